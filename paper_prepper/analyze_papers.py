@@ -1,19 +1,77 @@
 import asyncio
+import argparse
 import json
 import os
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from async_llm_handler import Handler
-from utils.bibtex_utils import get_bibtex_from_title
+from openai import OpenAI
+from utils.crossref_client import CrossrefClient
+from utils.rate_limiter import RateLimiter, estimate_tokens, is_rate_limit_error
+from utils.source_index import SourceIndex
+from utils.relevance_filter import RelevanceHistory, score_references
+from utils.chunking import chunk_document, count_tokens, fit_to_budget
+from utils.llm_cache import LLMCache, cache_key
+from utils.cost_estimator import RunEstimate, exceeds_budget
 import time
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Rate limiting settings
-MAX_REQUESTS_PER_MINUTE = 25
-REQUEST_INTERVAL = 60 / MAX_REQUESTS_PER_MINUTE
+# Rate limiting settings, shared by all concurrent reference analyses
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200000
+# Upper bound on analyses in flight; rate-limit responses halve the live limit
+MAX_CONCURRENCY = 8
+# Retries of a single reference after a rate-limit response
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Each reference is analyzed against only this many of the most relevant
+# sections of the source text (None sends the whole source text)
+TOP_K_SECTIONS = 4
+
+# References scoring below the prefilter threshold (TF-IDF cosine similarity to
+# the source text) are rejected without an LLM call. None calibrates the
+# threshold from past LLM decisions in PREFILTER_HISTORY_FILE; 0 disables it.
+PREFILTER_THRESHOLD = None
+PREFILTER_HISTORY_FILE = "prefilter_history.json"
+
+# References longer than this many tokens are analyzed in chunks (map-reduce)
+REFERENCE_CHUNK_TOKENS = 12000
+# Most reference tokens sent for one reference across all of its chunks
+REFERENCE_TOKEN_BUDGET = 48000
+
+# Short references are packed several to a request so the instructions and
+# source excerpt are paid once per pack. A pack's prompt stays under
+# PACK_TOKEN_BUDGET tokens; references over PACK_MAX_REFERENCE_TOKENS go alone.
+PACK_REFERENCES = True
+PACK_TOKEN_BUDGET = 30000
+PACK_MAX_REFERENCES = 6
+PACK_MAX_REFERENCE_TOKENS = 4000
+
+# Batch API mode: requests are written to a JSONL file in the reference folder,
+# submitted, polled every BATCH_POLL_INTERVAL seconds and ingested on completion.
+# The batch id and request mapping are kept in BATCH_INFO_FILENAME so an
+# interrupted run can be resumed with --resume.
+BATCH_MODEL = "gpt-4o-mini"
+BATCH_INPUT_FILENAME = "citation_batch_input.jsonl"
+BATCH_INFO_FILENAME = "citation_batch_info.json"
+BATCH_POLL_INTERVAL = 60
+
+# Responses are cached by a hash of model and prompt, so re-runs only pay for
+# prompts that changed. The cache file lives in the reference folder.
+LLM_CACHE_FILENAME = "llm_cache.sqlite"
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Crossref lookups (query -> DOI, DOI -> BibTeX) are cached here, in the reference folder
+CROSSREF_CACHE_FILENAME = "crossref_cache.sqlite"
+
+# Typical length of a reference decision, for the pre-flight cost estimate
+EXPECTED_OUTPUT_TOKENS = 300
+
+# Replaced by process_references; disabled until then
+llm_cache = LLMCache(None)
 
 async def load_text_file(file_path: str) -> str:
     logger.info(f"Loading text file: {file_path}")
@@ -26,63 +84,98 @@ async def load_text_file(file_path: str) -> str:
         logger.error(f"Error loading file {file_path}: {str(e)}")
         raise
 
-async def analyze_reference(handler: Handler, source_text: str, reference_text: str, reference_file: str) -> Dict:
-    logger.info(f"Analyzing reference: {reference_file}")
-    
-    prompt = f"""
+def cache_response(key: str, response: str, **kwargs) -> None:
+    """Store a response, skipping malformed JSON so a bad answer is not replayed on every run."""
+    if kwargs.get('json_mode'):
+        try:
+            json.loads(response)
+        except (TypeError, ValueError):
+            return
+    llm_cache.put(key, response, model=kwargs.get('model', ''))
+
+async def query_llm(handler: Handler, prompt: str, limiter: Optional[RateLimiter] = None, **kwargs) -> str:
+    """
+    Send one prompt through the shared limiter, backing off and retrying on
+    rate-limit responses. Identical prompts are answered from the response cache.
+    """
+    key = cache_key(kwargs.get('model', ''), [{"role": "user", "content": prompt}],
+                    {"json_mode": kwargs.get('json_mode', False)}, kwargs.get('temperature'))
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    if limiter is None:
+        response = await handler.query(prompt, **kwargs)
+        cache_response(key, response, **kwargs)
+        return response
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        try:
+            async with limiter.slot(estimate_tokens(prompt)):
+                response = await handler.query(prompt, **kwargs)
+            await limiter.on_success()
+            cache_response(key, response, **kwargs)
+            return response
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                raise
+            await limiter.on_rate_limit()
+            wait_time = 2 ** attempt
+            logger.warning(f"Rate limited (attempt {attempt + 1}); retrying in {wait_time}s")
+            await asyncio.sleep(wait_time)
+
+REFERENCE_INSTRUCTIONS = """
     Analyze the provided source text and reference text to determine if the reference should be cited. 
     Return a JSON object with the following structure:
 
-    {{
+    {
         "title": "Paper title",
         "authors": ["Author 1", "Author 2"],
         "year": YYYY,
         "doi": "DOI if available",
-        "analysis": {{
+        "analysis": {
             "include": 0 or 1,
             "section": "Section name",
             "paragraph": "First 5 words of the paragraph",
             "after_line": "First 5 words of the line",
             "explanation": "Detailed explanation of why this paper should be included, where it fits in the review, and what point it supports"
-        }},
+        },
         "relevant_quotes": [
             "Quote 1",
             "Quote 2",
             "Quote 3"
         ],
         "bibtex": "BibTeX entry"
-    }}
+    }
     
     Here is what a good acceptance might look like:
     
-        {{
+        {
     "title": "Machine Learning Approaches for IoT Security: A Comprehensive Survey",
     "authors": ["John Doe", "Jane Smith"],
     "year": 2022,
     "doi": "10.1234/example.doi.2022",
-    "analysis": {{
+    "analysis": {
         "include": 1,
         "section": "Security Challenges in IoT",
         "paragraph": "One of the primary concerns",
         "after_line": "Various security threats in IoT",
         "explanation": "This paper should be included in the review as it provides a comprehensive survey of machine learning approaches specifically tailored for IoT security. It fits well in the 'Security Challenges in IoT' section, supporting the point that machine learning can be effectively used to address various security threats in IoT systems. The paper's findings on the effectiveness of different ML algorithms for threat detection and prevention would significantly strengthen our argument about the importance of advanced security measures in IoT environments."
-    }},
+    },
     "relevant_quotes": [
         "Our survey reveals that supervised learning techniques, particularly deep learning models, show promising results in detecting and classifying IoT security threats.",
         "The study found that ensemble methods combining multiple ML algorithms outperform single-algorithm approaches in IoT intrusion detection systems.",
         "Despite the advantages, the survey highlights challenges in implementing ML-based security solutions in resource-constrained IoT devices, emphasizing the need for lightweight algorithms."
     ],
-    "bibtex": "@article{{doe2022machine,\n  title={{Machine Learning Approaches for IoT Security: A Comprehensive Survey}},\n  author={{Doe, John and Smith, Jane}},\n  journal={{Journal of IoT Security}},\n  year={{2022}},\n  publisher={{Example Publisher}}\n}}"
-    }}
+    "bibtex": "@article{doe2022machine,\n  title={Machine Learning Approaches for IoT Security: A Comprehensive Survey},\n  author={Doe, John and Smith, Jane},\n  journal={Journal of IoT Security},\n  year={2022},\n  publisher={Example Publisher}\n}"
+    }
     
     And here is what a good rejection might look like:
     
-        {{
+        {
     "title": "Energy-Efficient Machine Learning Algorithms for IoT Devices",
     "authors": null,
     "year": null,
     "doi": null,
-    "analysis": {{
+    "analysis": {
         "include": 0,
         "section": "IoT and Machine Learning Integration",
         "paragraph": "Challenges in implementing ML on",
@@ -94,10 +187,10 @@ async def analyze_reference(handler: Handler, source_text: str, reference_text:
         Furthermore, the paper's focus is quite narrow, dealing specifically with energy efficiency in ML algorithms, while our review aims to provide a broader overview of IoT and ML integration challenges and solutions. Including this paper might skew the balance of our review towards energy efficiency at the expense of other equally important aspects.
 
         In summary, while the paper is of good quality and relevant to our topic, its contributions are not sufficiently novel or impactful to justify expanding our already well-rounded review. It would be more appropriate to reference this work in a more specialized survey focusing specifically on energy efficiency in IoT-based machine learning systems."
-    }},
+    },
     "relevant_quotes": null,
     "bibtex": null
-    }}
+    }
     
     It is just as important to reject references as it is to accept them.
 
@@ -110,22 +203,79 @@ async def analyze_reference(handler: Handler, source_text: str, reference_text:
     6. In the explanation, provide a detailed rationale for including the paper, specifying where it fits in the review and what point it supports.
 
     Your task is to enhance the source text with only the most pertinent and impactful references. Reject any reference that doesn't significantly strengthen or expand upon the source text's content.
+"""
 
-    Source text:
+def build_reference_prompt(source_text: str, reference_text: str) -> str:
+    return f"""{REFERENCE_INSTRUCTIONS}
+    Source text (only the sections most relevant to this reference; "[...]" marks omitted sections. Quote section names and paragraph openings exactly as they appear here):
     {source_text}
 
     Reference text:
     {reference_text}
     """
 
+def merge_reference_decisions(partials: List[Dict]) -> Dict:
+    """
+    Reduce per-chunk citation decisions to one. The reference is included if
+    any chunk makes the case for it; bibliographic fields come from the first
+    chunk that has them (normally the front matter) and quotes are pooled
+    from the accepting chunks.
+    """
+    accepted = [p for p in partials if (p.get('analysis') or {}).get('include') == 1]
+    chosen = accepted or [p for p in partials if isinstance(p.get('analysis'), dict)] or partials
+    result = dict(max(chosen, key=lambda p: len((p.get('analysis') or {}).get('explanation') or '')))
+    for key in ('title', 'authors', 'year', 'doi'):
+        result[key] = next((p[key] for p in partials if p.get(key)), None)
+    if accepted:
+        quotes = [q for p in accepted for q in (p.get('relevant_quotes') or [])]
+        result['relevant_quotes'] = list(dict.fromkeys(quotes))[:3]
+    return result
+
+async def analyze_reference_chunks(handler: Handler, source_text: str, reference_text: str, reference_file: str,
+                                   limiter: Optional[RateLimiter] = None) -> Dict:
+    """Map the citation prompt over token-bounded chunks of a long reference, then merge the decisions."""
+    chunks = fit_to_budget(chunk_document(reference_text, REFERENCE_CHUNK_TOKENS), REFERENCE_TOKEN_BUDGET)
+    logger.info(f"{reference_file} is long; analyzing it in {len(chunks)} chunks")
+    prompts = [
+        build_reference_prompt(source_text, f"[Part {i + 1} of {len(chunks)} of the reference]\n\n{chunk.text}")
+        for i, chunk in enumerate(chunks)
+    ]
+    responses = await asyncio.gather(
+        *(query_llm(handler, prompt, limiter, model="gpt_4o_mini", json_mode=True) for prompt in prompts),
+        return_exceptions=True,
+    )
+    partials = []
+    for i, response in enumerate(responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            partials.append(json.loads(response))
+        except Exception as e:
+            logger.warning(f"Chunk {i + 1} of {reference_file} failed: {str(e)}")
+    if not partials:
+        raise RuntimeError(f"All {len(chunks)} chunks failed")
+    return merge_reference_decisions(partials)
+
+async def analyze_reference(handler: Handler, source_text: str, reference_text: str, reference_file: str,
+                            limiter: Optional[RateLimiter] = None) -> Dict:
+    logger.info(f"Analyzing reference: {reference_file}")
+
     try:
-        response = await handler.query(prompt, model="gpt_4o_mini", json_mode=True)
-        result = json.loads(response)
+        if count_tokens(reference_text) > REFERENCE_CHUNK_TOKENS:
+            result = await analyze_reference_chunks(handler, source_text, reference_text, reference_file, limiter)
+        else:
+            prompt = build_reference_prompt(source_text, reference_text)
+            response = await query_llm(handler, prompt, limiter, model="gpt_4o_mini", json_mode=True)
+            result = json.loads(response)
         logger.debug(f"Successfully analyzed reference: {reference_file}")
+        # Inside the try: a null or malformed "analysis" fails this reference only
+        return finalize_reference_result(result, reference_file)
     except Exception as e:
         logger.error(f"Error analyzing reference {reference_file}: {str(e)}")
         return None
 
+def finalize_reference_result(result: Dict, reference_file: str) -> Dict:
+    """Blank the fields of a rejection; acceptances get their BibTeX later, in add_bibtex."""
     if result['analysis']['include'] == 0:
         logger.info(f"Reference rejected: {reference_file}")
         result = {
@@ -137,18 +287,196 @@ async def analyze_reference(handler: Handler, source_text: str, reference_text:
             "relevant_quotes": None,
             "bibtex": None
         }
-    elif result.get('title') and result.get('authors') and result.get('year'):
+    else:
         logger.info(f"Reference accepted: {reference_file}")
-        try:
-            result['bibtex'] = get_bibtex_from_title(result['title'], result['authors'], result['year'])
-        except Exception as e:
-            logger.warning(f"Failed to generate BibTeX for {result['title']}: {str(e)}")
-    
     return result
 
-async def process_references(source_file: str, reference_folder: str, output_file: str):
+async def add_bibtex(results: List[Dict], reference_folder: str) -> None:
+    """Replace the BibTeX of every accepted reference with Crossref's, looked up concurrently in one pass."""
+    accepted = [r for r in results
+                if r['analysis']['include'] == 1 and r.get('title') and r.get('authors') and r.get('year')]
+    if not accepted:
+        return
+    async with CrossrefClient(os.path.join(reference_folder, CROSSREF_CACHE_FILENAME)) as crossref:
+        entries = await crossref.bibtex_many([(r['title'], r['authors'], r['year']) for r in accepted])
+    for result, bibtex in zip(accepted, entries):
+        result['bibtex'] = bibtex
+
+PACKED_INSTRUCTIONS = """
+    PACKED REQUEST: This request contains several references, each between "=== Reference <id> ===" markers. Decide on each one independently, exactly as you would if it were the only reference, applying all of the instructions above to it.
+    Return a JSON object of the form {"decisions": [...]} holding exactly one object per reference, in the order given. Each object has the structure described above plus a "reference_id" field set to the reference's id.
+"""
+
+def build_packed_prompt(source_text: str, packed: List[Tuple[str, str]]) -> str:
+    """One prompt for several (reference_id, text) pairs that share the instructions and source excerpt."""
+    reference_blocks = "\n\n".join(f"=== Reference {ref_id} ===\n{text}" for ref_id, text in packed)
+    return f"""{REFERENCE_INSTRUCTIONS}{PACKED_INSTRUCTIONS}
+    Source text (only the sections most relevant to these references; "[...]" marks omitted sections. Quote section names and paragraph openings exactly as they appear here):
+    {source_text}
+
+    References:
+    {reference_blocks}
+    """
+
+def parse_packed_response(response: str, reference_ids: List[str]) -> Dict[str, Dict]:
+    """
+    Decisions by reference id. Raises ValueError if the response is not the
+    expected JSON; decisions that are malformed or for unknown ids are dropped.
+    """
+    data = json.loads(response)
+    decisions = data.get('decisions') if isinstance(data, dict) else None
+    if not isinstance(decisions, list):
+        raise ValueError("Packed response has no 'decisions' list")
+    valid = {}
+    for decision in decisions:
+        if not isinstance(decision, dict):
+            continue
+        ref_id = decision.pop('reference_id', None)
+        analysis = decision.get('analysis')
+        if ref_id in reference_ids and ref_id not in valid and isinstance(analysis, dict) \
+                and analysis.get('include') in (0, 1):
+            valid[ref_id] = decision
+    return valid
+
+def pack_source_text(source_text: str, source_index: Optional[SourceIndex], texts: List[str], top_sections=None) -> str:
+    """Union of the most relevant source sections for all texts in a pack."""
+    if source_index is None or not TOP_K_SECTIONS:
+        return source_text
+    sections = {}
+    for i, text in enumerate(texts):
+        matched = top_sections[i] if top_sections else source_index.top_sections(text, TOP_K_SECTIONS)
+        for section in matched:
+            sections[section.position] = section
+    return source_index.render([sections[position] for position in sorted(sections)])
+
+def plan_packs(source_text: str, references: Dict[str, str],
+               source_index: Optional[SourceIndex] = None) -> Tuple[List[List[str]], List[str]]:
+    """
+    Group short references into packs under PACK_TOKEN_BUDGET. References are
+    ordered by the source sections they match so packs share their excerpt.
+    Returns the packs and the references to analyze on their own.
+    """
+    if not PACK_REFERENCES:
+        return [], list(references)
+    singles = [f for f, text in references.items() if count_tokens(text) > PACK_MAX_REFERENCE_TOKENS]
+    candidates = [f for f in references if f not in singles]
+    matched = {}
+    if source_index is not None and TOP_K_SECTIONS:
+        matched = {f: source_index.top_sections(references[f], TOP_K_SECTIONS) for f in candidates}
+        candidates.sort(key=lambda f: tuple(s.position for s in matched[f]))
+    overhead = count_tokens(REFERENCE_INSTRUCTIONS) + count_tokens(PACKED_INSTRUCTIONS)
+
+    packs, current = [], []
+    for ref_file in candidates:
+        trial = current + [ref_file]
+        texts = [references[f] for f in trial]
+        excerpt = pack_source_text(source_text, source_index, texts, [matched[f] for f in trial] if matched else None)
+        tokens = overhead + count_tokens(excerpt) + sum(count_tokens(t) for t in texts)
+        if current and (len(trial) > PACK_MAX_REFERENCES or tokens > PACK_TOKEN_BUDGET):
+            packs.append(current)
+            current = [ref_file]
+        else:
+            current = trial
+    if current:
+        packs.append(current)
+    singles.extend(pack[0] for pack in packs if len(pack) == 1)
+    return [pack for pack in packs if len(pack) > 1], singles
+
+async def analyze_reference_pack(handler: Handler, source_text: str, references: Dict[str, str], pack: List[str],
+                                 limiter: RateLimiter, source_index: Optional[SourceIndex] = None) -> Dict[str, Optional[Dict]]:
+    """Analyze a pack in one request; references missing from the response fall back to single calls."""
+    ids = {f"R{i + 1}": ref_file for i, ref_file in enumerate(pack)}
+    excerpt = pack_source_text(source_text, source_index, [references[f] for f in pack])
+    prompt = build_packed_prompt(excerpt, [(ref_id, references[ref_file]) for ref_id, ref_file in ids.items()])
+    decisions = {}
+    try:
+        response = await query_llm(handler, prompt, limiter, model="gpt_4o_mini", json_mode=True)
+        decisions = parse_packed_response(response, list(ids))
+    except Exception as e:
+        logger.warning(f"Packed request for {len(pack)} references failed ({str(e)}); falling back to single calls")
+
+    results = {}
+    for ref_id, ref_file in ids.items():
+        if ref_id in decisions:
+            logger.info(f"Analyzed reference in pack: {ref_file}")
+            results[ref_file] = finalize_reference_result(decisions[ref_id], ref_file)
+    missing = [ref_file for ref_id, ref_file in ids.items() if ref_id not in decisions]
+    if missing and decisions:
+        logger.warning(f"Packed response omitted {len(missing)} of {len(pack)} references; analyzing them singly")
+    fallbacks = await asyncio.gather(*(
+        analyze_reference_file(handler, source_text, references[ref_file], ref_file, limiter, source_index)
+        for ref_file in missing
+    ))
+    results.update(zip(missing, fallbacks))
+    return results
+
+def prefilter_rejection(title: str, score: float, threshold: float) -> Dict:
+    """Rejection in the same shape as an LLM rejection, for references the prefilter skipped."""
+    return {
+        "title": title,
+        "authors": None,
+        "year": None,
+        "doi": None,
+        "analysis": {
+            "include": 0,
+            "section": None,
+            "paragraph": None,
+            "after_line": None,
+            "explanation": f"Auto-rejected by the relevance prefilter (score {score:.4f} < threshold {threshold:.4f})",
+        },
+        "relevant_quotes": None,
+        "bibtex": None,
+        "prefilter_score": round(float(score), 6),
+    }
+
+async def analyze_reference_file(handler: Handler, source_text: str, ref_text: str, ref_file: str,
+                                 limiter: RateLimiter, source_index: Optional[SourceIndex] = None) -> Optional[Dict]:
+    try:
+        if source_index is not None and TOP_K_SECTIONS:
+            excerpt = source_index.relevant_text(ref_text, TOP_K_SECTIONS)
+            logger.debug(f"{ref_file}: sending {len(excerpt)} of {len(source_text)} source characters")
+        else:
+            excerpt = source_text
+        return await analyze_reference(handler, excerpt, ref_text, ref_file, limiter)
+    except Exception as e:
+        logger.error(f"Error processing reference file {ref_file}: {str(e)}")
+        return None
+
+async def analyze_references_concurrently(handler: Handler, source_text: str, references: Dict[str, str],
+                                          limiter: RateLimiter,
+                                          source_index: Optional[SourceIndex] = None) -> List[Optional[Dict]]:
+    """Analyze references (file name -> text) concurrently; results come back in the order of `references`."""
+    start_time = time.monotonic()
+    reference_files = list(references)
+    packs, singles = plan_packs(source_text, references, source_index)
+    if packs:
+        logger.info(f"Packed {sum(len(p) for p in packs)} references into {len(packs)} requests; {len(singles)} go alone")
+    pack_results, single_results = await asyncio.gather(
+        asyncio.gather(*(analyze_reference_pack(handler, source_text, references, pack, limiter, source_index)
+                         for pack in packs)),
+        asyncio.gather(*(analyze_reference_file(handler, source_text, references[ref_file], ref_file, limiter, source_index)
+                         for ref_file in singles)),
+    )
+    by_file = dict(zip(singles, single_results))
+    for pack_result in pack_results:
+        by_file.update(pack_result)
+    results = [by_file.get(ref_file) for ref_file in reference_files]
+    elapsed = time.monotonic() - start_time
+    logger.info(f"Analyzed {len(reference_files)} references in {elapsed:.1f}s ({limiter.summary()})")
+    return results
+
+async def process_references(source_file: str, reference_folder: str, output_file: str,
+                             max_concurrency: int = MAX_CONCURRENCY, use_cache: bool = True,
+                             budget: Optional[float] = None):
+    global llm_cache
     logger.info("Starting reference processing")
+    llm_cache = LLMCache(os.path.join(reference_folder, LLM_CACHE_FILENAME), LLM_CACHE_MAX_BYTES, enabled=use_cache)
     handler = Handler()
+    limiter = RateLimiter(
+        requests_per_minute=MAX_REQUESTS_PER_MINUTE,
+        tokens_per_minute=MAX_TOKENS_PER_MINUTE,
+        max_concurrency=max_concurrency,
+    )
     
     try:
         source_text = await load_text_file(source_file)
@@ -156,24 +484,59 @@ async def process_references(source_file: str, reference_folder: str, output_fil
         logger.error(f"Failed to load source text. Aborting process. Error: {str(e)}")
         return
 
+    references = await load_references(reference_folder)
+    history = RelevanceHistory(os.path.join(reference_folder, PREFILTER_HISTORY_FILE))
+    references, prefiltered, scores = prefilter_references(source_text, references, history)
+
+    source_index = SourceIndex(source_text)
+    if budget is not None and exceeds_budget(estimate_citation_run(source_text, references, source_index),
+                                             BATCH_MODEL, budget):
+        llm_cache.close()
+        return
+    results = await analyze_references_concurrently(handler, source_text, references, limiter, source_index)
+    for ref_file, result in zip(references, results):
+        if result is not None:
+            history.record(ref_file, scores[ref_file], result['analysis']['include'])
+    history.save()
+    results = [result for result in results if result is not None] + prefiltered
+
+    logger.info(llm_cache.summary())
+    llm_cache.close()
+    await add_bibtex(results, reference_folder)
+    write_accepted_results(results, output_file)
+
+async def load_references(reference_folder: str) -> Dict[str, str]:
     reference_files = [f for f in os.listdir(reference_folder) if f.endswith('.txt')]
     logger.info(f"Found {len(reference_files)} reference files to process")
-
-    results = []
+    references = {}
     for ref_file in reference_files:
-        ref_path = os.path.join(reference_folder, ref_file)
         try:
-            ref_text = await load_text_file(ref_path)
-            result = await analyze_reference(handler, source_text, ref_text, ref_file)
-            if result is not None:
-                results.append(result)
-            await asyncio.sleep(REQUEST_INTERVAL)  # Rate limiting
+            references[ref_file] = await load_text_file(os.path.join(reference_folder, ref_file))
         except Exception as e:
             logger.error(f"Error processing reference file {ref_file}: {str(e)}")
+    return references
 
+def prefilter_references(source_text: str, references: Dict[str, str],
+                         history: RelevanceHistory) -> Tuple[Dict[str, str], List[Dict], Dict[str, float]]:
+    """
+    Cheap local prefilter: skip the LLM for references with little overlap with the source.
+    Returns the references to analyze, the prefilter rejections and every reference's score.
+    """
+    threshold = history.calibrated_threshold() if PREFILTER_THRESHOLD is None else PREFILTER_THRESHOLD
+    scores = dict(zip(references, score_references(source_text, list(references.values()))))
+    kept, prefiltered = {}, []
+    for ref_file, score in scores.items():
+        if score < threshold:
+            logger.info(f"Reference auto-rejected by prefilter: {ref_file} (score {score:.4f} < {threshold:.4f})")
+            prefiltered.append(prefilter_rejection(os.path.splitext(ref_file)[0], score, threshold))
+        else:
+            kept[ref_file] = references[ref_file]
+    logger.info(f"Prefilter rejected {len(prefiltered)} references; sending {len(kept)} to the LLM")
+    return kept, prefiltered, {ref_file: float(score) for ref_file, score in scores.items()}
+
+def write_accepted_results(results: List[Dict], output_file: str) -> None:
     accepted_results = [result for result in results if result['analysis']['include'] == 1]
     logger.info(f"Accepted {len(accepted_results)} out of {len(results)} references")
-
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(accepted_results, f, indent=2, ensure_ascii=False)
@@ -181,11 +544,204 @@ async def process_references(source_file: str, reference_folder: str, output_fil
     except Exception as e:
         logger.error(f"Error writing results to {output_file}: {str(e)}")
 
+def estimate_citation_run(source_text: str, references: Dict[str, str],
+                          source_index: Optional[SourceIndex] = None) -> RunEstimate:
+    """
+    Token counts of one request per reference (or per chunk), the requests batch
+    mode sends. Realtime mode packs short references, so this is its upper bound.
+    """
+    requests, mapping = build_batch_requests(source_text, references, source_index)
+    prompts: Dict[str, List[str]] = {ref_file: [] for ref_file in references}
+    for request in requests:
+        prompts[mapping[request['custom_id']][0]].append(request['body']['messages'][0]['content'])
+    return RunEstimate.from_prompts(list(prompts), list(prompts.values()), EXPECTED_OUTPUT_TOKENS)
+
+async def estimate_references(source_file: str, reference_folder: str, batch: bool = False) -> None:
+    """Dry run: load and prefilter the references and report the projected tokens and cost."""
+    source_text = await load_text_file(source_file)
+    references = await load_references(reference_folder)
+    history = RelevanceHistory(os.path.join(reference_folder, PREFILTER_HISTORY_FILE))
+    references, _, _ = prefilter_references(source_text, references, history)
+    estimate = estimate_citation_run(source_text, references, SourceIndex(source_text))
+    print(estimate.report(BATCH_MODEL, batch=batch))
+
+def build_batch_requests(source_text: str, references: Dict[str, str],
+                         source_index: Optional[SourceIndex] = None) -> Tuple[List[Dict], Dict[str, List]]:
+    """
+    One chat-completion request per reference, or per chunk of a long reference.
+    Returns the requests and a mapping of custom_id to [reference file, chunk index, chunk count].
+    """
+    requests, mapping = [], {}
+    for ref_index, (ref_file, ref_text) in enumerate(references.items()):
+        excerpt = source_index.relevant_text(ref_text, TOP_K_SECTIONS) if source_index is not None and TOP_K_SECTIONS else source_text
+        if count_tokens(ref_text) > REFERENCE_CHUNK_TOKENS:
+            chunks = fit_to_budget(chunk_document(ref_text, REFERENCE_CHUNK_TOKENS), REFERENCE_TOKEN_BUDGET)
+            parts = [f"[Part {i + 1} of {len(chunks)} of the reference]\n\n{chunk.text}" for i, chunk in enumerate(chunks)]
+        else:
+            parts = [ref_text]
+        for part_index, part in enumerate(parts):
+            custom_id = f"ref_{ref_index}_{part_index}"
+            mapping[custom_id] = [ref_file, part_index, len(parts)]
+            requests.append({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": BATCH_MODEL,
+                    "messages": [{"role": "user", "content": build_reference_prompt(excerpt, part)}],
+                    "response_format": {"type": "json_object"},
+                },
+            })
+    return requests, mapping
+
+def submit_citation_batch(client: OpenAI, requests: List[Dict], reference_folder: str) -> str:
+    batch_file_path = os.path.join(reference_folder, BATCH_INPUT_FILENAME)
+    with open(batch_file_path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    with open(batch_file_path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    logger.info(f"Submitted citation batch {batch.id} with {len(requests)} requests")
+    return batch.id
+
+async def wait_for_batch(client: OpenAI, batch_id: str):
+    """Poll a batch until it reaches a terminal status, logging progress."""
+    while True:
+        batch = await asyncio.to_thread(client.batches.retrieve, batch_id)
+        counts = batch.request_counts
+        progress = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+        logger.info(f"Batch {batch_id}: {batch.status} ({progress} requests done)")
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+
+def read_batch_output(client: OpenAI, batch) -> Dict[str, str]:
+    """Message content by custom_id for every successful request in the batch."""
+    outputs = {}
+    if batch.error_file_id:
+        errors = client.files.content(batch.error_file_id).text.splitlines()
+        logger.warning(f"Batch {batch.id} reported {len(errors)} failed requests")
+    if not batch.output_file_id:
+        return outputs
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        try:
+            response = json.loads(line)
+            outputs[response['custom_id']] = response['response']['body']['choices'][0]['message']['content']
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+            logger.error(f"Unreadable batch output line ({str(e)}): {line[:200]}")
+    return outputs
+
+async def ingest_citation_batch(outputs: Dict[str, str], mapping: Dict[str, List]) -> Dict[str, Optional[Dict]]:
+    """Parse, merge chunked decisions and finalize the batch results per reference file."""
+    partials: Dict[str, List[Dict]] = {}
+    for custom_id, (ref_file, _, _) in mapping.items():
+        partials.setdefault(ref_file, [])
+        if custom_id not in outputs:
+            continue
+        try:
+            partials[ref_file].append(json.loads(outputs[custom_id]))
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid JSON in batch response {custom_id} for {ref_file}: {str(e)}")
+
+    async def finalize(ref_file: str, decisions: List[Dict]) -> Optional[Dict]:
+        if not decisions:
+            logger.error(f"No usable batch response for reference {ref_file}")
+            return None
+        try:
+            result = decisions[0] if len(decisions) == 1 else merge_reference_decisions(decisions)
+            return finalize_reference_result(result, ref_file)
+        except Exception as e:
+            logger.error(f"Error processing batch result for {ref_file}: {str(e)}")
+            return None
+
+    ref_files = list(partials)
+    results = await asyncio.gather(*(finalize(ref_file, partials[ref_file]) for ref_file in ref_files))
+    return dict(zip(ref_files, results))
+
+async def process_references_batch(source_file: str, reference_folder: str, output_file: str, resume: bool = False,
+                                   budget: Optional[float] = None):
+    """Citation analysis through the OpenAI Batch API, ingested into the same accepted-references output."""
+    logger.info("Starting reference processing in batch mode")
+    client = OpenAI()
+    info_path = os.path.join(reference_folder, BATCH_INFO_FILENAME)
+    history = RelevanceHistory(os.path.join(reference_folder, PREFILTER_HISTORY_FILE))
+
+    if resume:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        logger.info(f"Resuming citation batch {info['batch_id']}")
+    else:
+        try:
+            source_text = await load_text_file(source_file)
+        except Exception as e:
+            logger.error(f"Failed to load source text. Aborting process. Error: {str(e)}")
+            return
+        references = await load_references(reference_folder)
+        references, prefiltered, scores = prefilter_references(source_text, references, history)
+        if not references:
+            write_accepted_results(prefiltered, output_file)
+            return
+        requests, mapping = build_batch_requests(source_text, references, SourceIndex(source_text))
+        estimate = RunEstimate.from_prompts([r['custom_id'] for r in requests],
+                                            [[r['body']['messages'][0]['content']] for r in requests],
+                                            EXPECTED_OUTPUT_TOKENS)
+        if exceeds_budget(estimate, BATCH_MODEL, budget, batch=True):
+            return
+        batch_id = await asyncio.to_thread(submit_citation_batch, client, requests, reference_folder)
+        info = {"batch_id": batch_id, "mapping": mapping, "scores": scores, "prefiltered": prefiltered}
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=2)
+        logger.info(f"Batch information stored in: {info_path}")
+
+    batch = await wait_for_batch(client, info['batch_id'])
+    if batch.status != "completed":
+        if not batch.output_file_id:
+            logger.error(f"Batch {batch.id} ended with status {batch.status}; no results to ingest")
+            return
+        # Expired and cancelled batches keep the requests that finished before the cutoff
+        logger.warning(f"Batch {batch.id} ended with status {batch.status}; ingesting its partial output")
+    outputs = await asyncio.to_thread(read_batch_output, client, batch)
+    missing = [custom_id for custom_id in info['mapping'] if custom_id not in outputs]
+    if missing:
+        logger.warning(f"{len(missing)} of {len(info['mapping'])} batch requests have no output: {', '.join(missing)}")
+    by_file = await ingest_citation_batch(outputs, info['mapping'])
+    for ref_file, result in by_file.items():
+        if result is not None:
+            history.record(ref_file, info['scores'][ref_file], result['analysis']['include'])
+    history.save()
+    results = [result for result in by_file.values() if result is not None] + info['prefiltered']
+    await add_bibtex(results, reference_folder)
+    write_accepted_results(results, output_file)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decide which reference papers to cite in the source text.")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and do not update the LLM response cache")
+    parser.add_argument("--mode", choices=["realtime", "batch"], default="realtime",
+                        help="'realtime' for concurrent API calls or 'batch' for the OpenAI Batch API")
+    parser.add_argument("--resume", action="store_true",
+                        help="Batch mode: wait for and ingest the batch recorded in the reference folder instead of submitting a new one")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Report projected tokens, cost and context-limit overflows without calling the model")
+    parser.add_argument("--budget", type=float,
+                        help="Do not send anything when the projected cost in USD exceeds this amount")
+    args = parser.parse_args()
+
     source_file = r"C:\Users\bnsoh2\OneDrive - University of Nebraska-Lincoln\Projects\Students\Bryan Nsoh\Papers\Real-Time-IoT-ML\Draft7\full_papers\source_text.txt.txt"
     reference_folder = r"C:\Users\bnsoh2\OneDrive - University of Nebraska-Lincoln\Projects\Students\Bryan Nsoh\Papers\Real-Time-IoT-ML\Draft7\full_papers"
     output_file = os.path.join(reference_folder, "citation_analysis.json")
 
     logger.info("Citation analyzer started")
-    asyncio.run(process_references(source_file, reference_folder, output_file))
+    if args.estimate:
+        asyncio.run(estimate_references(source_file, reference_folder, batch=args.mode == "batch"))
+    elif args.mode == "batch":
+        asyncio.run(process_references_batch(source_file, reference_folder, output_file, resume=args.resume,
+                                             budget=args.budget))
+    else:
+        asyncio.run(process_references(source_file, reference_folder, output_file, use_cache=not args.no_cache,
+                                       budget=args.budget))
     logger.info("Citation analyzer finished")
\ No newline at end of file
@@ -7,6 +7,9 @@ import aiohttp
 from pathlib import Path
 from typing import List, Dict, Tuple
 from utils.slow_scraper import UnifiedWebScraper  # Adjust the import path if necessary
+from utils.scrape_budget import ScrapeBudget
+from utils.link_ranker import LinkStats
+from utils.doi_index import open_default_index, indexed_urls
 
 # ============================
 # Configuration Section
@@ -33,6 +36,31 @@ MAX_RETRIES = 3
 # Initial timeout in seconds for page loading and interactions
 INITIAL_TIMEOUT = 60
 
+# Wall-clock budget in seconds for all links of one paper (None = unlimited)
+PAPER_BUDGET = 20 * 60
+
+# Wall-clock budget in seconds for a single link, within the paper budget (None = unlimited)
+URL_BUDGET = 8 * 60
+
+# A paper is finished at the first link whose content reaches this many words;
+# results between MIN_WORDS and this bar are kept while the next links are tried
+GOOD_ENOUGH_WORDS = 2000
+
+# Scrape the links skipped by the good-enough rule after all primary work is
+# done, saving them under <folder>/alternates for manual comparison
+COLLECT_ALTERNATES = False
+
+# Observed success per domain and link type, used to order each paper's links
+LINK_STATS_FILE = os.path.join("scraper_logs", "link_stats.json")
+
+# Papers left without a PDF because a domain's circuit was open are retried
+# after the batch, at most this many times
+DEFERRED_RETRY_ROUNDS = 3
+
+# Offline metadata index built with `python -m utils.doi_index`; open-access
+# locations it knows for a paper's DOI links are tried before the links themselves
+DOI_INDEX_FILE = os.getenv("DOI_INDEX_PATH")
+
 # ============================
 # Logging Configuration
 # ============================
@@ -98,6 +126,128 @@ def collect_papers_from_json(file_path: str) -> Dict[str, List[str]]:
         logging.error(f"Failed to extract papers from JSON file {file_path}: {str(e)}")
         return {}
 
+# ============================
+# Per-Paper Scraping
+# ============================
+
+async def scrape_paper(scraper, paper_key: str, links: List[str], link_stats: LinkStats) -> Tuple[str, int, List[str]]:
+    """
+    Try a paper's links in order of predicted success and stop at the first
+    result that clears GOOD_ENOUGH_WORDS.
+
+    Returns the best PDF path, its word count and the links that were not tried.
+    """
+    logger = logging.getLogger("scrape_papers")
+    best_word_count = -1
+    best_pdf_path = ""
+    paper_budget = ScrapeBudget(PAPER_BUDGET, label=paper_key)
+
+    ranked_links = link_stats.rank(links)
+    preferred = indexed_urls(open_default_index(DOI_INDEX_FILE), ranked_links)
+    if preferred:
+        logger.info(f"DOI index supplied {len(preferred)} open-access location(s) for {paper_key}")
+        ranked_links = preferred + ranked_links
+    logger.info(f"Link order for {paper_key}: {json.dumps(link_stats.describe(ranked_links), indent=2)}")
+
+    for index, link in enumerate(ranked_links):
+        if paper_budget.expired():
+            logger.warning(f"Budget exhausted for {paper_key}; skipping {len(ranked_links) - index} remaining links")
+            break
+        logger.info(f"Scraping link: {link}")
+        # Split what is left evenly over the links still to try
+        link_budget = paper_budget.sub_budget(share=1 / (len(ranked_links) - index), label=link)
+        content, pdf_path = await scraper.scrape(link, min_words=MIN_WORDS, max_retries=MAX_RETRIES, budget=link_budget)
+
+        success = bool(content and pdf_path)
+        if scraper.normalize_url(link) in scraper.deferred_urls:
+            # Not a verdict on the link itself, so keep it out of the stats
+            continue
+        link_stats.record(link, success)
+        if success:
+            word_count = len(content.split())
+            logger.info(f"Word count for URL {link}: {word_count}")
+
+            if word_count > best_word_count:
+                best_word_count = word_count
+                best_pdf_path = pdf_path
+
+            if word_count >= GOOD_ENOUGH_WORDS:
+                logger.info(f"{link} cleared the quality bar ({word_count} >= {GOOD_ENOUGH_WORDS} words); finishing {paper_key}")
+                logger.info(paper_budget.report())
+                return best_pdf_path, best_word_count, ranked_links[index + 1:]
+
+    logger.info(paper_budget.report())
+    return best_pdf_path, best_word_count, []
+
+
+def deferred_links(scraper, links: List[str]) -> List[str]:
+    """Links the scraper put aside because their domain's circuit was open."""
+    return [link for link in links if scraper.normalize_url(link) in scraper.deferred_urls]
+
+
+def save_best_pdf(paper_key: str, best_pdf_path: str, best_word_count: int, output_folder: Path) -> None:
+    logger = logging.getLogger("scrape_papers")
+    if best_pdf_path:
+        # Define the final PDF path with the paper_key as the filename
+        final_pdf_path = output_folder / f"{paper_key}.pdf"
+        try:
+            os.rename(best_pdf_path, final_pdf_path)
+            logger.info(f"Saved best PDF for {paper_key} at {final_pdf_path}")
+            print(f"\nPaper: {paper_key}\nStatus: Success\nWord count: {best_word_count}\nSaved as: {final_pdf_path}\n" + "-" * 80)
+        except Exception as e:
+            logger.error(f"Failed to rename/move PDF for {paper_key}: {str(e)}")
+    else:
+        logger.warning(f"No valid PDF found for paper: {paper_key}")
+        print(f"\nPaper: {paper_key}\nStatus: Failure (No valid PDF found)\n" + "-" * 80)
+
+
+async def retry_deferred_papers(scraper, deferred: Dict[str, Tuple[List[str], Path]], link_stats: LinkStats) -> None:
+    """Re-scrape papers whose links were deferred, once their domains admit a probe."""
+    logger = logging.getLogger("scrape_papers")
+    for round_number in range(1, DEFERRED_RETRY_ROUNDS + 1):
+        if not deferred:
+            return
+        all_links = [link for links, _ in deferred.values() for link in links]
+        delay = scraper.breaker.next_retry_delay(all_links)
+        logger.info(f"Deferred retry round {round_number} for {len(deferred)} papers in {delay:.0f}s. Circuits: {scraper.breaker.summary()}")
+        await asyncio.sleep(delay)
+        still_deferred = {}
+        for paper_key, (links, output_folder) in deferred.items():
+            for link in links:
+                scraper.deferred_urls.discard(scraper.normalize_url(link))
+            best_pdf_path, best_word_count, _ = await scrape_paper(scraper, paper_key, links, link_stats)
+            retry_links = deferred_links(scraper, links)
+            if not best_pdf_path and retry_links:
+                still_deferred[paper_key] = (retry_links, output_folder)
+            else:
+                save_best_pdf(paper_key, best_pdf_path, best_word_count, output_folder)
+        deferred = still_deferred
+    for paper_key, (links, output_folder) in deferred.items():
+        logger.warning(f"{paper_key} still deferred after {DEFERRED_RETRY_ROUNDS} rounds: {links}")
+        save_best_pdf(paper_key, "", -1, output_folder)
+
+
+async def collect_alternates(scraper, alternates: asyncio.Queue, primary_done: asyncio.Event, link_stats: LinkStats) -> None:
+    """Low-priority worker: scrape skipped links only once all primary scraping has finished."""
+    logger = logging.getLogger("scrape_papers")
+    await primary_done.wait()
+    while not alternates.empty():
+        paper_key, link, output_folder = alternates.get_nowait()
+        logger.info(f"Collecting alternate for {paper_key}: {link}")
+        content, pdf_path = await scraper.scrape(link, min_words=MIN_WORDS, max_retries=MAX_RETRIES)
+        link_stats.record(link, bool(content and pdf_path))
+        if content and pdf_path:
+            alternates_folder = output_folder / "alternates"
+            alternates_folder.mkdir(exist_ok=True)
+            existing = len(list(alternates_folder.glob(f"{paper_key}_alt*.pdf")))
+            final_pdf_path = alternates_folder / f"{paper_key}_alt{existing + 1}.pdf"
+            try:
+                os.replace(pdf_path, final_pdf_path)
+                logger.info(f"Saved alternate PDF for {paper_key} at {final_pdf_path} ({len(content.split())} words)")
+            except Exception as e:
+                logger.error(f"Failed to move alternate PDF for {paper_key}: {str(e)}")
+        alternates.task_done()
+
 # ============================
 # Main Scraping Function
 # ============================
@@ -114,7 +264,9 @@ async def scrape_papers():
         scraper = UnifiedWebScraper(
             session=session,
             max_concurrent_tasks=1,  # Process one URL at a time
-            initial_timeout=INITIAL_TIMEOUT
+            initial_timeout=INITIAL_TIMEOUT,
+            url_budget=URL_BUDGET,
+            deferred_retry_rounds=DEFERRED_RETRY_ROUNDS
         )
         try:
             await scraper.initialize()
@@ -122,6 +274,14 @@ async def scrape_papers():
             logger.error(f"Failed to initialize scraper: {str(e)}")
             return
 
+        link_stats = LinkStats(LINK_STATS_FILE)
+        alternates = asyncio.Queue()
+        primary_done = asyncio.Event()
+        alternates_task = None
+        deferred_papers = {}
+        if COLLECT_ALTERNATES:
+            alternates_task = asyncio.create_task(collect_alternates(scraper, alternates, primary_done, link_stats))
+
         # Iterate through each source folder
         for folder in SOURCE_FOLDERS:
             folder_path = Path(folder)
@@ -158,35 +318,25 @@ async def scrape_papers():
             # Process each paper
             for paper_key, links in papers.items():
                 logger.info(f"Processing paper: {paper_key}")
-                best_word_count = -1
-                best_pdf_path = ""
-
-                for link in links:
-                    logger.info(f"Scraping link: {link}")
-                    content, pdf_path = await scraper.scrape(link, min_words=MIN_WORDS, max_retries=MAX_RETRIES)
-
-                    if content and pdf_path:
-                        word_count = len(content.split())
-                        logger.info(f"Word count for URL {link}: {word_count}")
-
-                        if word_count > best_word_count:
-                            best_word_count = word_count
-                            best_pdf_path = pdf_path
-
-                if best_pdf_path:
-                    # Define the final PDF path with the paper_key as the filename
-                    final_pdf_path = source_output_folder / f"{paper_key}.pdf"
-                    try:
-                        os.rename(best_pdf_path, final_pdf_path)
-                        logger.info(f"Saved best PDF for {paper_key} at {final_pdf_path}")
-                        print(f"\nPaper: {paper_key}\nStatus: Success\nWord count: {best_word_count}\nSaved as: {final_pdf_path}\n" + "-" * 80)
-                    except Exception as e:
-                        logger.error(f"Failed to rename/move PDF for {paper_key}: {str(e)}")
-                else:
-                    logger.warning(f"No valid PDF found for paper: {paper_key}")
-                    print(f"\nPaper: {paper_key}\nStatus: Failure (No valid PDF found)\n" + "-" * 80)
+                best_pdf_path, best_word_count, skipped_links = await scrape_paper(scraper, paper_key, links, link_stats)
+                if COLLECT_ALTERNATES:
+                    for link in skipped_links:
+                        alternates.put_nowait((paper_key, link, source_output_folder))
+
+                retry_links = deferred_links(scraper, links)
+                if not best_pdf_path and retry_links:
+                    logger.info(f"Deferring {paper_key}: circuit open for {len(retry_links)} of its links")
+                    deferred_papers[paper_key] = (retry_links, source_output_folder)
+                    continue
+                save_best_pdf(paper_key, best_pdf_path, best_word_count, source_output_folder)
 
         # After processing all folders
+        await retry_deferred_papers(scraper, deferred_papers, link_stats)
+        primary_done.set()
+        if alternates_task:
+            logger.info(f"Collecting {alternates.qsize()} alternate links")
+            await alternates_task
+        link_stats.save()
         await scraper.close()
         logger.info("Completed scraping all sources.")
 
@@ -0,0 +1,7 @@
+# paper_prepper/tests/conftest.py
+
+import os
+import sys
+
+# Modules import each other as utils.x, relative to the paper_prepper directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,52 @@
+# paper_prepper/tests/test_page_classifier.py
+
+from utils.page_classifier import classify_page, extract_dom_signals, FULL_TEXT, PAYWALL, CAPTCHA
+from utils.html_extractor import extract_text_from_html
+
+SECTIONS = ["Introduction", "Materials and Methods", "Results", "Discussion", "Conclusions"]
+
+
+def full_text_page(head_extra: str = "") -> str:
+    paragraphs = []
+    for heading in SECTIONS:
+        paragraphs.append(f"<h2>{heading}</h2>")
+        paragraphs.extend(
+            f"<p>Soil moisture sensors and irrigation scheduling were evaluated in plot {i}, "
+            f"with water use and crop yield recorded over the growing season.</p>"
+            for i in range(18)
+        )
+    return f"<html><head>{head_extra}</head><body><article>{''.join(paragraphs)}</article></body></html>"
+
+
+SCRIPT_NOISE = (
+    '<script>window.__cfg={paywallEnabled:false, captchaProvider:"turnstile"};</script>'
+    '<script src="https://challenges.cloudflare.com/turnstile/v0/api.js" async defer></script>'
+)
+
+
+def test_script_markers_are_not_dom_signals():
+    signals = extract_dom_signals(full_text_page(SCRIPT_NOISE))
+    assert signals['paywall_elements'] == 0
+    assert signals['captcha_elements'] == 0
+
+
+def test_full_text_page_with_markers_in_scripts_is_full_text():
+    html = full_text_page(SCRIPT_NOISE)
+    text = extract_text_from_html(html)
+    assert len(text.split()) > 1500
+    assert classify_page(text, dom_signals=extract_dom_signals(html))['verdict'] == FULL_TEXT
+
+
+def test_dom_marker_alone_does_not_decide_a_long_page():
+    text = extract_text_from_html(full_text_page())
+    signals = {'paywall_elements': 1, 'captcha_elements': 1}
+    assert classify_page(text, dom_signals=signals)['verdict'] == FULL_TEXT
+
+
+def test_paywall_and_captcha_elements_on_short_pages():
+    paywall = '<html><body><h1>A paper title</h1><p>Abstract only.</p><div class="paywall-box">Log in</div></body></html>'
+    assert classify_page(extract_text_from_html(paywall, main_content=False),
+                         dom_signals=extract_dom_signals(paywall))['verdict'] == PAYWALL
+    challenge = '<html><body><div class="cf-turnstile"></div><p>One moment, please.</p></body></html>'
+    assert classify_page(extract_text_from_html(challenge, main_content=False),
+                         dom_signals=extract_dom_signals(challenge))['verdict'] == CAPTCHA
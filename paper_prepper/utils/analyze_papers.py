@@ -3,10 +3,28 @@ import json
 import time
 import sqlite3
 from dotenv import load_dotenv
-from openai import OpenAI
-from pydantic import BaseModel, Field
+import openai
+from openai import OpenAI, AsyncOpenAI
+from pydantic import BaseModel, Field, create_model
 from typing import Optional, List, Dict, Literal, Tuple
 import argparse
+import math
+import hashlib
+import string
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from utils.chunking import chunk_document, count_tokens, fit_to_budget
+from utils.llm_cache import LLMCache, cache_key
+from utils.batch_manager import BatchManager, BatchStateStore
+from utils.process_batch_responses import process_batch_responses
+from utils.paper_store import PaperStore, flatten_dict
+from utils.rate_limiter import RateLimiter, retry_after_seconds
+from utils.cost_estimator import RunEstimate, count_tokens_batch, exceeds_budget
+import numpy as np
+import asyncio
 
 
 # Load environment variables
@@ -16,9 +34,76 @@ load_dotenv()
 DB_PATH = r"C:\Users\bnsoh2\OneDrive - University of Nebraska-Lincoln\Projects\Students\Bryan Nsoh\Papers\Real-Time-IoT-ML\First_Sumbission\Final\source_papers\iot_ml_review.db"
 DB_DIR = r"C:\Users\bnsoh2\OneDrive - University of Nebraska-Lincoln\Projects\Students\Bryan Nsoh\Papers\Real-Time-IoT-ML\First_Sumbission\Final\source_papers"
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Model for the full PaperAnalysis extraction in every mode
+ANALYSIS_MODEL = "gpt-4o-mini"
+
+# Papers longer than CHUNK_TOKENS are analyzed in chunks and the partial
+# analyses merged; at most DOCUMENT_TOKEN_BUDGET tokens of a paper are sent
+CHUNK_TOKENS = 12000
+DOCUMENT_TOKEN_BUDGET = 60000
+CHUNK_CONCURRENCY = 4
+
+# Batch API input limits per file, with some headroom on the size limit
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_FILE_BYTES = 190 * 1024 * 1024
+# Every submitted batch is recorded here; see utils/batch_manager.py
+BATCH_STATE_PATH = os.path.join(DB_DIR, 'batch_state.sqlite')
+
+# Column holding the fingerprint of the inputs each stored analysis was made from
+FINGERPRINT_COLUMN = 'analysis_fingerprint'
+
+# Parsed analyses are cached by a hash of model, messages and response schema
+LLM_CACHE_PATH = os.path.join(DB_DIR, 'llm_cache.sqlite')
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Analyses are committed to the database every COMMIT_EVERY papers
+COMMIT_EVERY = 20
+
+# Concurrent mode: papers in flight, account rate limits and retries per request
+CONCURRENT_WORKERS = 16
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200000
+MAX_RETRIES = 5
+# Rough size of a PaperAnalysis response, reserved from the token budget per request
+EXPECTED_OUTPUT_TOKENS = 1000
+
+# Cascade: a local keyword heuristic, then a cheap short-output screening model,
+# decide whether a paper is in scope; only in-scope or uncertain papers get the
+# full PaperAnalysis extraction. Screened-out papers are stored as all-0 analyses.
+CASCADE_ENABLED = True
+SCREEN_MODEL = "gpt-4.1-nano"
+# Tokens from the start of the paper the screening model sees, and the size of its answer
+SCREEN_TOKENS = 2000
+SCREEN_OUTPUT_TOKENS = 60
+# The screening model rejects a paper only below this in-scope probability
+SCREEN_REJECT_BELOW = 0.2
+# Heuristic: fewer scope-term hits than this is off-topic; at least these
+# densities (hits per 1000 words) of scope and technology terms is in scope
+HEURISTIC_MIN_DOMAIN_HITS = 3
+HEURISTIC_ACCEPT_DOMAIN_DENSITY = 4.0
+HEURISTIC_ACCEPT_TECH_DENSITY = 2.0
+
+# Fan-out (--fanout): papers that fit in one request are analyzed as these
+# independent groups of PaperAnalysis categories in parallel requests, and
+# the results merged. The group prompts differ only after the paper text, so
+# with FANOUT_WARM_CACHE the first group runs alone and the rest reuse its
+# cached prompt prefix.
+FANOUT_ENABLED = False
+FANOUT_WARM_CACHE = True
+FANOUT_GROUPS = {
+    "scope": ["document_type", "primary_research_focus", "automation_level", "irrigation_system_focus", "crop_focus"],
+    "methods": ["ml_techniques", "data_sources", "evaluation_metrics"],
+    "technology": ["iot_technologies", "system_integration", "interoperability_standards_focus"],
+    "deployment": ["challenges_addressed", "implementation_scale", "temporal_resolution"],
+}
 
 # Initialize OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are handled in parse_analysis_async so waits are shared across workers
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Replaced in main() unless --no-cache is given; disabled until then
+llm_cache = LLMCache(None)
 
 
 class DocumentType(BaseModel):
@@ -280,6 +365,116 @@ FINAL REMINDER:
 This analysis demands the HIGHEST level of certainty and rigor. When in doubt, classify as 0. Only use 1 for classifications that are UNDENIABLE based on the paper's primary focus and content. Your response must be a JSON object matching the provided structure, including the detailed reasoning field. The standards for this task are uncompromising - reflect this in every aspect of your analysis.
 """
 
+CHUNK_NOTE = """
+NOTE ON THIS PART: The full text above is part {part} of {total} of the paper. Classify based on what this part shows, and record in the reasoning field the evidence it contains for each category. A later step combines the analyses of all parts.
+"""
+
+MERGE_PROMPT = """
+You are combining analyses of separate parts of one research paper into a single final analysis.
+
+Title: {title}
+Authors: {authors}
+
+Each part was analyzed on its own with the standards below, so a part may mark a category as 1 from evidence that is not a primary focus of the paper as a whole. Mark a field as 1 in the final analysis ONLY if the evidence across the parts shows it is a MAJOR and PRIMARY focus of the entire paper. When in doubt, classify as 0. Write the reasoning field for the whole paper, citing the evidence reported by the parts.
+
+Partial analyses:
+{partials}
+
+Your analysis must follow this structure, adhering strictly to the descriptions provided:
+
+{structure_description}
+"""
+
+def _compile_prompt(template, **fixed):
+    """Split a format template into literal parts once, with the fixed fields already filled in."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            parts.append(literal)
+        if field is not None:
+            parts.append(fixed[field] if field in fixed else (field,))
+    return parts
+
+# The structure description is the bulk of the prompt and never changes between papers
+ANALYSIS_PROMPT_PARTS = _compile_prompt(ANALYSIS_PROMPT, structure_description=structure_description)
+
+def _render_prompt(parts, title, authors, full_text):
+    values = {'title': str(title), 'authors': str(authors), 'full_text': str(full_text)}
+    return "".join(part if isinstance(part, str) else values[part[0]] for part in parts)
+
+def render_analysis_prompt(title, authors, full_text):
+    return _render_prompt(ANALYSIS_PROMPT_PARTS, title, authors, full_text)
+
+def build_group_model(group, fields):
+    """A PaperAnalysis restricted to some categories, with its own reasoning field."""
+    definitions = {'reasoning': (str, PaperAnalysis.model_fields['reasoning'])}
+    for name in fields:
+        definitions[name] = (PaperAnalysis.model_fields[name].annotation, PaperAnalysis.model_fields[name])
+    return create_model(f"PaperAnalysis_{group}", **definitions)
+
+_grouped = [name for fields in FANOUT_GROUPS.values() for name in fields]
+if sorted(_grouped) != sorted(name for name in PaperAnalysis.model_fields if name != 'reasoning'):
+    raise ValueError("FANOUT_GROUPS must list every PaperAnalysis category exactly once")
+
+GROUP_MODELS = {group: build_group_model(group, fields) for group, fields in FANOUT_GROUPS.items()}
+# The group prompts are identical up to the end of the paper text, so they share a cacheable prefix
+GROUP_PROMPT_PARTS = {
+    group: _compile_prompt(ANALYSIS_PROMPT, structure_description=generate_structure_description(model))
+    for group, model in GROUP_MODELS.items()
+}
+
+def render_group_prompt(group, title, authors, full_text):
+    return _render_prompt(GROUP_PROMPT_PARTS[group], title, authors, full_text)
+
+@lru_cache(maxsize=None)
+def _config_fingerprint(fanout):
+    config = json.dumps({
+        'prompts': [ANALYSIS_PROMPT, CHUNK_NOTE, MERGE_PROMPT],
+        'schema': PaperAnalysis.model_json_schema(),
+        'model': ANALYSIS_MODEL,
+        'chunking': [CHUNK_TOKENS, DOCUMENT_TOKEN_BUDGET],
+        'fanout': [FANOUT_GROUPS, GROUP_PROMPT_PARTS] if fanout else None,
+    }, sort_keys=True)
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()
+
+def analysis_config_fingerprint():
+    """
+    Hash of everything besides the paper that shapes an analysis: prompts,
+    schema, model, chunking and, when enabled, the fan-out groups. Computed
+    when used, after --fanout has been applied.
+    """
+    return _config_fingerprint(FANOUT_ENABLED)
+
+@lru_cache(maxsize=None)
+def screening_config_fingerprint():
+    """Hash of the cascade configuration that decides which papers are screened out."""
+    config = json.dumps({
+        'prompt': SCREEN_PROMPT,
+        'model': SCREEN_MODEL,
+        'tokens': SCREEN_TOKENS,
+        'reject_below': SCREEN_REJECT_BELOW,
+        'heuristic': [HEURISTIC_MIN_DOMAIN_HITS, HEURISTIC_ACCEPT_DOMAIN_DENSITY, HEURISTIC_ACCEPT_TECH_DENSITY,
+                      DOMAIN_TERMS_RE.pattern, TECH_TERMS_RE.pattern],
+    }, sort_keys=True)
+    return hashlib.sha256(config.encode('utf-8')).hexdigest()
+
+def paper_fingerprint(title, authors, full_text, screened_out=False):
+    """
+    Short hash of a paper's prompt inputs and the analysis configuration.
+    Screened-out papers also hash the cascade configuration, so they are
+    analyzed again when the cascade is disabled or its settings change.
+    """
+    digest = hashlib.sha256(analysis_config_fingerprint().encode('utf-8'))
+    if screened_out:
+        digest.update(b"\x00screened\x00" + screening_config_fingerprint().encode('utf-8'))
+    for part in (title, authors, full_text):
+        digest.update(b"\x00" + str(part).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def stored_fingerprint(analysis, title, authors, full_text):
+    """The fingerprint to store with an analysis: screened-out placeholders get their own."""
+    return paper_fingerprint(title, authors, full_text, screened_out=analysis.reasoning.startswith(SCREENED_OUT_MARKER))
+
 def get_all_fields(model, prefix=''):
     fields = []
     for field_name, field in model.__annotations__.items():
@@ -289,108 +484,336 @@ def get_all_fields(model, prefix=''):
             fields.append(f"{prefix}{field_name}")
     return fields
 
+# All fields of a PaperAnalysis as flattened column names
+ANALYSIS_FIELDS = get_all_fields(PaperAnalysis)
+
+# Shared connection to DB_PATH, opened on first use; see utils/paper_store.py
+paper_store = None
+
+def get_paper_store():
+    global paper_store
+    if paper_store is None:
+        paper_store = PaperStore(DB_PATH, ANALYSIS_FIELDS, FINGERPRINT_COLUMN, commit_every=COMMIT_EVERY)
+    return paper_store
+
 def update_table_schema():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get existing columns
-    cursor.execute("PRAGMA table_info(papers)")
-    existing_columns = set(row[1] for row in cursor.fetchall())
-    
-    # Get all fields from PaperAnalysis
-    all_fields = get_all_fields(PaperAnalysis)
+    store = get_paper_store()
+    existing_columns = store.columns()
     
     # Add new columns
-    for field in all_fields:
+    for field in ANALYSIS_FIELDS:
         if field not in existing_columns:
             try:
                 if field == 'reasoning':
-                    cursor.execute(f"ALTER TABLE papers ADD COLUMN {field} TEXT")
+                    store.add_column(field, "TEXT")
                 else:
-                    cursor.execute(f"ALTER TABLE papers ADD COLUMN {field} INTEGER DEFAULT 0")
+                    store.add_column(field, "INTEGER DEFAULT 0")
                 print(f"Added column: {field}")
             except sqlite3.OperationalError as e:
                 print(f"Error adding column {field}: {e}")
-    
-    conn.commit()
-    conn.close()
+    if FINGERPRINT_COLUMN not in existing_columns:
+        store.add_column(FINGERPRINT_COLUMN, "TEXT")
+        print(f"Added column: {FINGERPRINT_COLUMN}")
 
 def get_all_paper_ids():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM papers")
-    paper_ids = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return paper_ids
+    return get_paper_store().paper_ids()
+
+def get_papers_needing_analysis(force=False):
+    """
+    Papers whose stored fingerprint is missing or differs from the current one,
+    as (paper_id, reason) pairs. Papers without title, authors or full text are left out.
+    """
+    pending = []
+    for paper_id, title, authors, full_text, stored in get_paper_store().iter_papers(with_fingerprint=True):
+        if not all((title, authors, full_text)):
+            continue
+        if force:
+            pending.append((paper_id, "forced"))
+        elif stored is None:
+            pending.append((paper_id, "no analysis"))
+        elif stored == paper_fingerprint(title, authors, full_text):
+            continue
+        elif CASCADE_ENABLED and stored == paper_fingerprint(title, authors, full_text, screened_out=True):
+            continue
+        else:
+            pending.append((paper_id, "inputs or configuration changed"))
+    return pending
 
 def get_paper_data(paper_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT title, authors, year, full_text FROM papers WHERE id = ?", (paper_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    return get_paper_store().get_paper(paper_id)
 
 def wipe_previous_analysis(paper_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Get all fields from PaperAnalysis
-    all_fields = get_all_fields(PaperAnalysis)
-    
-    # Create a list of field assignments
-    field_assignments = [f"{field} = ?" for field in all_fields if field != 'id']
-    
-    # Create the update query
-    update_query = f"UPDATE papers SET {', '.join(field_assignments)} WHERE id = ?"
-    
-    # Create a list of values (0 for integer fields, NULL for the reasoning field)
-    values = [0 if field != 'reasoning' else None for field in all_fields if field != 'id']
-    values.append(paper_id)
-    
-    # Execute the update query
-    cursor.execute(update_query, values)
-    
-    conn.commit()
-    conn.close()
+    get_paper_store().wipe_analysis(paper_id)
 
-def update_paper_analysis(paper_id, analysis):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    def flatten_dict(d, parent_key=''):
-        items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}_{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(flatten_dict(v, new_key).items())
+def update_paper_analysis(paper_id, analysis, fingerprint=None):
+    get_paper_store().update_analysis(paper_id, flatten_dict(analysis.model_dump()), fingerprint)
+
+def analysis_messages(prompt):
+    return [
+        {"role": "system", "content": "You are an expert at structured data extraction from research papers."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_structured(model, messages, response_format):
+    key = cache_key(model, messages, response_format)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return response_format.model_validate_json(cached)
+    completion = client.beta.chat.completions.parse(
+        model=model,
+        messages=messages,
+        response_format=response_format,
+    )
+    parsed = completion.choices[0].message.parsed
+    if parsed is not None:
+        llm_cache.put(key, parsed.model_dump_json(), model=model)
+    return parsed
+
+def parse_analysis(prompt):
+    return parse_structured(ANALYSIS_MODEL, analysis_messages(prompt), PaperAnalysis)
+
+class ScreeningResult(BaseModel):
+    in_scope_probability: float = Field(description="Probability from 0 to 1 that the paper's main subject is irrigation or agricultural water management together with IoT, sensing, automation or machine learning.")
+    reason: str = Field(description="At most 20 words on what the paper is about and why it is or is not in scope.")
+
+SCREEN_PROMPT = """
+Decide whether this paper belongs in a review of real-time, IoT- and machine-learning-driven irrigation management. Papers on irrigation, soil water or crop water use combined with sensing, automation, IoT or machine learning are in scope; so are reviews and standards on those topics. Papers that only mention irrigation or agriculture in passing are not. If unsure, give a middle probability rather than a low one.
+
+Title: {title}
+Authors: {authors}
+Beginning of the paper:
+{excerpt}
+"""
+
+DOMAIN_TERMS_RE = re.compile(r"\birrigat\w*|evapotranspir\w*|soil moisture|soil water|water (?:management|use|stress|balance|saving)"
+                             r"|\bcrops?\b|agricultur\w*|\bfarm\w*", re.IGNORECASE)
+TECH_TERMS_RE = re.compile(r"\biot\b|internet of things|\bsensors?\b|\bsensing\b|wireless|machine learning|deep learning"
+                           r"|neural network|lorawan|zigbee|remote sensing|\bautomat\w*|\bcontroll?\w*", re.IGNORECASE)
+
+class CascadeStats:
+    """Counts of screening decisions by stage, for auditing what the cascade saved."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.tokens_saved = 0
+        self.lock = threading.Lock()
+
+    def record(self, stage, escalated, tokens_saved=0):
+        with self.lock:
+            self.counts[(stage, escalated)] += 1
+            self.tokens_saved += tokens_saved
+
+    def summary(self):
+        total = sum(self.counts.values())
+        if not total:
+            return "Cascade: no papers screened"
+        escalated = self.counts[("heuristic", True)] + self.counts[("model", True)]
+        return (f"Cascade: {total} papers screened; heuristic rejected {self.counts[('heuristic', False)]} "
+                f"(< {HEURISTIC_MIN_DOMAIN_HITS} scope terms) and accepted {self.counts[('heuristic', True)]} "
+                f"(>= {HEURISTIC_ACCEPT_DOMAIN_DENSITY}/{HEURISTIC_ACCEPT_TECH_DENSITY} terms per 1000 words); "
+                f"{SCREEN_MODEL} rejected {self.counts[('model', False)]} and escalated {self.counts[('model', True)]} "
+                f"(reject below p={SCREEN_REJECT_BELOW}); {escalated / total:.0%} escalated to full extraction, "
+                f"about {self.tokens_saved:,} input tokens of {ANALYSIS_MODEL} saved")
+
+cascade_stats = CascadeStats()
+
+def screening_messages(title, authors, full_text):
+    excerpt = full_text[:SCREEN_TOKENS * 4]
+    return [
+        {"role": "system", "content": "You screen research papers for relevance. Answer briefly."},
+        {"role": "user", "content": SCREEN_PROMPT.format(title=title, authors=authors, excerpt=excerpt)}
+    ]
+
+def heuristic_screen(title, full_text):
+    """
+    Local first stage: ("out", detail) when irrigation/agriculture is barely
+    mentioned, ("in", detail) when both scope and technology terms are dense,
+    and (None, detail) when the screening model has to decide.
+    """
+    text = f"{title}\n{full_text}"
+    words = max(len(text.split()), 1)
+    domain = len(DOMAIN_TERMS_RE.findall(text))
+    tech = len(TECH_TERMS_RE.findall(text))
+    domain_density = domain * 1000 / words
+    tech_density = tech * 1000 / words
+    detail = f"{domain} scope / {tech} technology terms, {domain_density:.1f} / {tech_density:.1f} per 1000 words"
+    if domain < HEURISTIC_MIN_DOMAIN_HITS:
+        return "out", detail
+    if domain_density >= HEURISTIC_ACCEPT_DOMAIN_DENSITY and tech_density >= HEURISTIC_ACCEPT_TECH_DENSITY:
+        return "in", detail
+    return None, detail
+
+def finish_screening(title, full_text, stage, escalate, detail):
+    saved = 0 if escalate else max(count_tokens(full_text[:DOCUMENT_TOKEN_BUDGET * 4]) - (SCREEN_TOKENS if stage == "model" else 0), 0)
+    cascade_stats.record(stage, escalate, saved)
+    print(f"Screening '{title[:60]}': {'escalated' if escalate else 'off-topic'} by {stage} ({detail})")
+    return escalate, f"{stage}: {detail}"
+
+def screening_decision(result):
+    """Escalate unless the screening model is confident the paper is out of scope."""
+    if result is None:
+        return True, "no screening result"
+    return result.in_scope_probability >= SCREEN_REJECT_BELOW, f"p={result.in_scope_probability:.2f}, {result.reason}"
+
+def screen_paper(title, authors, full_text):
+    """(escalate, detail): whether the paper should get the full PaperAnalysis extraction."""
+    verdict, detail = heuristic_screen(title, full_text)
+    if verdict is not None:
+        return finish_screening(title, full_text, "heuristic", verdict == "in", detail)
+    try:
+        result = parse_structured(SCREEN_MODEL, screening_messages(title, authors, full_text), ScreeningResult)
+    except Exception as e:
+        print(f"Screening failed ({e}); escalating")
+        result = None
+    escalate, detail = screening_decision(result)
+    return finish_screening(title, full_text, "model", escalate, detail)
+
+# Reasoning prefix of the placeholder analysis stored for screened-out papers
+SCREENED_OUT_MARKER = "[screened out]"
+
+def off_topic_analysis(detail):
+    """PaperAnalysis for a screened-out paper: every category 0, not_applicable set where it exists."""
+    def empty(model):
+        values = {}
+        for name, field in model.model_fields.items():
+            if isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel):
+                values[name] = empty(field.annotation)
+            elif name == 'reasoning':
+                values[name] = f"{SCREENED_OUT_MARKER} Not analyzed in full: off-topic for this review ({detail})."
             else:
-                items.append((new_key, v))
-        return dict(items)
-    
-    flattened_analysis = flatten_dict(analysis.dict())
-    
-    update_query = "UPDATE papers SET " + ", ".join(f"{k} = ?" for k in flattened_analysis.keys()) + " WHERE id = ?"
-    cursor.execute(update_query, list(flattened_analysis.values()) + [paper_id])
-    
-    conn.commit()
-    conn.close()
+                values[name] = 1 if name == 'not_applicable' else 0
+        return values
+    return PaperAnalysis.model_validate(empty(PaperAnalysis))
 
-def get_paper_analysis(title, authors, full_text):
-    structure = PaperAnalysis.model_json_schema()
-    prompt = ANALYSIS_PROMPT.format(
-        title=title, authors=authors, full_text=full_text, structure=structure
+def merge_group_analyses(results):
+    """One PaperAnalysis from the per-group results, their reasoning concatenated in group order."""
+    values = {'reasoning': "\n\n".join(f"[{group}] {results[group].reasoning}" for group in FANOUT_GROUPS)}
+    for group in FANOUT_GROUPS:
+        values.update(results[group].model_dump(exclude={'reasoning'}))
+    return PaperAnalysis.model_validate(values)
+
+def parse_group(group, title, authors, full_text):
+    """
+    Extract one category group. JSON mode is used rather than a strict schema,
+    since a per-group response schema would sit in front of the messages and
+    break the shared prompt prefix.
+    """
+    messages = analysis_messages(render_group_prompt(group, title, authors, full_text))
+    response_format = GROUP_MODELS[group]
+    key = cache_key(ANALYSIS_MODEL, messages, response_format)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return response_format.model_validate_json(cached)
+    completion = client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=messages,
+        response_format={"type": "json_object"},
+        prompt_cache_key=paper_fingerprint(title, authors, full_text),
     )
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an expert at structured data extraction from research papers."},
-            {"role": "user", "content": prompt}
-        ],
-        response_format=PaperAnalysis,
+    parsed = response_format.model_validate_json(completion.choices[0].message.content)
+    llm_cache.put(key, parsed.model_dump_json(), model=ANALYSIS_MODEL)
+    report_prompt_cache(group, completion)
+    return parsed
+
+def report_prompt_cache(group, completion):
+    details = getattr(getattr(completion, 'usage', None), 'prompt_tokens_details', None)
+    if details is not None and completion.usage.prompt_tokens:
+        print(f"  group {group}: {details.cached_tokens or 0}/{completion.usage.prompt_tokens} prompt tokens from cache")
+
+def get_fanout_paper_analysis(title, authors, full_text):
+    """
+    Extract the category groups in parallel and merge them. With
+    FANOUT_WARM_CACHE the first group goes alone so the rest hit the prompt
+    cache it fills.
+    """
+    groups = list(FANOUT_GROUPS)
+    results = {}
+    if FANOUT_WARM_CACHE:
+        results[groups[0]] = parse_group(groups[0], title, authors, full_text)
+        groups = groups[1:]
+    with ThreadPoolExecutor(max_workers=len(groups) or 1) as executor:
+        for group, result in zip(groups, executor.map(lambda g: parse_group(g, title, authors, full_text), groups)):
+            results[group] = result
+    return merge_group_analyses(results)
+
+def get_paper_analysis(title, authors, full_text):
+    if CASCADE_ENABLED:
+        escalate, detail = screen_paper(title, authors, full_text)
+        if not escalate:
+            return off_topic_analysis(detail)
+    if FANOUT_ENABLED and count_tokens(full_text) <= CHUNK_TOKENS:
+        try:
+            analysis = get_fanout_paper_analysis(title, authors, full_text)
+            print(analysis)
+            return analysis
+        except Exception as e:
+            print(f"Fan-out analysis failed ({e}); falling back to a single request")
+    if count_tokens(full_text) > CHUNK_TOKENS:
+        analysis = get_chunked_paper_analysis(title, authors, full_text)
+    else:
+        analysis = parse_analysis(render_analysis_prompt(title, authors, full_text))
+    print(analysis)
+    return analysis
+
+def merge_partial_analyses(partials):
+    """
+    Fallback merge without an LLM: a field is 1 if at least a third of the
+    parts marked it, and not_applicable is cleared when a sibling field is set.
+    """
+    needed = max(1, math.ceil(len(partials) / 3))
+
+    def merge(values):
+        first = values[0]
+        if isinstance(first, dict):
+            merged = {key: merge([v[key] for v in values]) for key in first}
+            if 'not_applicable' in merged and any(
+                    v == 1 for k, v in merged.items() if k != 'not_applicable' and isinstance(v, int)):
+                merged['not_applicable'] = 0
+            return merged
+        if isinstance(first, str):
+            return "\n\n".join(f"[Part {i + 1}] {v}" for i, v in enumerate(values))
+        return 1 if sum(1 for v in values if v == 1) >= needed else 0
+
+    return PaperAnalysis.model_validate(merge([p.model_dump() for p in partials]))
+
+def chunk_prompts(title, authors, full_text):
+    chunks = fit_to_budget(chunk_document(full_text, CHUNK_TOKENS), DOCUMENT_TOKEN_BUDGET)
+    print(f"Analyzing '{title}' in {len(chunks)} chunks")
+    return [
+        render_analysis_prompt(title, authors, chunk.text) + CHUNK_NOTE.format(part=i + 1, total=len(chunks))
+        for i, chunk in enumerate(chunks)
+    ]
+
+def build_merge_prompt(title, authors, partials):
+    return MERGE_PROMPT.format(
+        title=title, authors=authors,
+        partials="\n\n".join(f"Part {i + 1}:\n{p.model_dump_json()}" for i, p in enumerate(partials)),
+        structure_description=structure_description,
     )
-    print(completion.choices[0].message.parsed)
-    return completion.choices[0].message.parsed
+
+def get_chunked_paper_analysis(title, authors, full_text):
+    """Map the analysis over token-bounded chunks concurrently, then reduce the partial analyses."""
+    prompts = chunk_prompts(title, authors, full_text)
+
+    def try_parse(prompt):
+        try:
+            return parse_analysis(prompt)
+        except Exception as e:
+            print(f"Chunk analysis failed: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=CHUNK_CONCURRENCY) as executor:
+        partials = [p for p in executor.map(try_parse, prompts) if p is not None]
+    if not partials:
+        raise RuntimeError(f"All {len(prompts)} chunk analyses failed for '{title}'")
+    if len(partials) == 1:
+        return partials[0]
+
+    try:
+        return parse_analysis(build_merge_prompt(title, authors, partials))
+    except Exception as e:
+        print(f"Merge step failed ({e}); merging partial analyses by vote")
+        return merge_partial_analyses(partials)
 
 def process_paper_sequentially(paper_id):
     paper_data = get_paper_data(paper_id)
@@ -399,7 +822,7 @@ def process_paper_sequentially(paper_id):
         if all((title, authors, full_text)):
             wipe_previous_analysis(paper_id)
             analysis = get_paper_analysis(title, authors, full_text)
-            update_paper_analysis(paper_id, analysis)
+            update_paper_analysis(paper_id, analysis, stored_fingerprint(analysis, title, authors, full_text))
             print(f"Processed paper {paper_id}")
         else:
             print(f"Skipping paper {paper_id} due to missing data")
@@ -407,118 +830,414 @@ def process_paper_sequentially(paper_id):
         print(f"No data found for paper {paper_id}")
         
         
-def prepare_batch_file(papers):
-    batch_requests = []
-    for paper in papers:
-        structure = PaperAnalysis.model_json_schema()
-        prompt = ANALYSIS_PROMPT.format(
-            title=paper['title'], 
-            authors=paper['authors'], 
-            full_text=paper['full_text'], 
-            structure_description=structure_description
-        )
-        
-        request = {
-            "custom_id": f"paper_{paper['id']}",
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": {
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": "You are an expert at structured data extraction from research papers."},
-                    {"role": "user", "content": prompt}
-                ],
-                "response_format": {"type": "json_object"}
-            }
-        }
-        batch_requests.append(json.dumps(request))
-    
-    batch_file_path = os.path.join(DB_DIR, 'batch_input.jsonl')
-    with open(batch_file_path, 'w') as f:
-        for request in batch_requests:
-            f.write(f"{request}\n")
-    return batch_file_path
-
-def process_papers_batch(papers):
-    # 1. Prepare batch file
-    batch_file_path = prepare_batch_file(papers)
-    
-    # 2. Upload batch file
-    with open(batch_file_path, 'rb') as f:
-        batch_file = client.files.create(file=f, purpose="batch")
-    
-    # 3. Create batch
-    batch = client.batches.create(
-        input_file_id=batch_file.id,
-        endpoint="/v1/chat/completions",
-        completion_window="24h"
+async def request_with_retries(limiter, tokens, send):
+    """
+    Await send() under the shared limiter. Rate-limit and transient errors are
+    retried, waiting as long as Retry-After or the rate-limit headers say.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with limiter.slot(tokens):
+                response = await send()
+            await limiter.on_success()
+            limiter.observe_headers(response.headers)
+            return response
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            headers = e.response.headers if getattr(e, 'response', None) is not None else None
+            delay = retry_after_seconds(headers) or min(2 ** attempt, 60)
+            if isinstance(e, openai.RateLimitError):
+                await limiter.on_rate_limit()
+                limiter.pause(delay)
+            print(f"{type(e).__name__}; retrying in {delay:.1f}s (attempt {attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+async def parse_structured_async(model, messages, response_format, limiter, output_tokens):
+    """
+    parse_structured on the async client: same model, messages and cache key, so
+    the stored analysis matches sequential mode.
+    """
+    key = cache_key(model, messages, response_format)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return response_format.model_validate_json(cached)
+    prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+    response = await request_with_retries(
+        limiter, prompt_tokens + output_tokens,
+        lambda: async_client.beta.chat.completions.with_raw_response.parse(
+            model=model,
+            messages=messages,
+            response_format=response_format,
+        ),
     )
-    
-    # 4. Store batch information
-    batch_info = {
-        "batch_id": batch.id,
-        "input_file_id": batch.input_file_id,
-        "status": batch.status,
-        "created_at": batch.created_at,
-        "paper_ids": [paper['id'] for paper in papers]
+    parsed = response.parse().choices[0].message.parsed
+    if parsed is None:
+        raise RuntimeError("The model returned no parsed result")
+    llm_cache.put(key, parsed.model_dump_json(), model=model)
+    return parsed
+
+async def parse_analysis_async(prompt, limiter):
+    return await parse_structured_async(ANALYSIS_MODEL, analysis_messages(prompt), PaperAnalysis, limiter,
+                                        EXPECTED_OUTPUT_TOKENS)
+
+async def screen_paper_async(title, authors, full_text, limiter):
+    verdict, detail = heuristic_screen(title, full_text)
+    if verdict is not None:
+        return finish_screening(title, full_text, "heuristic", verdict == "in", detail)
+    try:
+        result = await parse_structured_async(SCREEN_MODEL, screening_messages(title, authors, full_text),
+                                              ScreeningResult, limiter, SCREEN_OUTPUT_TOKENS)
+    except Exception as e:
+        print(f"Screening failed ({e}); escalating")
+        result = None
+    escalate, detail = screening_decision(result)
+    return finish_screening(title, full_text, "model", escalate, detail)
+
+async def parse_group_async(group, title, authors, full_text, limiter):
+    messages = analysis_messages(render_group_prompt(group, title, authors, full_text))
+    response_format = GROUP_MODELS[group]
+    key = cache_key(ANALYSIS_MODEL, messages, response_format)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return response_format.model_validate_json(cached)
+    response = await request_with_retries(
+        limiter, count_tokens(messages[1]["content"]) + EXPECTED_OUTPUT_TOKENS // len(FANOUT_GROUPS),
+        lambda: async_client.chat.completions.with_raw_response.create(
+            model=ANALYSIS_MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+            prompt_cache_key=paper_fingerprint(title, authors, full_text),
+        ),
+    )
+    completion = response.parse()
+    parsed = response_format.model_validate_json(completion.choices[0].message.content)
+    llm_cache.put(key, parsed.model_dump_json(), model=ANALYSIS_MODEL)
+    report_prompt_cache(group, completion)
+    return parsed
+
+async def get_fanout_paper_analysis_async(title, authors, full_text, limiter):
+    groups = list(FANOUT_GROUPS)
+    results = {}
+    if FANOUT_WARM_CACHE:
+        results[groups[0]] = await parse_group_async(groups[0], title, authors, full_text, limiter)
+        groups = groups[1:]
+    parsed = await asyncio.gather(*(parse_group_async(g, title, authors, full_text, limiter) for g in groups))
+    results.update(zip(groups, parsed))
+    return merge_group_analyses(results)
+
+async def get_paper_analysis_async(title, authors, full_text, limiter):
+    if CASCADE_ENABLED:
+        escalate, detail = await screen_paper_async(title, authors, full_text, limiter)
+        if not escalate:
+            return off_topic_analysis(detail)
+    if FANOUT_ENABLED and count_tokens(full_text) <= CHUNK_TOKENS:
+        try:
+            return await get_fanout_paper_analysis_async(title, authors, full_text, limiter)
+        except Exception as e:
+            print(f"Fan-out analysis failed ({e}); falling back to a single request")
+    if count_tokens(full_text) <= CHUNK_TOKENS:
+        return await parse_analysis_async(render_analysis_prompt(title, authors, full_text), limiter)
+
+    prompts = chunk_prompts(title, authors, full_text)
+    results = await asyncio.gather(*(parse_analysis_async(prompt, limiter) for prompt in prompts),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Chunk analysis failed: {result}")
+    partials = [r for r in results if not isinstance(r, Exception)]
+    if not partials:
+        raise RuntimeError(f"All {len(prompts)} chunk analyses failed for '{title}'")
+    if len(partials) == 1:
+        return partials[0]
+
+    try:
+        return await parse_analysis_async(build_merge_prompt(title, authors, partials), limiter)
+    except Exception as e:
+        print(f"Merge step failed ({e}); merging partial analyses by vote")
+        return merge_partial_analyses(partials)
+
+class ProgressReporter:
+    """Prints done/total, throughput and an ETA after each finished paper."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def update(self, paper_id, ok=True):
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        status = "done" if ok else "FAILED"
+        print(f"[{self.done}/{self.total}] paper {paper_id} {status} | "
+              f"{rate * 60:.1f} papers/min | elapsed {elapsed / 60:.1f} min | ETA {eta / 60:.1f} min")
+
+async def process_papers_concurrently(paper_ids, workers=CONCURRENT_WORKERS):
+    """
+    Analyze papers with `workers` running at once. Each result is queued to
+    the single database writer as soon as it arrives.
+    """
+    store = get_paper_store()
+    limiter = RateLimiter(
+        requests_per_minute=MAX_REQUESTS_PER_MINUTE,
+        tokens_per_minute=MAX_TOKENS_PER_MINUTE,
+        max_concurrency=workers,
+    )
+    progress = ProgressReporter(len(paper_ids))
+    queue = asyncio.Queue()
+    for paper_id in paper_ids:
+        queue.put_nowait(paper_id)
+
+    async def worker(writer):
+        while True:
+            try:
+                paper_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            paper_data = await asyncio.to_thread(store.get_paper, paper_id)
+            if not paper_data or not all((paper_data[0], paper_data[1], paper_data[3])):
+                print(f"Skipping paper {paper_id} due to missing data")
+                progress.update(paper_id, ok=False)
+                continue
+            title, authors, year, full_text = paper_data
+            try:
+                analysis = await get_paper_analysis_async(title, authors, full_text, limiter)
+            except Exception as e:
+                print(f"Analysis of paper {paper_id} failed: {e}")
+                progress.update(paper_id, ok=False)
+                continue
+            await writer.put(paper_id, flatten_dict(analysis.model_dump()),
+                             stored_fingerprint(analysis, title, authors, full_text), wipe=True)
+            progress.update(paper_id)
+
+    async with store.writer() as writer:
+        await asyncio.gather(*(worker(writer) for _ in range(min(workers, len(paper_ids)))))
+    print(f"Analyzed {progress.done - progress.failed} of {len(paper_ids)} papers "
+          f"({progress.failed} failed, {writer.written} written; {limiter.summary()})")
+
+def iter_papers(paper_ids, fetch_size=100):
+    """Stream (id, title, authors, full_text) rows for the given ids from a DB cursor."""
+    wanted = set(paper_ids)
+    for paper_id, title, authors, full_text in get_paper_store().iter_papers(fetch_size):
+        if paper_id in wanted and all((title, authors, full_text)):
+            yield paper_id, title, authors, full_text
+
+def build_batch_request(paper_id, title, authors, full_text):
+    return {
+        # The fingerprint rides along so ingesting the response can record it
+        "custom_id": f"paper_{paper_id}_{paper_fingerprint(title, authors, full_text)}",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": ANALYSIS_MODEL,
+            "messages": [
+                {"role": "system", "content": "You are an expert at structured data extraction from research papers."},
+                {"role": "user", "content": render_analysis_prompt(title, authors, full_text)}
+            ],
+            "response_format": {"type": "json_object"}
+        }
     }
-    
-    batch_info_path = os.path.join(DB_DIR, 'batch_info.json')
-    with open(batch_info_path, 'w') as f:
-        json.dump(batch_info, f, indent=2)
-    
-    print(f"Batch created with ID: {batch.id}")
-    print(f"Batch information stored in: {batch_info_path}")
-    print("You can check the batch status later using this information.")
+
+def prepare_batch_files(paper_ids):
+    """
+    Write batch requests as JSONL while streaming papers from the database,
+    starting a new shard before a file would pass the Batch API's request or
+    size limit. Returns a list of (shard path, paper ids) pairs.
+    """
+    shards = []
+    handle = None
+    shard_bytes = 0
+    try:
+        for paper_id, title, authors, full_text in iter_papers(paper_ids):
+            line = (json.dumps(build_batch_request(paper_id, title, authors, full_text)) + "\n").encode('utf-8')
+            if len(line) > BATCH_MAX_FILE_BYTES:
+                print(f"Skipping paper {paper_id}: its request alone exceeds the batch file size limit")
+                continue
+            if handle is None or len(shards[-1][1]) >= BATCH_MAX_REQUESTS or shard_bytes + len(line) > BATCH_MAX_FILE_BYTES:
+                if handle is not None:
+                    handle.close()
+                shard_path = os.path.join(DB_DIR, f"batch_input_{len(shards) + 1:03d}.jsonl")
+                handle = open(shard_path, 'wb')
+                shards.append((shard_path, []))
+                shard_bytes = 0
+            handle.write(line)
+            shard_bytes += len(line)
+            shards[-1][1].append(paper_id)
+    finally:
+        if handle is not None:
+            handle.close()
+    return shards
+
+def process_papers_batch(paper_ids, wait=False):
+    # 1. Stream requests into shard files
+    shards = prepare_batch_files(paper_ids)
+    if not shards:
+        print("No valid papers found for processing. Exiting.")
+        return
+    print(f"Wrote {sum(len(ids) for _, ids in shards)} requests to {len(shards)} batch file(s)")
+
+    # 2. Submit the shards concurrently and record them in the batch state store
+    store = BatchStateStore(BATCH_STATE_PATH)
+    manager = BatchManager(client, store, DB_DIR, ingest=lambda output_path: process_batch_responses(output_path, DB_PATH))
+
+    async def submit_and_track():
+        batch_ids = await manager.submit_many(path for path, _ in shards)
+        print(f"Created {len(batch_ids)} batch(es): {', '.join(batch_ids)}")
+        # 3. Optionally poll until done, ingesting outputs and resubmitting failures
+        if wait:
+            await manager.run()
+
+    asyncio.run(submit_and_track())
+    print(manager.summary())
+    store.close()
+    print(f"Batch information stored in: {BATCH_STATE_PATH}")
+    if not wait:
+        print(f"Track and ingest later with: python -m utils.batch_manager --db \"{DB_PATH}\"")
+
+def estimate_analysis_run(paper_ids, mode):
+    """
+    Token counts for analyzing the given papers, without calling the model.
+    Batch mode sends each paper whole; the other modes chunk long papers, so
+    their cost is estimated from the chunk and merge prompts they will send.
+    """
+    labels, full_texts, prompts = [], [], []
+    for paper_id, title, authors, full_text in iter_papers(paper_ids):
+        labels.append(f"{paper_id} {title[:60]}")
+        full_texts.append(full_text)
+        prompts.append(render_analysis_prompt(title, authors, full_text))
+    prompt_tokens = count_tokens_batch(prompts)
+    requests = np.ones(len(labels), dtype=np.int64)
+    if mode == "batch":
+        return RunEstimate(labels, prompt_tokens, requests * EXPECTED_OUTPUT_TOKENS, requests, prompt_tokens)
+
+    text_tokens = count_tokens_batch(full_texts)
+    overhead = prompt_tokens - text_tokens
+    chunked = text_tokens > CHUNK_TOKENS
+    sent = np.minimum(text_tokens, DOCUMENT_TOKEN_BUDGET)
+    chunks = np.where(chunked, np.ceil(sent / CHUNK_TOKENS), 1).astype(np.int64)
+    note_tokens = count_tokens(CHUNK_NOTE.format(part=1, total=1))
+    merge_tokens = count_tokens(MERGE_PROMPT.format(title='', authors='', partials='',
+                                                    structure_description=structure_description))
+    # Chunked papers send every chunk with the prompt around it, then one merge of the partial analyses
+    chunked_input = sent + chunks * (overhead + note_tokens) + merge_tokens + chunks * EXPECTED_OUTPUT_TOKENS
+    input_tokens = np.where(chunked, chunked_input, prompt_tokens)
+    requests = np.where(chunked, chunks + 1, 1)
+    largest = np.where(chunked, np.maximum(CHUNK_TOKENS + overhead + note_tokens,
+                                           merge_tokens + chunks * EXPECTED_OUTPUT_TOKENS), prompt_tokens)
+    return RunEstimate(labels, input_tokens, requests * EXPECTED_OUTPUT_TOKENS, requests, largest)
 
 def get_user_choice():
     while True:
-        choice = input("Choose processing mode (sequential/batch): ").lower().strip()
-        if choice in ['sequential', 'batch']:
+        choice = input("Choose processing mode (sequential/concurrent/batch): ").lower().strip()
+        if choice in ['sequential', 'concurrent', 'batch']:
             return choice
-        print("Invalid choice. Please enter 'sequential' or 'batch'.")
+        print("Invalid choice. Please enter 'sequential', 'concurrent' or 'batch'.")
 
 def main():
     parser = argparse.ArgumentParser(description="Process papers using sequential or batch method.")
-    parser.add_argument("--mode", choices=["sequential", "batch"],
-                        help="Processing mode: 'sequential' for one-by-one or 'batch' for batch processing")
+    parser.add_argument("--mode", choices=["sequential", "concurrent", "batch"],
+                        help="Processing mode: 'sequential' for one-by-one, 'concurrent' for many papers at once "
+                             "through the async client, or 'batch' for batch processing")
+    parser.add_argument("--workers", type=int, default=CONCURRENT_WORKERS,
+                        help="Concurrent mode: number of papers analyzed at once")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore and do not update the LLM response cache")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="List the papers that would be analyzed and why, without calling the model")
+    parser.add_argument("--wait", action="store_true",
+                        help="Batch mode: poll the submitted batches and ingest their results as they complete")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Report input/output tokens, projected cost and context-limit overflows for the "
+                             "papers --mode would analyze, without calling the model")
+    parser.add_argument("--budget", type=float,
+                        help="Refuse to start when the projected cost in USD exceeds this amount")
+    parser.add_argument("--fanout", action="store_true",
+                        help="Extract groups of categories in parallel requests per paper for lower latency")
+    parser.add_argument("--no-cascade", action="store_true",
+                        help="Run the full extraction on every paper instead of screening off-topic papers first")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-analyze every paper, even those whose fingerprint is unchanged")
     args = parser.parse_args()
 
+    # Applied first: they change which stored analyses count as up to date
+    global llm_cache, CASCADE_ENABLED, FANOUT_ENABLED
+    if args.no_cascade:
+        CASCADE_ENABLED = False
+    # Batch requests are single full extractions, so fan-out only applies to the other modes
+    FANOUT_ENABLED = args.fanout and args.mode != "batch"
+
+    if args.dry_run:
+        pending = get_papers_needing_analysis(force=args.force)
+        for paper_id, reason in pending:
+            print(f"{paper_id}\t{reason}")
+        print(f"{len(pending)} of {len(get_all_paper_ids())} papers would be analyzed.")
+        return
+
+    if args.estimate:
+        mode = args.mode or "sequential"
+        paper_ids = [paper_id for paper_id, _ in get_papers_needing_analysis(force=args.force)]
+        print(f"Estimate for {mode} mode:")
+        print(estimate_analysis_run(paper_ids, mode).report(ANALYSIS_MODEL, batch=mode == "batch"))
+        return
+
+    if not args.no_cache:
+        llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+
     # If mode is not provided as a command-line argument, ask the user
     if args.mode is None:
         args.mode = get_user_choice()
+        FANOUT_ENABLED = args.fanout and args.mode != "batch"
 
     update_table_schema()
-    paper_ids = get_all_paper_ids()
-    
-    if not paper_ids:
+    if not get_all_paper_ids():
         print("No papers found in the database. Please add papers before running analysis.")
         return
 
+    # Only papers without an analysis or whose inputs changed since it was made
+    pending = get_papers_needing_analysis(force=args.force)
+    paper_ids = [paper_id for paper_id, _ in pending]
+    print(f"{len(paper_ids)} papers need analysis; the rest are up to date.")
+    if not paper_ids:
+        return
+    if args.budget is not None:
+        estimate = estimate_analysis_run(paper_ids, args.mode)
+        if exceeds_budget(estimate, ANALYSIS_MODEL, args.budget, batch=args.mode == "batch"):
+            print(f"Projected cost exceeds the ${args.budget:.2f} budget; run with --estimate for details.")
+            return
+        if args.mode == "batch" and estimate.over_context(ANALYSIS_MODEL):
+            print(f"Warning: {len(estimate.over_context(ANALYSIS_MODEL))} papers exceed the context limit "
+                  f"and will fail in batch mode; run with --estimate to list them.")
+
     if args.mode == "sequential":
         print("Processing papers sequentially...")
-        for paper_id in paper_ids:
-            process_paper_sequentially(paper_id)
+        try:
+            for paper_id in paper_ids:
+                process_paper_sequentially(paper_id)
+        finally:
+            # Commit the analyses written since the last batched commit
+            get_paper_store().close()
         print("Sequential processing completed.")
+        print(llm_cache.summary())
+        if CASCADE_ENABLED:
+            print(cascade_stats.summary())
+    elif args.mode == "concurrent":
+        print(f"Processing papers concurrently with {args.workers} workers...")
+        try:
+            asyncio.run(process_papers_concurrently(paper_ids, workers=args.workers))
+        finally:
+            get_paper_store().close()
+        print(llm_cache.summary())
+        if CASCADE_ENABLED:
+            print(cascade_stats.summary())
     else:  # batch mode
         print("Processing papers in batch mode...")
-        papers = []
-        for paper_id in paper_ids:
-            paper_data = get_paper_data(paper_id)
-            if paper_data:
-                title, authors, year, full_text = paper_data
-                if all((title, authors, full_text)):
-                    papers.append({'id': paper_id, 'title': title, 'authors': authors, 'full_text': full_text})
-            else:
-                print(f"Skipping paper {paper_id} due to missing data")
-        
-        if not papers:
-            print("No valid papers found for processing. Exiting.")
-            return
-
-        print(f"Number of papers to process in batch: {len(papers)}")
-        process_papers_batch(papers)
-        print("Batch job submitted. You can check its status later using the information in batch_info.json")
+        print(f"Number of papers to process in batch: {len(paper_ids)}")
+        process_papers_batch(paper_ids, wait=args.wait)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,285 @@
+# paper_prepper/utils/batch_manager.py
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class BatchStateStore:
+    """SQLite record of every submitted batch, so submissions never overwrite each other."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # Submissions run in worker threads, so the connection is shared under a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                input_path TEXT,
+                input_file_id TEXT,
+                status TEXT,
+                attempt INTEGER DEFAULT 0,
+                parent_batch_id TEXT,
+                output_path TEXT,
+                error_path TEXT,
+                ingested INTEGER DEFAULT 0,
+                resubmitted INTEGER DEFAULT 0,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self.conn.commit()
+
+    def add(self, batch_id: str, input_path: str, input_file_id: str, status: str,
+            attempt: int = 0, parent_batch_id: Optional[str] = None) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, input_path, input_file_id, status, attempt, parent_batch_id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, input_path, input_file_id, status, attempt, parent_batch_id, now, now),
+            )
+            self.conn.commit()
+
+    def update(self, batch_id: str, **fields) -> None:
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE batches SET {assignments} WHERE batch_id = ?", list(fields.values()) + [batch_id])
+            self.conn.commit()
+
+    def get(self, batch_id: str) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute("SELECT * FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+
+    def unfinished(self) -> List[sqlite3.Row]:
+        """Batches still to poll, ingest or resubmit."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT * FROM batches WHERE ingested = 0 OR resubmitted = 0 ORDER BY created_at"
+            ).fetchall()
+
+    def all(self) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute("SELECT * FROM batches ORDER BY created_at").fetchall()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def read_custom_ids(path: Optional[str]) -> Set[str]:
+    ids = set()
+    if not path or not os.path.exists(path):
+        return ids
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)['custom_id'])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return ids
+
+
+def successful_custom_ids(output_path: Optional[str]) -> Set[str]:
+    """custom_ids whose response in an output file came back with HTTP 200."""
+    ids = set()
+    if not output_path or not os.path.exists(output_path):
+        return ids
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if (record.get('response') or {}).get('status_code') == 200 and not record.get('error'):
+                    ids.add(record['custom_id'])
+            except (json.JSONDecodeError, KeyError, AttributeError):
+                continue
+    return ids
+
+
+class BatchManager:
+    """
+    Submits, polls, downloads, ingests and resubmits OpenAI batches.
+
+    Every batch is tracked in a BatchStateStore and polled concurrently, with
+    the poll interval doubling (up to max_poll_interval) while a batch's status
+    is unchanged. Completed outputs are streamed to disk and handed to
+    `ingest` right away. Requests that did not come back with HTTP 200 are
+    written to a new input file and resubmitted, up to max_resubmits times.
+
+    `client` is anything with the OpenAI SDK's files/batches interface, so a
+    local stand-in (or OpenAI(base_url=...) pointed at one) can replace the API.
+    """
+
+    def __init__(self, client, store: BatchStateStore, work_dir: str, ingest: Optional[Callable[[str], None]] = None,
+                 poll_interval: float = 30, max_poll_interval: float = 600, max_resubmits: int = 2,
+                 endpoint: str = "/v1/chat/completions", completion_window: str = "24h"):
+        self.client = client
+        self.store = store
+        self.work_dir = work_dir
+        self.ingest = ingest
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_resubmits = max_resubmits
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, input_path: str, attempt: int = 0, parent_batch_id: Optional[str] = None) -> str:
+        with open(input_path, 'rb') as f:
+            batch_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        self.store.add(batch.id, input_path, batch_file.id, batch.status, attempt, parent_batch_id)
+        logger.info(f"Submitted batch {batch.id} from {os.path.basename(input_path)} (attempt {attempt})")
+        return batch.id
+
+    async def submit_many(self, input_paths: Iterable[str]) -> List[str]:
+        """Upload and create batches for several input files concurrently."""
+        return await asyncio.gather(*(asyncio.to_thread(self.submit, path) for path in input_paths))
+
+    def _download(self, file_id: str, path: str) -> str:
+        """Stream a file's content to disk without holding it all in memory when the client allows it."""
+        content = self.client.files.content(file_id)
+        with open(path, 'wb') as f:
+            if hasattr(content, 'iter_bytes'):
+                for chunk in content.iter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    f.write(chunk)
+            else:
+                data = content.content if hasattr(content, 'content') else content.text.encode('utf-8')
+                f.write(data)
+        return path
+
+    def _resubmit_failures(self, row: sqlite3.Row) -> Optional[str]:
+        """Write the requests that did not succeed to a new input file and submit it."""
+        failed = read_custom_ids(row['input_path']) - successful_custom_ids(row['output_path'])
+        if not failed:
+            return None
+        if row['attempt'] >= self.max_resubmits:
+            logger.error(f"Batch {row['batch_id']}: {len(failed)} requests still failing after {row['attempt']} resubmissions")
+            return None
+        retry_path = os.path.join(self.work_dir, f"{row['batch_id']}_retry{row['attempt'] + 1}_input.jsonl")
+        with open(row['input_path'], 'r', encoding='utf-8') as source, open(retry_path, 'w', encoding='utf-8') as target:
+            for line in source:
+                try:
+                    if json.loads(line)['custom_id'] in failed:
+                        target.write(line)
+                except (json.JSONDecodeError, KeyError):
+                    continue
+        logger.warning(f"Batch {row['batch_id']}: resubmitting {len(failed)} failed requests")
+        return self.submit(retry_path, attempt=row['attempt'] + 1, parent_batch_id=row['batch_id'])
+
+    async def _track(self, batch_id: str) -> None:
+        interval = self.poll_interval
+        last_status = None
+        while True:
+            row = self.store.get(batch_id)
+            if row['status'] in TERMINAL_STATUSES and row['ingested'] and row['resubmitted']:
+                return
+            if row['status'] not in TERMINAL_STATUSES:
+                batch = await asyncio.to_thread(self.client.batches.retrieve, batch_id)
+                if batch.status != last_status:
+                    counts = getattr(batch, 'request_counts', None)
+                    progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+                    logger.info(f"Batch {batch_id}: {batch.status}{progress}")
+                    interval = self.poll_interval
+                    last_status = batch.status
+                else:
+                    interval = min(interval * 2, self.max_poll_interval)
+                if batch.status not in TERMINAL_STATUSES:
+                    await asyncio.sleep(interval)
+                    continue
+                fields = {'status': batch.status}
+                if getattr(batch, 'output_file_id', None):
+                    fields['output_path'] = await asyncio.to_thread(
+                        self._download, batch.output_file_id, os.path.join(self.work_dir, f"{batch_id}_output.jsonl"))
+                if getattr(batch, 'error_file_id', None):
+                    fields['error_path'] = await asyncio.to_thread(
+                        self._download, batch.error_file_id, os.path.join(self.work_dir, f"{batch_id}_errors.jsonl"))
+                self.store.update(batch_id, **fields)
+                row = self.store.get(batch_id)
+
+            if not row['ingested']:
+                if row['output_path'] and self.ingest is not None:
+                    await asyncio.to_thread(self.ingest, row['output_path'])
+                    logger.info(f"Batch {batch_id}: ingested {os.path.basename(row['output_path'])}")
+                self.store.update(batch_id, ingested=1)
+            if not row['resubmitted']:
+                retry_id = await asyncio.to_thread(self._resubmit_failures, self.store.get(batch_id))
+                self.store.update(batch_id, resubmitted=1)
+                if retry_id:
+                    self.tasks[retry_id] = asyncio.create_task(self._track(retry_id))
+            return
+
+    async def run(self) -> None:
+        """Track every unfinished batch in the store until all are ingested and resubmitted."""
+        for row in self.store.unfinished():
+            if row['batch_id'] not in self.tasks:
+                self.tasks[row['batch_id']] = asyncio.create_task(self._track(row['batch_id']))
+        # Resubmissions add tasks while others run, so keep waiting until none are left
+        while True:
+            pending = [task for task in self.tasks.values() if not task.done()]
+            if not pending:
+                break
+            # One batch failing to download or ingest must not abandon tracking of the others
+            await asyncio.gather(*pending, return_exceptions=True)
+        for batch_id, task in self.tasks.items():
+            if not task.cancelled() and task.exception():
+                logger.error(f"Batch tracking failed for {batch_id}: {task.exception()}")
+
+    def summary(self) -> str:
+        rows = self.store.all()
+        counts: Dict[str, int] = {}
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+        return f"{len(rows)} batches: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+
+
+def main():
+    from openai import OpenAI
+    from utils.process_batch_responses import process_batch_responses
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Submit, track and ingest OpenAI batches.")
+    parser.add_argument("--db", required=True, help="SQLite database the batch outputs are ingested into")
+    parser.add_argument("--state", help="Batch state store (default: batch_state.sqlite next to the database)")
+    parser.add_argument("--submit", nargs="*", default=[], help="Batch input JSONL files to submit before tracking")
+    parser.add_argument("--base-url", help="Alternative API base URL, e.g. a local stand-in of the batch endpoints")
+    parser.add_argument("--poll-interval", type=float, default=30)
+    parser.add_argument("--max-resubmits", type=int, default=2)
+    args = parser.parse_args()
+
+    work_dir = os.path.dirname(os.path.abspath(args.db))
+    store = BatchStateStore(args.state or os.path.join(work_dir, "batch_state.sqlite"))
+    client = OpenAI(base_url=args.base_url) if args.base_url else OpenAI()
+    manager = BatchManager(client, store, work_dir,
+                           ingest=lambda output_path: process_batch_responses(output_path, args.db),
+                           poll_interval=args.poll_interval, max_resubmits=args.max_resubmits)
+
+    async def run():
+        if args.submit:
+            await manager.submit_many(args.submit)
+        await manager.run()
+
+    asyncio.run(run())
+    print(manager.summary())
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# paper_prepper/utils/benchmark_extractors.py
+
+import os
+import re
+import json
+import time
+import argparse
+import statistics
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils.html_extractor import EXTRACTORS, extract
+
+# Phrases that indicate page chrome leaked into the extracted text
+BOILERPLATE_MARKERS = [
+    'cookie', 'accept all', 'sign in', 'log in', 'subscribe', 'access through your institution',
+    'purchase pdf', 'rights and permissions', 'share this article', 'download citation',
+    'skip to main content', 'privacy policy', 'terms of use',
+]
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def load_corpus(corpus_dir: str) -> List[Dict[str, Optional[str]]]:
+    """
+    Load saved publisher pages (*.html / *.htm) and optional gold text files.
+
+    A gold file shares the page's stem and ends in .txt, e.g. mdpi_agronomy.html
+    and mdpi_agronomy.txt. It should contain the article body as a human would
+    select it (no menus, no reference list).
+    """
+    corpus = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() not in ('.html', '.htm'):
+            continue
+        with open(os.path.join(corpus_dir, filename), 'r', encoding='utf-8', errors='replace') as f:
+            html = f.read()
+        gold_path = os.path.join(corpus_dir, f"{stem}.txt")
+        gold = None
+        if os.path.exists(gold_path):
+            with open(gold_path, 'r', encoding='utf-8', errors='replace') as f:
+                gold = f.read()
+        corpus.append({'name': stem, 'html': html, 'gold': gold})
+    return corpus
+
+
+def token_f1(extracted: str, gold: str) -> Dict[str, float]:
+    """Bag-of-words precision/recall/F1 of extracted text against the gold text."""
+    extracted_counts = Counter(w.lower() for w in WORD_RE.findall(extracted))
+    gold_counts = Counter(w.lower() for w in WORD_RE.findall(gold))
+    overlap = sum((extracted_counts & gold_counts).values())
+    precision = overlap / max(sum(extracted_counts.values()), 1)
+    recall = overlap / max(sum(gold_counts.values()), 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def boilerplate_hits(text: str) -> int:
+    lowered = text.lower()
+    return sum(lowered.count(marker) for marker in BOILERPLATE_MARKERS)
+
+
+def benchmark(corpus: List[Dict[str, Optional[str]]], backends: List[str], repeats: int = 3) -> Dict[str, Dict]:
+    results = {}
+    for backend in backends:
+        timings, words, hits, f1_scores, pages = [], [], [], [], []
+        for doc in corpus:
+            page_times = []
+            result = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                result = extract(doc['html'], backend=backend)
+                page_times.append(time.perf_counter() - start)
+            text = result['text']
+            page = {
+                'name': doc['name'],
+                'method': result['method'],
+                'median_ms': statistics.median(page_times) * 1000,
+                'words': len(text.split()),
+                'boilerplate_hits': boilerplate_hits(text),
+            }
+            if doc['gold'] is not None:
+                page.update(token_f1(text, doc['gold']))
+                f1_scores.append(page['f1'])
+            timings.append(page['median_ms'])
+            words.append(page['words'])
+            hits.append(page['boilerplate_hits'])
+            pages.append(page)
+
+        results[backend] = {
+            'total_ms': sum(timings),
+            'median_ms': statistics.median(timings) if timings else 0.0,
+            'mean_words': statistics.mean(words) if words else 0.0,
+            'boilerplate_hits': sum(hits),
+            'mean_f1': statistics.mean(f1_scores) if f1_scores else None,
+            'pages': pages,
+        }
+    return results
+
+
+def print_summary(results: Dict[str, Dict]) -> None:
+    print(f"{'backend':<10} {'total ms':>10} {'median ms':>10} {'mean words':>11} {'boilerplate':>12} {'mean F1':>8}")
+    print("-" * 66)
+    for backend, summary in results.items():
+        f1 = f"{summary['mean_f1']:.3f}" if summary['mean_f1'] is not None else "n/a"
+        print(f"{backend:<10} {summary['total_ms']:>10.1f} {summary['median_ms']:>10.2f} "
+              f"{summary['mean_words']:>11.0f} {summary['boilerplate_hits']:>12} {f1:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML text extractors over saved publisher pages.")
+    parser.add_argument("corpus_dir", help="Directory of saved *.html pages with optional gold *.txt files")
+    parser.add_argument("--backends", nargs="+", default=list(EXTRACTORS),
+                        help=f"Backends to compare (default: all of {list(EXTRACTORS)})")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing repeats per page")
+    parser.add_argument("--json", dest="json_path", help="Optional path to write per-page results as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus_dir)
+    if not corpus:
+        print(f"No .html pages found in {args.corpus_dir}")
+        return
+    print(f"Benchmarking {len(corpus)} pages ({sum(1 for d in corpus if d['gold'])} with gold text)\n")
+
+    results = benchmark(corpus, args.backends, repeats=args.repeats)
+    print_summary(results)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nPer-page results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
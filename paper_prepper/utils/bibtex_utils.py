@@ -3,12 +3,23 @@
 import requests
 from typing import Optional
 
+from utils.doi_index import open_default_index, record_to_bibtex
+
+# Blocking helpers for one-off lookups; batch work should use utils.crossref_client.CrossrefClient
+REQUEST_TIMEOUT = 30
+_session = requests.Session()
+
 def get_bibtex_from_doi(doi: str) -> Optional[str]:
     """
-    Fetch BibTeX data for a given DOI using the Crossref API.
+    Fetch BibTeX data for a given DOI, from the offline DOI index when it has
+    the DOI and otherwise using the Crossref API.
     """
+    index = open_default_index()
+    bibtex = index.bibtex(doi) if index else None
+    if bibtex:
+        return bibtex
     url = f"https://api.crossref.org/works/{doi}/transform/application/x-bibtex"
-    response = requests.get(url)
+    response = _session.get(url, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
         return response.text
     return None
@@ -16,10 +27,15 @@ def get_bibtex_from_doi(doi: str) -> Optional[str]:
 def get_bibtex_from_title(title: str, authors: list, year: int) -> Optional[str]:
     """
     Search for a paper using its title, authors, and year, then fetch its BibTeX data using the Crossref API.
+    A title found in the offline DOI index is answered from the index.
     """
+    index = open_default_index()
+    record = index.find_title(title, year) if index else None
+    if record:
+        return record_to_bibtex(record)
     query = f"{title} {' '.join(authors)} {year}"
-    url = f"https://api.crossref.org/works?query={query}&rows=1"
-    response = requests.get(url)
+    url = "https://api.crossref.org/works"
+    response = _session.get(url, params={'query': query, 'rows': 1}, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
         data = response.json()
         if data['message']['items']:
@@ -0,0 +1,126 @@
+# paper_prepper/utils/chunking.py
+
+import re
+import logging
+from dataclasses import dataclass
+from typing import List
+
+from utils.source_index import split_sections
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # pragma: no cover - optional exact tokenizer
+    _ENCODING = None
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+
+def count_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, otherwise about four characters per token."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+@dataclass
+class Chunk:
+    index: int
+    text: str
+    tokens: int
+    headings: List[str]
+
+
+def _split_oversized(paragraph: str, max_tokens: int) -> List[str]:
+    """Split a paragraph that alone exceeds max_tokens at sentence, then word, boundaries."""
+    pieces, current = [], ''
+    for sentence in SENTENCE_RE.split(paragraph):
+        if count_tokens(sentence) > max_tokens:
+            words = sentence.split()
+            step = max(1, len(words) * max_tokens // count_tokens(sentence))
+            units = [' '.join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            units = [sentence]
+        for unit in units:
+            candidate = f"{current} {unit}".strip()
+            if current and count_tokens(candidate) > max_tokens:
+                pieces.append(current)
+                current = unit
+            else:
+                current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_document(text: str, max_tokens: int = 12000) -> List[Chunk]:
+    """
+    Split a document into chunks of at most max_tokens, breaking between
+    sections or paragraphs where possible. Each chunk restates the heading of
+    the section it starts in so the model keeps its bearings.
+    """
+    chunks: List[Chunk] = []
+    parts: List[str] = []
+    headings: List[str] = []
+    used = 0
+
+    def flush():
+        nonlocal parts, headings, used
+        if parts:
+            body = '\n\n'.join(parts)
+            chunks.append(Chunk(index=len(chunks), text=body, tokens=count_tokens(body), headings=headings))
+        parts, headings, used = [], [], 0
+
+    for section in split_sections(text):
+        started = False
+        for paragraph in section.paragraphs:
+            for piece in _split_oversized(paragraph, max_tokens):
+                piece_tokens = count_tokens(piece)
+                if parts and used + piece_tokens > max_tokens:
+                    flush()
+                if section.heading and (not started or not parts):
+                    heading = f"## {section.heading}" if not started else f"## {section.heading} (continued)"
+                    parts.append(heading)
+                    used += count_tokens(heading)
+                    headings.append(section.heading)
+                started = True
+                parts.append(piece)
+                used += piece_tokens
+    flush()
+    return chunks
+
+
+def fit_to_budget(chunks: List[Chunk], token_budget: int) -> List[Chunk]:
+    """
+    Keep as many chunks as fit in token_budget. The first and last chunks
+    (abstract/introduction and conclusions) are kept; the rest are sampled
+    evenly so the whole document is still represented.
+    """
+    total = sum(c.tokens for c in chunks)
+    if total <= token_budget or len(chunks) <= 1:
+        return chunks
+    keep = {0, len(chunks) - 1}
+    used = chunks[0].tokens + chunks[-1].tokens
+    middle = chunks[1:-1]
+    # Take middle chunks in a strided order so the kept ones are spread out
+    stride_order, seen = [], set()
+    step = len(middle)
+    while step >= 1:
+        for i in range(step // 2, len(middle), step):
+            if i not in seen:
+                seen.add(i)
+                stride_order.append(i)
+        step //= 2
+    for i in stride_order:
+        if used + middle[i].tokens > token_budget:
+            continue
+        keep.add(i + 1)
+        used += middle[i].tokens
+    kept = [c for c in chunks if c.index in keep]
+    logger.warning(f"Document of {total} tokens exceeds the {token_budget}-token budget; "
+                   f"analyzing {len(kept)} of {len(chunks)} chunks ({used} tokens)")
+    return kept
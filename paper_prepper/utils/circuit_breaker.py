@@ -0,0 +1,175 @@
+# paper_prepper/utils/circuit_breaker.py
+
+import re
+import time
+import logging
+from collections import deque
+from typing import Dict, Iterable
+
+from utils.url_utils import get_domain
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# HTTP statuses that mean the host is pushing back rather than missing a page
+BLOCKING_STATUSES = {403, 429, 503}
+
+DOI_PREFIX_RE = re.compile(r"doi\.org/(10\.\d{4,9})/", re.IGNORECASE)
+
+
+class CircuitOpen(Exception):
+    """Raised when a request is refused because its domain's circuit is open."""
+
+
+class DomainBlocked(Exception):
+    """Raised by a scrape tier when the host answers with a blocking HTTP status."""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status = status
+
+
+class _DomainCircuit:
+    def __init__(self, window: int, cooldown: float):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = cooldown
+        self.probe_in_flight = False
+        self.last_reason = ''
+
+
+class DomainCircuitBreaker:
+    """
+    Per-domain circuit breaker for the scrapers.
+
+    Only blocking statuses, captchas and timeouts count as failures, and
+    callers record at most one failure per URL per scrape. A domain's circuit
+    opens after `consecutive_failures` such failures in a row, or when at
+    least `failure_ratio` of the last `window` outcomes were failures. While open, its URLs should be deferred. After `cooldown` seconds
+    one half-open probe is let through: success closes the circuit, failure
+    reopens it with the cooldown doubled up to `max_cooldown`.
+    """
+
+    def __init__(self, consecutive_failures: int = 3, window: int = 10, failure_ratio: float = 0.6,
+                 cooldown: float = 300.0, max_cooldown: float = 3600.0):
+        self.consecutive_failures = consecutive_failures
+        self.window = window
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.circuits: Dict[str, _DomainCircuit] = {}
+        # doi.org links are attributed to the publisher their DOI prefix last resolved to,
+        # and are not tracked until a link with that prefix has resolved once
+        self.doi_prefix_domains: Dict[str, str] = {}
+
+    def domain_for(self, url: str) -> str:
+        match = DOI_PREFIX_RE.search(url)
+        if match and match.group(1) in self.doi_prefix_domains:
+            return self.doi_prefix_domains[match.group(1)]
+        return get_domain(url)
+
+    def _key(self, url: str):
+        """Circuit key for a URL; None for a DOI link whose publisher is not known yet."""
+        match = DOI_PREFIX_RE.search(url)
+        if match and match.group(1) not in self.doi_prefix_domains:
+            # Keying these on doi.org would let one bad DOI open the circuit for every unresolved DOI
+            return None
+        return self.domain_for(url)
+
+    def learn_resolution(self, url: str, final_url: str) -> None:
+        """Remember which publisher a DOI prefix redirects to."""
+        match = DOI_PREFIX_RE.search(url)
+        final_domain = get_domain(final_url) if final_url else ''
+        if match and final_domain and final_domain not in ('doi.org', 'dx.doi.org'):
+            self.doi_prefix_domains[match.group(1)] = final_domain
+
+    def _circuit(self, url: str) -> _DomainCircuit:
+        domain = self._key(url)
+        if domain is None:
+            # Untracked: a fresh closed circuit that nothing is recorded against
+            return _DomainCircuit(self.window, self.cooldown)
+        if domain not in self.circuits:
+            self.circuits[domain] = _DomainCircuit(self.window, self.cooldown)
+        return self.circuits[domain]
+
+    def state(self, url: str) -> str:
+        return self._circuit(url).state
+
+    def seconds_until_retry(self, url: str) -> float:
+        circuit = self._circuit(url)
+        if circuit.state != OPEN:
+            return 0.0
+        return max(circuit.opened_at + circuit.cooldown - time.monotonic(), 0.0)
+
+    def blocked(self, url: str) -> bool:
+        """True if a request to this URL's domain should be deferred right now."""
+        circuit = self._circuit(url)
+        if circuit.state == OPEN:
+            return self.seconds_until_retry(url) > 0
+        return circuit.state == HALF_OPEN and circuit.probe_in_flight
+
+    def acquire(self, url: str) -> bool:
+        """
+        Ask permission for one request. In the half-open state only a single
+        probe is admitted until its outcome is recorded or it is released.
+        """
+        circuit = self._circuit(url)
+        if circuit.state == OPEN:
+            if self.seconds_until_retry(url) > 0:
+                return False
+            circuit.state = HALF_OPEN
+            circuit.probe_in_flight = False
+            logger.info(f"Circuit for {self.domain_for(url)} half-open; sending a probe")
+        if circuit.state == HALF_OPEN:
+            if circuit.probe_in_flight:
+                return False
+            circuit.probe_in_flight = True
+        return True
+
+    def release(self, url: str) -> None:
+        """Give back a probe slot when the request ended without a usable outcome."""
+        self._circuit(url).probe_in_flight = False
+
+    def record_success(self, url: str) -> None:
+        circuit = self._circuit(url)
+        circuit.outcomes.append(True)
+        circuit.consecutive_failures = 0
+        if circuit.state == HALF_OPEN:
+            logger.info(f"Circuit for {self.domain_for(url)} closed after successful probe")
+            circuit.state = CLOSED
+            circuit.cooldown = self.cooldown
+            circuit.outcomes.clear()
+        circuit.probe_in_flight = False
+
+    def record_failure(self, url: str, reason: str = '') -> None:
+        circuit = self._circuit(url)
+        circuit.outcomes.append(False)
+        circuit.consecutive_failures += 1
+        circuit.last_reason = reason
+        circuit.probe_in_flight = False
+        if circuit.state == HALF_OPEN:
+            circuit.cooldown = min(circuit.cooldown * 2, self.max_cooldown)
+            self._open(url, circuit, f"probe failed ({reason})")
+            return
+        failures = circuit.outcomes.count(False)
+        ratio_tripped = len(circuit.outcomes) >= self.window and failures / len(circuit.outcomes) >= self.failure_ratio
+        if circuit.state == CLOSED and (circuit.consecutive_failures >= self.consecutive_failures or ratio_tripped):
+            self._open(url, circuit, reason)
+
+    def _open(self, url: str, circuit: _DomainCircuit, reason: str) -> None:
+        circuit.state = OPEN
+        circuit.opened_at = time.monotonic()
+        logger.warning(f"Circuit for {self.domain_for(url)} opened for {circuit.cooldown:.0f}s: {reason}")
+
+    def next_retry_delay(self, urls: Iterable[str]) -> float:
+        """Shortest wait until any of the given URLs' domains admits a probe."""
+        delays = [self.seconds_until_retry(url) for url in urls]
+        return min(delays) if delays else 0.0
+
+    def summary(self) -> Dict[str, str]:
+        return {domain: circuit.state for domain, circuit in self.circuits.items()}
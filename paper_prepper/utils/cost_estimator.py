@@ -0,0 +1,125 @@
+# paper_prepper/utils/cost_estimator.py
+
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from utils.chunking import _ENCODING
+
+logger = logging.getLogger(__name__)
+
+# USD per million (input, output) tokens at standard rates; Batch API requests cost BATCH_DISCOUNT of that
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+BATCH_DISCOUNT = 0.5
+# Context windows in tokens; a single request over its model's limit fails outright
+CONTEXT_LIMITS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1-mini": 1047576,
+    "gpt-4.1": 1047576,
+    "gpt-4.1-nano": 1047576,
+}
+# Threads tiktoken may use to encode a corpus
+ENCODE_THREADS = 8
+
+
+def count_tokens_batch(texts: Sequence[str]) -> np.ndarray:
+    """
+    Token counts for many texts at once, matching utils.chunking.count_tokens:
+    tiktoken's multithreaded batch encoder when installed, otherwise about
+    four characters per token computed over the whole array.
+    """
+    texts = [text or '' for text in texts]
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    if _ENCODING is not None:
+        encoded = _ENCODING.encode_ordinary_batch(texts, num_threads=ENCODE_THREADS)
+        return np.fromiter((len(tokens) for tokens in encoded), dtype=np.int64, count=len(texts))
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    return np.where(lengths > 0, lengths // 4 + 1, 0)
+
+
+@dataclass
+class RunEstimate:
+    """Per-item token counts for a planned run; an item is a paper or a reference and may span several requests."""
+    labels: List[str]
+    input_tokens: np.ndarray
+    output_tokens: np.ndarray
+    requests: np.ndarray
+    # Input tokens of each item's largest single request, checked against context limits
+    largest_request: np.ndarray
+
+    @classmethod
+    def from_prompts(cls, labels: List[str], prompts: List[List[str]], output_tokens_per_request: int) -> 'RunEstimate':
+        """Estimate from the exact prompts each item will send, counted in one vectorized pass."""
+        counts = np.fromiter((len(p) for p in prompts), dtype=np.int64, count=len(prompts))
+        flat = count_tokens_batch([prompt for item in prompts for prompt in item])
+        owner = np.repeat(np.arange(len(prompts)), counts)
+        input_tokens = np.bincount(owner, weights=flat, minlength=len(prompts)).astype(np.int64)
+        largest = np.zeros(len(prompts), dtype=np.int64)
+        np.maximum.at(largest, owner, flat)
+        return cls(labels, input_tokens, counts * output_tokens_per_request, counts, largest)
+
+    @property
+    def total_input(self) -> int:
+        return int(self.input_tokens.sum())
+
+    @property
+    def total_output(self) -> int:
+        return int(self.output_tokens.sum())
+
+    def cost(self, model: str, batch: bool = False) -> float:
+        input_price, output_price = MODEL_PRICES[model]
+        cost = (self.total_input * input_price + self.total_output * output_price) / 1e6
+        return cost * BATCH_DISCOUNT if batch else cost
+
+    def over_context(self, model: str) -> List[int]:
+        """Indices of items with a request over the model's context window (prompt plus expected output)."""
+        limit = CONTEXT_LIMITS.get(model)
+        if limit is None:
+            return []
+        per_request_output = np.divide(self.output_tokens, np.maximum(self.requests, 1))
+        return [int(i) for i in np.flatnonzero(self.largest_request + per_request_output > limit)]
+
+    def report(self, model: str, batch: bool = False, top: Optional[int] = None) -> str:
+        """Totals, cost per model, per-item tokens (the `top` largest, or all) and items over the context limit."""
+        lines = [
+            f"{len(self.labels)} items, {int(self.requests.sum())} requests",
+            f"Input tokens: {self.total_input:,} (mean {self.input_tokens.mean() if len(self.labels) else 0:,.0f}, "
+            f"max {self.input_tokens.max() if len(self.labels) else 0:,} per item)",
+            f"Expected output tokens: {self.total_output:,}",
+            f"Projected cost ({'Batch API' if batch else 'standard'} pricing):",
+        ]
+        for name in MODEL_PRICES:
+            marker = "  <- configured" if name == model else ""
+            lines.append(f"  {name:<14} ${self.cost(name, batch):>10.2f}{marker}")
+        if len(self.labels):
+            lines.append("Input tokens per item, largest first:")
+            for i in np.argsort(self.input_tokens)[::-1][:top]:
+                lines.append(f"  {self.labels[i]}\t{int(self.input_tokens[i]):,} tokens in {int(self.requests[i])} request(s)")
+        over = self.over_context(model)
+        lines.append(f"{len(over)} items exceed the {CONTEXT_LIMITS.get(model, '?')}-token context of {model}")
+        for i in over:
+            lines.append(f"  {self.labels[i]}\t{int(self.largest_request[i]):,} tokens in one request")
+        return "\n".join(lines)
+
+
+def exceeds_budget(estimate: RunEstimate, model: str, budget: Optional[float], batch: bool = False) -> bool:
+    """True (and logged) when the projected cost of the run is over budget; no budget never blocks."""
+    if budget is None:
+        return False
+    cost = estimate.cost(model, batch)
+    if cost > budget:
+        logger.error(f"Projected cost ${cost:.2f} for {estimate.total_input:,} input tokens exceeds the "
+                     f"${budget:.2f} budget; nothing was sent")
+        return True
+    logger.info(f"Projected cost ${cost:.2f} is within the ${budget:.2f} budget")
+    return False
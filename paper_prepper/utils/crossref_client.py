@@ -0,0 +1,208 @@
+# paper_prepper/utils/crossref_client.py
+
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import aiohttp
+from aiohttp import ClientTimeout
+
+from utils.doi_index import DOIIndex, open_default_index
+
+logger = logging.getLogger(__name__)
+
+CROSSREF_API = "https://api.crossref.org"
+# Crossref asks clients to keep concurrent requests low; the polite pool is
+# used when requests identify a contact address (CROSSREF_MAILTO)
+DEFAULT_CONCURRENCY = 5
+DEFAULT_TIMEOUT = 30
+MAX_RETRIES = 4
+# Queries that found no DOI are retried after this long, in case Crossref gained the work
+NEGATIVE_CACHE_SECONDS = 30 * 24 * 3600
+
+
+class CrossrefCache:
+    """Persistent SQLite cache of DOI -> BibTeX and search query -> DOI lookups."""
+
+    def __init__(self, path: Optional[str]):
+        self.enabled = path is not None
+        self.lock = threading.Lock()
+        self.conn = None
+        if self.enabled:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS bibtex (doi TEXT PRIMARY KEY, bibtex TEXT, fetched REAL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, doi TEXT, fetched REAL)")
+            self.conn.commit()
+
+    def get_bibtex(self, doi: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT bibtex FROM bibtex WHERE doi = ?", (doi.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def put_bibtex(self, doi: str, bibtex: str) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO bibtex VALUES (?, ?, ?)", (doi.lower(), bibtex, time.time()))
+            self.conn.commit()
+
+    def get_query(self, query: str) -> Tuple[bool, Optional[str]]:
+        """(found, doi): found is False when the query is not cached or its negative entry expired."""
+        if not self.enabled:
+            return False, None
+        with self.lock:
+            row = self.conn.execute("SELECT doi, fetched FROM queries WHERE query = ?", (query,)).fetchone()
+        if row is None or (row[0] is None and time.time() - row[1] > NEGATIVE_CACHE_SECONDS):
+            return False, None
+        return True, row[0]
+
+    def put_query(self, query: str, doi: Optional[str]) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO queries VALUES (?, ?, ?)", (query, doi, time.time()))
+            self.conn.commit()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.enabled = False
+
+
+def build_query(title: str, authors: Sequence[str], year) -> str:
+    """The search string get_bibtex_from_title has always sent."""
+    return f"{title} {' '.join(authors)} {year}"
+
+
+class CrossrefClient:
+    """
+    Async Crossref client over one pooled aiohttp session.
+
+    Requests identify a contact address for Crossref's polite pool, at most
+    max_concurrency are in flight, 429/5xx responses are retried honoring
+    Retry-After, and lookups are cached in a CrossrefCache. A DOIIndex (by
+    default the one at $DOI_INDEX_PATH) is consulted before either. Use as
+    `async with CrossrefClient(cache_path) as crossref:`.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, mailto: Optional[str] = None,
+                 max_concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                 index: Optional[DOIIndex] = None):
+        self.cache = CrossrefCache(cache_path)
+        self.index = index if index is not None else open_default_index()
+        self.mailto = mailto or os.getenv('CROSSREF_MAILTO')
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.cache_hits = 0
+        self.index_hits = 0
+
+    async def __aenter__(self) -> 'CrossrefClient':
+        agent = "paper_prepper/0.1"
+        if self.mailto:
+            agent += f" (mailto:{self.mailto})"
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=ClientTimeout(total=self.timeout),
+            headers={'User-Agent': agent},
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.cache.close()
+
+    async def _get(self, url: str, params: Optional[dict] = None, as_json: bool = False):
+        """GET with retries; the body (text or JSON) on 200, None on any other final status."""
+        if self.mailto:
+            params = dict(params or {}, mailto=self.mailto)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with self.semaphore:
+                    self.requests += 1
+                    async with self.session.get(url, params=params) as response:
+                        if response.status == 200:
+                            return await (response.json(content_type=None) if as_json else response.text())
+                        if response.status not in (429, 500, 502, 503, 504):
+                            logger.debug(f"Crossref returned {response.status} for {url}")
+                            return None
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Crossref request failed for {url}: {str(e)}")
+                retry_after = None
+            if attempt == MAX_RETRIES:
+                break
+            try:
+                delay = float(retry_after) if retry_after else 2 ** attempt
+            except ValueError:
+                delay = 2 ** attempt
+            await asyncio.sleep(delay)
+        logger.error(f"Crossref request gave up after {MAX_RETRIES + 1} attempts: {url}")
+        return None
+
+    async def bibtex_for_doi(self, doi: str) -> Optional[str]:
+        if self.index is not None:
+            bibtex = self.index.bibtex(doi)
+            if bibtex:
+                self.index_hits += 1
+                return bibtex
+        cached = self.cache.get_bibtex(doi)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        bibtex = await self._get(f"{CROSSREF_API}/works/{quote(doi, safe='/')}/transform/application/x-bibtex")
+        if bibtex:
+            self.cache.put_bibtex(doi, bibtex)
+        return bibtex
+
+    async def doi_for_title(self, title: str, authors: Sequence[str], year) -> Optional[str]:
+        if self.index is not None:
+            record = self.index.find_title(title, year)
+            if record:
+                self.index_hits += 1
+                return record['doi']
+        query = build_query(title, authors, year)
+        found, doi = self.cache.get_query(query)
+        if found:
+            self.cache_hits += 1
+            return doi
+        data = await self._get(f"{CROSSREF_API}/works", {'query': query, 'rows': 1, 'select': 'DOI'}, as_json=True)
+        if data is None:
+            return None
+        items = data.get('message', {}).get('items') or []
+        doi = items[0].get('DOI') if items else None
+        self.cache.put_query(query, doi)
+        return doi
+
+    async def bibtex_for_title(self, title: str, authors: Sequence[str], year) -> Optional[str]:
+        doi = await self.doi_for_title(title, authors, year)
+        return await self.bibtex_for_doi(doi) if doi else None
+
+    async def bibtex_many(self, works: List[Tuple[str, Sequence[str], object]]) -> List[Optional[str]]:
+        """BibTeX for many (title, authors, year) works at once, in order; failures give None."""
+        async def lookup(title, authors, year):
+            try:
+                return await self.bibtex_for_title(title, authors, year)
+            except Exception as e:
+                logger.warning(f"Failed to generate BibTeX for {title}: {str(e)}")
+                return None
+        results = await asyncio.gather(*(lookup(*work) for work in works))
+        logger.info(f"Crossref: {sum(r is not None for r in results)}/{len(works)} BibTeX entries found, "
+                    f"{self.requests} requests, {self.cache_hits} cache hits, {self.index_hits} index hits")
+        return results
@@ -0,0 +1,336 @@
+# paper_prepper/utils/doi_index.py
+
+import os
+import re
+import json
+import mmap
+import struct
+import argparse
+import logging
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from unidecode import unidecode
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DOIIDX01"
+# magic, record count, then offset and length of: records, DOI keys, DOI table, title keys, title table
+HEADER = struct.Struct("<8sQ10Q")
+# One sorted lookup table row: key position in its key blob, record position in the record blob
+TABLE_DTYPE = np.dtype([('key_offset', '<u8'), ('key_length', '<u4'), ('record_offset', '<u8'), ('record_length', '<u4')])
+
+# Index used by bibtex_utils, crossref_client and the scraper when no path is given
+DEFAULT_INDEX_ENV = "DOI_INDEX_PATH"
+
+DOI_PREFIX_RE = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+DOI_IN_URL_RE = re.compile(r"(10\.\d{4,9}/[^\s?#]+)")
+TITLE_STRIP_RE = re.compile(r"[^a-z0-9]+")
+
+BIBTEX_TYPES = {
+    'journal-article': 'article',
+    'proceedings-article': 'inproceedings',
+    'book-chapter': 'incollection',
+    'book': 'book',
+    'monograph': 'book',
+    'dissertation': 'phdthesis',
+    'report': 'techreport',
+}
+
+
+def normalize_doi(doi: str) -> str:
+    return DOI_PREFIX_RE.sub('', (doi or '').strip()).strip().lower()
+
+
+def normalize_title(title: str) -> str:
+    return TITLE_STRIP_RE.sub(' ', unidecode(title or '').lower()).strip()
+
+
+def doi_from_link(link: str) -> Optional[str]:
+    """The DOI in a bare DOI, doi: link or doi.org URL, else None."""
+    lowered = link.strip().lower()
+    if not (lowered.startswith('10.') or lowered.startswith('doi:') or 'doi.org/' in lowered):
+        return None
+    match = DOI_IN_URL_RE.search(link)
+    return normalize_doi(match.group(1)) if match else None
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def compact_record(item: Dict) -> Optional[Dict]:
+    """
+    The fields kept from one dump record: Crossref work metadata, plus
+    open-access locations in Unpaywall style (oa_locations) or Crossref
+    full-text links with a PDF content type.
+    """
+    doi = normalize_doi(item.get('DOI') or item.get('doi') or '')
+    if not doi:
+        return None
+    year = None
+    for key in ('issued', 'published-print', 'published-online', 'published'):
+        parts = (item.get(key) or {}).get('date-parts') or [[None]]
+        if parts and parts[0] and parts[0][0]:
+            year = parts[0][0]
+            break
+    year = year or item.get('year')
+    authors = [
+        {'given': a.get('given'), 'family': a.get('family') or a.get('name')}
+        for a in item.get('author') or [] if a.get('family') or a.get('name')
+    ]
+    pdf_urls, landing_urls = [], []
+    for location in item.get('oa_locations') or []:
+        if location.get('url_for_pdf'):
+            pdf_urls.append(location['url_for_pdf'])
+        elif location.get('url'):
+            landing_urls.append(location['url'])
+    for link in item.get('link') or []:
+        if link.get('URL') and 'pdf' in (link.get('content-type') or ''):
+            pdf_urls.append(link['URL'])
+    record = {
+        'doi': doi,
+        'title': _first(item.get('title')),
+        'authors': authors,
+        'year': year,
+        'container': _first(item.get('container-title') or item.get('journal_name')),
+        'type': item.get('type') or item.get('genre'),
+        'publisher': item.get('publisher'),
+        'volume': item.get('volume'),
+        'issue': item.get('issue'),
+        'pages': item.get('page'),
+        'pdf_urls': list(dict.fromkeys(pdf_urls)),
+        'landing_urls': list(dict.fromkeys(landing_urls)),
+    }
+    return {key: value for key, value in record.items() if value not in (None, [], '')}
+
+
+def iter_dump(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed dump line {line_number}: {str(e)}")
+                continue
+            record = compact_record(item)
+            if record is not None:
+                yield record
+
+
+def _write_table(out, keys: List[Tuple[bytes, int, int]], base: int) -> Tuple[int, int, int, int]:
+    """Write a key blob and its sorted table; returns (key offset, key length, table offset, table length)."""
+    keys.sort(key=lambda entry: entry[0])
+    table = np.zeros(len(keys), dtype=TABLE_DTYPE)
+    key_offset = base
+    position = 0
+    for i, (key, record_offset, record_length) in enumerate(keys):
+        out.write(key)
+        table[i] = (position, len(key), record_offset, record_length)
+        position += len(key)
+    table_offset = key_offset + position
+    out.write(table.tobytes())
+    return key_offset, position, table_offset, table.nbytes
+
+
+def build_index(dump_path: str, index_path: str) -> int:
+    """
+    Build an index file from a JSONL metadata dump. Records are stored once as
+    compact JSON; two sorted tables (normalized DOI, normalized title) point
+    into them. Later records for the same DOI replace earlier ones.
+    Returns the number of records indexed.
+    """
+    latest: Dict[bytes, Tuple[int, int, bytes]] = {}
+    directory = os.path.dirname(os.path.abspath(index_path))
+    with tempfile.TemporaryFile(dir=directory) as records:
+        for record in iter_dump(dump_path):
+            payload = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            offset = records.tell()
+            records.write(payload)
+            latest[record['doi'].encode('utf-8')] = (offset, len(payload),
+                                                      normalize_title(record.get('title', '')).encode('utf-8'))
+        records_length = records.tell()
+        records.seek(0)
+
+        doi_keys = [(doi, offset, length) for doi, (offset, length, _) in latest.items()]
+        title_keys = [(title, offset, length) for offset, length, title in latest.values() if title]
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(b"\0" * HEADER.size)
+            while True:
+                block = records.read(1024 * 1024)
+                if not block:
+                    break
+                out.write(block)
+            doi_section = _write_table(out, doi_keys, HEADER.size + records_length)
+            title_section = _write_table(out, title_keys, doi_section[2] + doi_section[3])
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, len(doi_keys), HEADER.size, records_length, *doi_section, *title_section))
+        os.replace(tmp_path, index_path)
+    logger.info(f"Indexed {len(doi_keys)} records ({len(title_keys)} titles) from {dump_path} into {index_path}")
+    return len(doi_keys)
+
+
+class DOIIndex:
+    """Read-only, memory-mapped lookup of dump metadata by normalized DOI or title."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count, self.records_offset, _, doi_keys, _, doi_table, doi_table_length,
+         title_keys, _, title_table, title_table_length) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a DOI index")
+        self.doi_keys = doi_keys
+        self.doi_table = np.frombuffer(self.map, TABLE_DTYPE, doi_table_length // TABLE_DTYPE.itemsize, doi_table)
+        self.title_keys = title_keys
+        self.title_table = np.frombuffer(self.map, TABLE_DTYPE, title_table_length // TABLE_DTYPE.itemsize, title_table)
+
+    def _key_at(self, table: np.ndarray, keys_offset: int, i: int) -> bytes:
+        start = keys_offset + int(table[i]['key_offset'])
+        return self.map[start:start + int(table[i]['key_length'])]
+
+    def _record_at(self, table: np.ndarray, i: int) -> Dict:
+        start = self.records_offset + int(table[i]['record_offset'])
+        return json.loads(self.map[start:start + int(table[i]['record_length'])])
+
+    def _matches(self, table: np.ndarray, keys_offset: int, key: bytes) -> Iterator[Dict]:
+        """Records of every row whose key equals key, found by binary search for the first one."""
+        low, high = 0, len(table)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(table, keys_offset, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        while low < len(table) and self._key_at(table, keys_offset, low) == key:
+            yield self._record_at(table, low)
+            low += 1
+
+    def get(self, doi: str) -> Optional[Dict]:
+        key = normalize_doi(doi)
+        return next(self._matches(self.doi_table, self.doi_keys, key.encode('utf-8')), None) if key else None
+
+    def find_title(self, title: str, year=None) -> Optional[Dict]:
+        """
+        Record with exactly this normalized title. Several works can share a
+        title; with a year, the one from that year wins, then one without a
+        year, and records from other years are never returned.
+        """
+        key = normalize_title(title)
+        if not key:
+            return None
+        undated = None
+        for record in self._matches(self.title_table, self.title_keys, key.encode('utf-8')):
+            if not year:
+                return record
+            if not record.get('year'):
+                undated = undated or record
+            elif str(record['year']) == str(year):
+                return record
+        return undated
+
+    def bibtex(self, doi: str) -> Optional[str]:
+        record = self.get(doi)
+        return record_to_bibtex(record) if record else None
+
+    def preferred_url(self, doi: str) -> Optional[str]:
+        """Best known open-access location: a PDF first, then a landing page."""
+        record = self.get(doi)
+        if not record:
+            return None
+        urls = record.get('pdf_urls', []) + record.get('landing_urls', [])
+        return urls[0] if urls else None
+
+    def close(self) -> None:
+        self.doi_table = self.title_table = None
+        self.map.close()
+        self.file.close()
+
+
+def record_to_bibtex(record: Dict) -> str:
+    """BibTeX in the layout of Crossref's x-bibtex transform."""
+    authors = record.get('authors', [])
+    first = (authors[0].get('family') if authors else None) or 'anon'
+    key = re.sub(r'[^A-Za-z0-9]', '', unidecode(first))
+    if record.get('year'):
+        key += f"_{record['year']}"
+    fields = [
+        ('title', record.get('title')),
+        ('volume', record.get('volume')),
+        ('url', f"http://dx.doi.org/{record['doi']}"),
+        ('DOI', record['doi']),
+        ('number', record.get('issue')),
+        ('journal' if BIBTEX_TYPES.get(record.get('type')) == 'article' else 'booktitle', record.get('container')),
+        ('publisher', record.get('publisher')),
+        ('author', " and ".join(
+            f"{a['family']}, {a['given']}" if a.get('given') else a['family'] for a in authors)),
+        ('year', record.get('year')),
+        ('pages', record.get('pages')),
+    ]
+    body = ", ".join(f"{name}={{{value}}}" for name, value in fields if value)
+    return f"@{BIBTEX_TYPES.get(record.get('type'), 'misc')}{{{key}, {body} }}"
+
+
+def indexed_urls(index: Optional[DOIIndex], links: List[str]) -> List[str]:
+    """Open-access locations the index knows for the DOI links among links, not already in links."""
+    if index is None:
+        return []
+    found = []
+    for link in links:
+        doi = doi_from_link(link)
+        url = index.preferred_url(doi) if doi else None
+        if url and url not in links and url not in found:
+            found.append(url)
+    return found
+
+
+_default_index = None
+# Set when opening the index failed, so callers asking once per paper do not retry and warn every time
+_UNAVAILABLE = object()
+
+
+def open_default_index(path: Optional[str] = None) -> Optional[DOIIndex]:
+    """The index at path (default $DOI_INDEX_PATH), opened once; None when unset or unreadable."""
+    global _default_index
+    if _default_index is None:
+        path = path or os.getenv(DEFAULT_INDEX_ENV)
+        if not path:
+            return None
+        try:
+            _default_index = DOIIndex(path)
+            logger.info(f"Using DOI index {path} ({_default_index.count} records)")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not open DOI index {path}: {str(e)}; continuing without it")
+            _default_index = _UNAVAILABLE
+    return None if _default_index is _UNAVAILABLE else _default_index
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or query an offline DOI metadata index.")
+    parser.add_argument("index", help="Index file")
+    parser.add_argument("--build", metavar="DUMP", help="Crossref-style JSONL dump to build the index from")
+    parser.add_argument("--doi", help="Print the record and BibTeX for a DOI")
+    parser.add_argument("--title", help="Print the record for a title")
+    args = parser.parse_args()
+
+    if args.build:
+        build_index(args.build, args.index)
+    index = DOIIndex(args.index)
+    if args.doi:
+        print(json.dumps(index.get(args.doi), indent=2, ensure_ascii=False))
+        print(index.bibtex(args.doi))
+    if args.title:
+        print(json.dumps(index.find_title(args.title), indent=2, ensure_ascii=False))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
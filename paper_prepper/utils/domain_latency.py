@@ -0,0 +1,102 @@
+# paper_prepper/utils/domain_latency.py
+
+import os
+import json
+import random
+import logging
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+
+from utils.url_utils import get_domain
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Linear-interpolated percentile of a non-empty list, q in [0, 1]."""
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class LatencyTracker:
+    """
+    Rolling latency window per (domain, tier) used to derive timeouts and retry
+    backoff from observed percentiles instead of fixed multiples.
+
+    Timed-out attempts are recorded at the timeout value, a lower bound on the
+    real latency, so a slow host pushes its own timeout up. Learned windows are
+    persisted as JSON so later runs start from what earlier runs observed.
+    """
+
+    def __init__(self, path: Optional[str] = None, window: int = 50, min_samples: int = 5,
+                 timeout_percentile: float = 0.95, timeout_multiplier: float = 1.5,
+                 timeout_floor: float = 5.0, timeout_ceiling: float = 180.0,
+                 backoff_floor: float = 1.0, backoff_ceiling: float = 60.0):
+        self.path = path
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.timeout_floor = timeout_floor
+        self.timeout_ceiling = timeout_ceiling
+        self.backoff_floor = backoff_floor
+        self.backoff_ceiling = backoff_ceiling
+        self.samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=self.window))
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for key, values in json.load(f).items():
+                        self.samples[key].extend(values)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not load latency history from {path}: {str(e)}")
+
+    @staticmethod
+    def _key(url: str, tier: str) -> str:
+        return f"{get_domain(url)}|{tier}"
+
+    def record(self, url: str, tier: str, seconds: float) -> None:
+        self.samples[self._key(url, tier)].append(round(seconds, 3))
+
+    def record_timeout(self, url: str, tier: str, timeout: float) -> None:
+        self.record(url, tier, timeout)
+
+    def _clamp(self, value: float, floor: float, ceiling: float) -> float:
+        return max(floor, min(value, ceiling))
+
+    def timeout_for(self, url: str, tier: str, default: float, attempt: int = 1) -> float:
+        """Timeout for this attempt: the configured default until enough samples exist."""
+        samples = self.samples.get(self._key(url, tier))
+        if not samples or len(samples) < self.min_samples:
+            return default
+        learned = percentile(list(samples), self.timeout_percentile) * self.timeout_multiplier
+        # Later attempts get more headroom, like the fixed schedule did
+        learned *= 1 + 0.5 * (attempt - 1)
+        return self._clamp(learned, self.timeout_floor, self.timeout_ceiling)
+
+    def backoff_for(self, url: str, tier: str, attempt: int, default_range: Tuple[float, float]) -> float:
+        """Jittered wait before the next attempt, scaled from the domain's median latency."""
+        samples = self.samples.get(self._key(url, tier))
+        if not samples or len(samples) < self.min_samples:
+            return random.uniform(*default_range) * attempt
+        base = percentile(list(samples), 0.5) * 0.5
+        return self._clamp(random.uniform(0.5, 1.5) * base * attempt, self.backoff_floor, self.backoff_ceiling)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            key: {'samples': len(values), 'p50': percentile(list(values), 0.5),
+                  'p95': percentile(list(values), 0.95)}
+            for key, values in self.samples.items() if values
+        }
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({key: list(values) for key, values in self.samples.items()}, f, indent=2, sort_keys=True)
+            logger.info(f"Latency history saved to {self.path}")
+        except OSError as e:
+            logger.error(f"Failed to save latency history: {str(e)}")
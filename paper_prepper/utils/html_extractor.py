@@ -0,0 +1,304 @@
+# paper_prepper/utils/html_extractor.py
+
+import re
+import logging
+from typing import Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:  # pragma: no cover - optional C-accelerated backend
+    HAS_LXML = False
+
+logger = logging.getLogger(__name__)
+
+# Tags that never hold paper content
+BOILERPLATE_TAGS = [
+    'script', 'style', 'noscript', 'nav', 'footer', 'header', 'aside',
+    'button', 'iframe', 'svg', 'select', 'template',
+]
+# Forms are dropped only when they look like search or login boxes: ASP.NET
+# pages wrap the whole article in one <form>, so forms are not dropped wholesale
+FORM_MIN_WORDS = 50
+FORM_MAX_LINK_DENSITY = 0.5
+FORM_INPUT_TAGS = ('input', 'select', 'textarea', 'button')
+# Words per input below which a form counts as controls rather than content
+FORM_MIN_WORDS_PER_INPUT = 20
+
+# Class/id patterns used by readability-style scoring
+NEGATIVE_RE = re.compile(
+    r"comment|cookie|consent|gdpr|banner|menu|navbar|sidebar|footer|masthead|"
+    r"share|social|related|recommend|promo|advert|sponsor|popup|modal|breadcrumb|"
+    r"skip|toolbar|signin|login|subscribe|newsletter|metrics|altmetric|widget",
+    re.IGNORECASE,
+)
+POSITIVE_RE = re.compile(
+    r"article|body|content|main|fulltext|full-text|abstract|section|paper|text|entry",
+    re.IGNORECASE,
+)
+# Reference lists inflate word counts without adding content worth analysing
+REFERENCES_RE = re.compile(
+    r"ref-list|references|bibliography|citedby|cited-by|reference-list",
+    re.IGNORECASE,
+)
+
+# Publisher and JATS containers that hold the article body, most specific first
+PREFERRED_XPATHS = [
+    '//*[@itemprop="articleBody"]',
+    '//*[contains(@class, "jats") and (self::div or self::section or self::article)]',
+    '//div[contains(@class, "c-article-body")]',  # Springer / Nature
+    '//div[contains(@class, "html-body")]',  # MDPI
+    '//section[contains(@class, "article-section__content")]/..',  # Wiley
+    '//div[@id="body" or @id="article-body" or @id="maincontent"]',  # ScienceDirect / PMC
+    '//div[contains(@class, "article-body") or contains(@class, "articleBody")]',
+    '//div[contains(@class, "fulltext") or contains(@class, "full-text")]',
+]
+
+# Minimum number of words for a preferred container or scored candidate to be trusted
+MIN_MAIN_CONTENT_WORDS = 50
+
+
+def _normalize_text(parts) -> str:
+    """Join text fragments the way BeautifulSoup's get_text(' ', strip=True) does."""
+    return ' '.join(s.strip() for s in parts if s and s.strip())
+
+
+def _class_and_id(el) -> str:
+    return f"{el.get('class', '')} {el.get('id', '')}"
+
+
+def _get_citation_metadata(doc) -> Dict[str, str]:
+    """Collect Highwire/Dublin Core citation_* meta tags (title, abstract, doi, ...)."""
+    metadata = {}
+    for meta in doc.iter('meta'):
+        name = (meta.get('name') or meta.get('property') or '').lower()
+        content = (meta.get('content') or '').strip()
+        if not content:
+            continue
+        if name.startswith('citation_'):
+            key = name[len('citation_'):]
+            # Repeated tags such as citation_author accumulate
+            metadata[key] = f"{metadata[key]}; {content}" if key in metadata else content
+        elif name in ('dc.description', 'description') and 'abstract' not in metadata:
+            metadata['abstract'] = content
+    return metadata
+
+
+def _is_boilerplate_form(words: int, link_words: int, inputs: int) -> bool:
+    """Readability-style conditional cleaning: little text, mostly links, or mostly inputs."""
+    if words < FORM_MIN_WORDS:
+        return True
+    if link_words / words > FORM_MAX_LINK_DENSITY:
+        return True
+    return inputs > 0 and words / inputs < FORM_MIN_WORDS_PER_INPUT
+
+
+def _strip_boilerplate(doc, by_class: bool = True) -> None:
+    """Remove chrome, boilerplate forms and (optionally) class-flagged blocks and reference lists in place."""
+    for form in list(doc.iter('form')):
+        if form.getparent() is None:
+            continue
+        words = len(_normalize_text(form.itertext()).split())
+        link_words = sum(len(_normalize_text(a.itertext()).split()) for a in form.iter('a'))
+        if _is_boilerplate_form(words, link_words, len(list(form.iter(*FORM_INPUT_TAGS)))):
+            form.drop_tree()
+    for el in list(doc.iter(*BOILERPLATE_TAGS)):
+        if el.getparent() is not None:
+            el.drop_tree()
+    if not by_class:
+        return
+
+    for el in list(doc.iter()):
+        if el.getparent() is None or not isinstance(el.tag, str) or el.tag in ('html', 'body'):
+            continue
+        signature = _class_and_id(el)
+        if not signature.strip():
+            continue
+        if REFERENCES_RE.search(signature):
+            el.drop_tree()
+        elif NEGATIVE_RE.search(signature) and not POSITIVE_RE.search(signature):
+            el.drop_tree()
+
+
+def _class_weight(el) -> int:
+    weight = 0
+    signature = _class_and_id(el)
+    if NEGATIVE_RE.search(signature):
+        weight -= 25
+    if POSITIVE_RE.search(signature):
+        weight += 25
+    return weight
+
+
+def _link_density(el) -> float:
+    text_length = len(_normalize_text(el.itertext()))
+    if not text_length:
+        return 0.0
+    link_length = sum(len(_normalize_text(a.itertext())) for a in el.iter('a'))
+    return link_length / text_length
+
+
+def _find_main_content(doc):
+    """Readability-style scorer: paragraphs vote for their parent and grandparent."""
+    scores = {}
+
+    def initial_score(el) -> float:
+        tag_scores = {'div': 5, 'article': 10, 'section': 3, 'main': 10, 'pre': 3,
+                      'td': 3, 'blockquote': 3, 'form': -3, 'ol': -3, 'ul': -3,
+                      'li': -3, 'th': -5, 'h1': -5, 'h2': -5, 'h3': -5}
+        return tag_scores.get(el.tag, 0) + _class_weight(el)
+
+    for paragraph in doc.iter('p', 'pre', 'td'):
+        text = _normalize_text(paragraph.itertext())
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(',') + min(len(text) // 100, 3)
+        parent = paragraph.getparent()
+        for ancestor, share in ((parent, 1.0), (parent.getparent() if parent is not None else None, 0.5)):
+            if ancestor is None or not isinstance(ancestor.tag, str):
+                continue
+            if ancestor not in scores:
+                scores[ancestor] = initial_score(ancestor)
+            scores[ancestor] += score * share
+
+    if not scores:
+        return None
+
+    best, best_score = None, float('-inf')
+    for el, score in scores.items():
+        adjusted = score * (1 - _link_density(el))
+        if adjusted > best_score:
+            best, best_score = el, adjusted
+
+    # Walk up while the parent holds comparably scored siblings (multi-div article bodies)
+    parent = best.getparent()
+    while parent is not None and parent.tag not in ('html', 'body'):
+        sibling_score = sum(scores.get(child, 0) for child in parent if child is not best)
+        if sibling_score < best_score * 0.5:
+            break
+        best, best_score = parent, best_score + sibling_score
+        parent = best.getparent()
+    return best
+
+
+def extract_with_lxml(html_content: str, main_content: bool = True) -> Dict[str, object]:
+    """C-accelerated extraction with JATS/citation_* preference and main-content scoring."""
+    if not html_content or not html_content.strip():
+        return {'text': '', 'method': 'empty', 'metadata': {}}
+    if isinstance(html_content, str):
+        # lxml refuses str input that carries an XML encoding declaration
+        html_content = html_content.encode('utf-8', errors='replace')
+    parser = lxml.html.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True)
+    doc = lxml.html.fromstring(html_content, parser=parser)
+    metadata = _get_citation_metadata(doc)
+
+    _strip_boilerplate(doc, by_class=main_content)
+    full_text = _normalize_text(doc.itertext())
+    if not main_content:
+        return {'text': full_text, 'method': 'full', 'metadata': metadata}
+
+    for xpath in PREFERRED_XPATHS:
+        try:
+            candidates = doc.xpath(xpath)
+        except etree.XPathError:
+            continue
+        for candidate in candidates:
+            text = _normalize_text(candidate.itertext())
+            if len(text.split()) >= MIN_MAIN_CONTENT_WORDS:
+                return {'text': _with_abstract(text, metadata), 'method': 'structured', 'metadata': metadata}
+
+    best = _find_main_content(doc)
+    if best is not None:
+        text = _normalize_text(best.itertext())
+        if len(text.split()) >= MIN_MAIN_CONTENT_WORDS:
+            return {'text': _with_abstract(text, metadata), 'method': 'readability', 'metadata': metadata}
+
+    return {'text': full_text, 'method': 'full', 'metadata': metadata}
+
+
+def _with_abstract(text: str, metadata: Dict[str, str]) -> str:
+    """Prepend the citation_abstract when the detected body does not already contain it."""
+    abstract = metadata.get('abstract')
+    if abstract and abstract[:80] not in text:
+        return f"{abstract} {text}"
+    return text
+
+
+def extract_with_bs4(html_content: str, main_content: bool = True) -> Dict[str, object]:
+    """Pure-Python fallback used when lxml is not installed."""
+    soup = BeautifulSoup(html_content or '', 'html.parser')
+    for form in soup('form'):
+        if form.decomposed:
+            continue
+        words = len(form.get_text(separator=' ', strip=True).split())
+        link_words = sum(len(a.get_text(separator=' ', strip=True).split()) for a in form('a'))
+        if _is_boilerplate_form(words, link_words, len(form(FORM_INPUT_TAGS))):
+            form.decompose()
+    for el in soup(BOILERPLATE_TAGS):
+        el.decompose()
+    if main_content:
+        for el in soup.find_all(True):
+            if el.decomposed:
+                continue
+            signature = f"{' '.join(el.get('class', []))} {el.get('id', '')}"
+            if REFERENCES_RE.search(signature) or (NEGATIVE_RE.search(signature) and not POSITIVE_RE.search(signature)):
+                el.decompose()
+    text = soup.get_text(separator=' ', strip=True)
+    return {'text': text, 'method': 'full', 'metadata': {}}
+
+
+def extract_legacy(html_content: str, main_content: bool = True) -> Dict[str, object]:
+    """The original scraper behaviour, kept as a benchmark baseline."""
+    soup = BeautifulSoup(html_content or '', 'html.parser')
+    for el in soup(['script', 'style', 'nav', 'footer']):
+        el.decompose()
+    return {'text': soup.get_text(separator=' ', strip=True), 'method': 'legacy', 'metadata': {}}
+
+
+EXTRACTORS: Dict[str, Callable[..., Dict[str, object]]] = {
+    'bs4': extract_with_bs4,
+    'legacy': extract_legacy,
+}
+if HAS_LXML:
+    EXTRACTORS['lxml'] = extract_with_lxml
+
+DEFAULT_BACKEND = 'lxml' if HAS_LXML else 'bs4'
+
+
+def register_extractor(name: str, func: Callable[..., Dict[str, object]]) -> None:
+    """Register an additional extraction backend under the given name."""
+    EXTRACTORS[name] = func
+
+
+def available_extractors() -> List[str]:
+    return list(EXTRACTORS)
+
+
+def extract(html_content: str, backend: Optional[str] = None, main_content: bool = True) -> Dict[str, object]:
+    """
+    Extract text from HTML using the selected backend.
+
+    Returns a dict with 'text', 'method' ('structured', 'readability', 'full', ...),
+    'metadata' (citation_* fields) and 'backend'. Falls back to the BeautifulSoup
+    backend if the selected one raises.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor backend: {backend}. Available: {available_extractors()}")
+    try:
+        result = EXTRACTORS[backend](html_content, main_content=main_content)
+    except Exception as e:
+        if backend == 'bs4':
+            raise
+        logger.warning(f"Extractor '{backend}' failed, falling back to bs4: {str(e)}")
+        backend = 'bs4'
+        result = extract_with_bs4(html_content, main_content=main_content)
+    result['backend'] = backend
+    return result
+
+
+def extract_text_from_html(html_content: str, backend: Optional[str] = None, main_content: bool = True) -> str:
+    return extract(html_content, backend=backend, main_content=main_content)['text']
@@ -0,0 +1,106 @@
+# paper_prepper/utils/link_ranker.py
+
+import os
+import re
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, List
+
+from utils.url_utils import get_domain
+
+logger = logging.getLogger(__name__)
+
+# Link types, in rough order of how often they yield a full text
+PMC = 'pmc'
+OA_REPOSITORY = 'oa_repository'
+PUBLISHER_PDF = 'publisher_pdf'
+DOI = 'doi'
+PUBLISHER_HTML = 'publisher_html'
+
+# Prior probability that a link of each type yields full text, used until
+# enough outcomes have been observed for its domain
+PRIOR_SUCCESS = {
+    PMC: 0.85,
+    OA_REPOSITORY: 0.75,
+    PUBLISHER_PDF: 0.5,
+    DOI: 0.4,
+    PUBLISHER_HTML: 0.35,
+}
+
+# How many observations the prior is worth when blending with observed outcomes
+PRIOR_WEIGHT = 4
+
+OA_REPOSITORY_DOMAINS = {
+    'arxiv.org', 'biorxiv.org', 'medrxiv.org', 'europepmc.org', 'zenodo.org', 'core.ac.uk',
+    'hal.science', 'hal.archives-ouvertes.fr', 'osf.io', 'researchsquare.com', 'preprints.org',
+    'semanticscholar.org', 'pdfs.semanticscholar.org', 'doaj.org', 'mdpi.com', 'mdpi-res.com',
+    'journals.plos.org', 'frontiersin.org', 'hindawi.com', 'scielo.org', 'scielo.br',
+    'escholarship.org', 'digitalcommons.unl.edu',
+}
+PMC_RE = re.compile(r"ncbi\.nlm\.nih\.gov/pmc|pmc\.ncbi\.nlm\.nih\.gov|europepmc\.org/articles/pmc", re.IGNORECASE)
+PDF_RE = re.compile(r"\.pdf(?:$|[?#])|/pdf(?:/|$)|/pdfdirect/|/epdf/", re.IGNORECASE)
+
+
+def classify_link(url: str) -> str:
+    """Assign a link to one of the link types used for ranking."""
+    lowered = url.lower()
+    if lowered.startswith('10.') or lowered.startswith('doi:'):
+        return DOI
+    domain = get_domain(url)
+    if PMC_RE.search(lowered):
+        return PMC
+    if domain in ('doi.org', 'dx.doi.org'):
+        return DOI
+    if domain in OA_REPOSITORY_DOMAINS or any(domain.endswith(f".{d}") for d in OA_REPOSITORY_DOMAINS) or domain.endswith('.edu'):
+        return OA_REPOSITORY
+    if PDF_RE.search(lowered):
+        return PUBLISHER_PDF
+    return PUBLISHER_HTML
+
+
+class LinkStats:
+    """Observed scrape outcomes per (domain, link type), persisted as JSON between runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.outcomes = defaultdict(lambda: {'attempts': 0, 'successes': 0})
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for key, counts in json.load(f).items():
+                        self.outcomes[key].update(counts)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not load link stats from {path}: {str(e)}")
+
+    @staticmethod
+    def _key(url: str) -> str:
+        link_type = classify_link(url)
+        domain = 'doi.org' if link_type == DOI else get_domain(url)
+        return f"{domain}|{link_type}"
+
+    def record(self, url: str, success: bool) -> None:
+        outcome = self.outcomes[self._key(url)]
+        outcome['attempts'] += 1
+        if success:
+            outcome['successes'] += 1
+
+    def predicted_success(self, url: str) -> float:
+        prior = PRIOR_SUCCESS[classify_link(url)]
+        outcome = self.outcomes.get(self._key(url), {'attempts': 0, 'successes': 0})
+        return (outcome['successes'] + prior * PRIOR_WEIGHT) / (outcome['attempts'] + PRIOR_WEIGHT)
+
+    def rank(self, links: List[str]) -> List[str]:
+        """Order links by predicted success; ties keep their original order."""
+        return sorted(links, key=self.predicted_success, reverse=True)
+
+    def save(self) -> None:
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.outcomes), f, indent=2, sort_keys=True)
+            logger.info(f"Link stats saved to {self.path}")
+        except OSError as e:
+            logger.error(f"Failed to save link stats: {str(e)}")
+
+    def describe(self, links: List[str]) -> Dict[str, str]:
+        return {link: f"{classify_link(link)} p={self.predicted_success(link):.2f}" for link in links}
@@ -0,0 +1,119 @@
+# paper_prepper/utils/llm_cache.py
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, List, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _schema_of(response_format: Any) -> Any:
+    """JSON-serializable form of a response format: pydantic models by their schema."""
+    if hasattr(response_format, 'model_json_schema'):
+        return response_format.model_json_schema()
+    return response_format
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], response_format: Any = None,
+              temperature: Optional[float] = None) -> str:
+    """sha256 over everything that determines the response: model, messages, response schema and temperature."""
+    payload = json.dumps(
+        {'model': model, 'messages': messages, 'response_format': _schema_of(response_format),
+         'temperature': temperature},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of LLM responses with least-recently-used eviction
+    once the stored responses exceed max_bytes. A disabled cache (path None
+    or enabled=False) misses every lookup and stores nothing, so callers do
+    not need a separate code path for --no-cache.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int = DEFAULT_MAX_BYTES, enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled and path is not None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if self.enabled:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    size INTEGER,
+                    created REAL,
+                    last_used REAL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+            self.conn.commit()
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            self.misses += 1
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = '') -> None:
+        if not self.enabled:
+            return
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} cached responses to stay under {self.max_bytes} bytes")
+
+    def summary(self) -> str:
+        if not self.enabled:
+            return "LLM cache disabled"
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return f"LLM cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), {self.total_bytes / 1e6:.1f} MB stored"
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.enabled = False
@@ -0,0 +1,213 @@
+# paper_prepper/utils/page_classifier.py
+
+import os
+import re
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    HAS_LXML = True
+except ImportError:  # pragma: no cover - optional C-accelerated backend
+    HAS_LXML = False
+
+from utils.url_utils import get_domain
+
+logger = logging.getLogger(__name__)
+
+# Page verdicts
+FULL_TEXT = 'full_text'
+ABSTRACT_ONLY = 'abstract_only'
+PAYWALL = 'paywall'
+CAPTCHA = 'captcha'
+CONSENT_WALL = 'consent_wall'
+INSUFFICIENT = 'insufficient'
+
+# Verdicts that another browser tier or retry will not fix. Escalation stops
+# early on these and the scraper moves straight to PDF-link discovery.
+HOPELESS_VERDICTS = {PAYWALL, ABSTRACT_ONLY}
+
+PAYWALL_RE = re.compile(
+    r"access through your institution|check access|get access|purchase (?:this )?(?:article|pdf)|"
+    r"buy (?:this )?article|rent this article|subscribe to (?:read|continue|this journal)|"
+    r"log ?in to (?:access|view|read)|sign in to (?:access|view|read)|institutional (?:access|login)|"
+    r"you do not have access|full text access|access options|preview only|"
+    r"this is a preview of subscription content|to read the full[- ]text",
+    re.IGNORECASE,
+)
+CAPTCHA_RE = re.compile(
+    r"captcha|verify (?:that )?you are (?:a )?human|are you a robot|checking your browser|"
+    r"unusual traffic|ray id|access denied|request blocked|enable javascript and cookies to continue|"
+    r"press (?:and|&) hold",
+    re.IGNORECASE,
+)
+CONSENT_RE = re.compile(
+    r"we use cookies|cookie (?:settings|preferences|policy)|accept all cookies|manage (?:cookie )?preferences|"
+    r"your privacy choices|consent to (?:the use of )?cookies|reject all",
+    re.IGNORECASE,
+)
+# Section headings that appear in the body of a full paper
+SECTION_RE = re.compile(
+    r"\b(?:introduction|background|related work|materials and methods|methods|methodology|"
+    r"experimental (?:setup|design)|results|discussion|conclusions?|acknowledg(?:e)?ments)\b",
+    re.IGNORECASE,
+)
+ABSTRACT_RE = re.compile(r"\babstract\b|\bsummary\b", re.IGNORECASE)
+
+# Class/id values that identify challenge widgets and paywall boxes, and the
+# iframe sources of hosted challenges; matched on elements only, never on
+# script bodies, where the same words turn up in harmless config
+DOM_CAPTCHA_RE = re.compile(r"g-recaptcha|h-captcha|hcaptcha|cf-challenge|challenge-form|px-captcha|turnstile", re.IGNORECASE)
+DOM_CAPTCHA_IFRAME_RE = re.compile(r"captcha|challenges\.cloudflare\.com", re.IGNORECASE)
+DOM_PAYWALL_RE = re.compile(r"paywall|access-denied|purchase-options|buy-box|get-access|accessbar", re.IGNORECASE)
+# Elements whose contents are code or markup, not page structure
+DOM_SKIP_TAGS = ('script', 'style', 'noscript', 'template')
+
+# Only the head and tail of long texts are scanned for wall phrases; menus and
+# banners live there and scanning megabytes of body text costs time for nothing.
+SCAN_CHARS = 20000
+
+
+def _element_signals(elements) -> Dict[str, int]:
+    """Count markers over (tag, class, id, src, meta name) tuples of the page's elements."""
+    signals = {'captcha_elements': 0, 'paywall_elements': 0, 'has_citation_pdf_url': 0}
+    for tag, classes, element_id, src, name in elements:
+        signature = f"{classes} {element_id}"
+        if DOM_CAPTCHA_RE.search(signature) or (tag == 'iframe' and DOM_CAPTCHA_IFRAME_RE.search(src)):
+            signals['captcha_elements'] += 1
+        if DOM_PAYWALL_RE.search(signature):
+            signals['paywall_elements'] += 1
+        if tag == 'meta' and name.lower() == 'citation_pdf_url':
+            signals['has_citation_pdf_url'] = 1
+    return signals
+
+
+def extract_dom_signals(html: str) -> Dict[str, int]:
+    """
+    Challenge, paywall and citation markers in the class and id attributes of
+    the page's elements, the way the in-page scan in slow_scraper counts them.
+    """
+    if not html or not html.strip():
+        return {}
+    if HAS_LXML:
+        data = html.encode('utf-8', errors='replace') if isinstance(html, str) else html
+        try:
+            doc = lxml.html.fromstring(data, parser=lxml.html.HTMLParser(encoding='utf-8', remove_comments=True))
+        except Exception as e:  # lxml rejects some documents outright; the markers are best effort
+            logger.debug(f"Could not parse HTML for DOM signals: {str(e)}")
+            return {}
+        for el in list(doc.iter(*DOM_SKIP_TAGS)):
+            if el.getparent() is not None:
+                el.drop_tree()
+        return _element_signals(
+            (el.tag, el.get('class') or '', el.get('id') or '', el.get('src') or '', el.get('name') or '')
+            for el in doc.iter() if isinstance(el.tag, str)
+        )
+    soup = BeautifulSoup(html, 'html.parser')
+    for el in soup(DOM_SKIP_TAGS):
+        el.decompose()
+    return _element_signals(
+        (el.name, ' '.join(el.get('class') or []), el.get('id') or '', el.get('src') or '', el.get('name') or '')
+        for el in soup.find_all(True)
+    )
+
+
+def _scan_window(text: str) -> str:
+    if len(text) <= 2 * SCAN_CHARS:
+        return text
+    return f"{text[:SCAN_CHARS]} {text[-SCAN_CHARS:]}"
+
+
+def classify_page(text: str, min_words: int = 700, dom_signals: Optional[Dict[str, int]] = None,
+                  is_pdf: bool = False) -> Dict[str, object]:
+    """
+    Classify extracted page text as full text, abstract-only, paywall, captcha,
+    consent wall or insufficient. Text extracted from a PDF is never a wall:
+    it is full text or insufficient on length alone.
+
+    Returns a dict with the 'verdict', the 'word_count' and the raw 'signals'
+    that produced it, so decisions can be audited from the logs.
+    """
+    text = text or ''
+    dom_signals = dom_signals or {}
+    word_count = len(text.split())
+    window = _scan_window(text)
+
+    signals = {
+        'paywall_phrases': len(PAYWALL_RE.findall(window)),
+        'captcha_phrases': len(CAPTCHA_RE.findall(window)),
+        'consent_phrases': len(CONSENT_RE.findall(window)),
+        'section_headings': len({m.lower() for m in SECTION_RE.findall(text)}),
+        'has_abstract': 1 if ABSTRACT_RE.search(window) else 0,
+        'is_pdf': 1 if is_pdf else 0,
+    }
+    signals.update(dom_signals)
+
+    # A DOM marker backs up a wall phrase or a short page; on its own it never decides the verdict
+    paywall_elements = signals.get('paywall_elements', 0)
+    captcha_elements = signals.get('captcha_elements', 0)
+    paywall_score = signals['paywall_phrases']
+    if paywall_elements and (signals['paywall_phrases'] or word_count < min_words):
+        paywall_score += 2 * paywall_elements
+    captcha_score = signals['captcha_phrases']
+    if captcha_elements and (signals['captcha_phrases'] or word_count < 500):
+        captcha_score += 3 * captcha_elements
+    looks_like_paper = signals['section_headings'] >= 3
+    # Abstract and paywall verdicts only apply to short pages; a real paper or
+    # thesis mentions "abstract" or "access" somewhere and is still the full text
+    short = word_count < 3 * min_words
+
+    if is_pdf:
+        verdict = FULL_TEXT if word_count >= min_words else INSUFFICIENT
+    elif (captcha_score >= 2 and word_count < 500) or (captcha_elements and signals['captcha_phrases'] and not looks_like_paper):
+        verdict = CAPTCHA
+    elif signals['consent_phrases'] and word_count < 300:
+        verdict = CONSENT_WALL
+    elif paywall_score >= 2 and short:
+        # Landing pages often list the section outline next to the access box
+        verdict = PAYWALL
+    elif word_count >= min_words and signals['section_headings'] >= 2:
+        verdict = FULL_TEXT
+    elif paywall_score and short:
+        verdict = PAYWALL
+    elif signals['has_abstract'] and word_count >= 50 and short:
+        verdict = ABSTRACT_ONLY
+    elif not short:
+        verdict = FULL_TEXT
+    else:
+        verdict = INSUFFICIENT
+
+    return {'verdict': verdict, 'word_count': word_count, 'signals': signals}
+
+
+class DomainVerdictLog:
+    """Per-domain tally of page verdicts, persisted as JSON between runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.counts = defaultdict(lambda: defaultdict(int))
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for domain, verdicts in json.load(f).items():
+                        self.counts[domain].update(verdicts)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not load domain verdicts from {path}: {str(e)}")
+
+    def record(self, url: str, verdict: str) -> None:
+        self.counts[get_domain(url)][verdict] += 1
+
+    def summary(self, domain: str) -> Dict[str, int]:
+        return dict(self.counts.get(domain, {}))
+
+    def save(self) -> None:
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({d: dict(v) for d, v in self.counts.items()}, f, indent=2, sort_keys=True)
+            logger.info(f"Domain verdicts saved to {self.path}")
+        except OSError as e:
+            logger.error(f"Failed to save domain verdicts: {str(e)}")
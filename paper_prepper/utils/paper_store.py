@@ -0,0 +1,191 @@
+# paper_prepper/utils/paper_store.py
+
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMIT_EVERY = 20
+DEFAULT_QUEUE_SIZE = 256
+
+
+def flatten_dict(d, parent_key='', sep='_'):
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+class PaperStore:
+    """
+    Data access for the papers table over one shared SQLite connection in WAL mode.
+
+    SQL text for the fixed queries is built once, and UPDATE statements are
+    memoized per column set, so sqlite3's statement cache hands back the same
+    prepared statement on every call. Analysis writes are committed every
+    commit_every papers rather than one by one; call commit() or close() to
+    flush the rest.
+    """
+
+    def __init__(self, path: str, analysis_fields: List[str], fingerprint_column: str = 'analysis_fingerprint',
+                 commit_every: int = DEFAULT_COMMIT_EVERY):
+        self.path = path
+        self.analysis_fields = [f for f in analysis_fields if f != 'id']
+        self.fingerprint_column = fingerprint_column
+        self.commit_every = max(1, commit_every)
+        self.pending = 0
+        # Analysis workers may run in threads, so the connection is shared under a lock
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        self.select_paper_sql = "SELECT title, authors, year, full_text FROM papers WHERE id = ?"
+        self.select_ids_sql = "SELECT id FROM papers"
+        self.select_texts_sql = "SELECT id, title, authors, full_text FROM papers"
+        assignments = [f"{field} = ?" for field in self.analysis_fields] + [f"{fingerprint_column} = NULL"]
+        self.wipe_sql = f"UPDATE papers SET {', '.join(assignments)} WHERE id = ?"
+        # 0 for integer fields, NULL for the reasoning field
+        self.wipe_values = [None if field == 'reasoning' else 0 for field in self.analysis_fields]
+        self.update_sql: Dict[Tuple[str, ...], str] = {}
+
+    def columns(self) -> Set[str]:
+        with self.lock:
+            return set(row[1] for row in self.conn.execute("PRAGMA table_info(papers)"))
+
+    def add_column(self, name: str, declaration: str) -> None:
+        with self.lock:
+            self.conn.execute(f"ALTER TABLE papers ADD COLUMN {name} {declaration}")
+            self.conn.commit()
+
+    def paper_ids(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.conn.execute(self.select_ids_sql)]
+
+    def get_paper(self, paper_id: str) -> Optional[Tuple]:
+        """(title, authors, year, full_text) of a paper, or None."""
+        with self.lock:
+            return self.conn.execute(self.select_paper_sql, (paper_id,)).fetchone()
+
+    def iter_papers(self, fetch_size: int = 100, with_fingerprint: bool = False) -> Iterator[Tuple]:
+        """
+        Stream (id, title, authors, full_text) rows, plus the stored fingerprint
+        (None where the column does not exist yet) when with_fingerprint is set.
+        A separate read connection is used so writes can go on meanwhile.
+        """
+        sql = self.select_texts_sql
+        if with_fingerprint:
+            stored = self.fingerprint_column if self.fingerprint_column in self.columns() else "NULL"
+            sql = f"SELECT id, title, authors, full_text, {stored} FROM papers"
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(sql)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def wipe_analysis(self, paper_id: str) -> None:
+        with self.lock:
+            self.conn.execute(self.wipe_sql, self.wipe_values + [paper_id])
+
+    def update_analysis(self, paper_id: str, flattened_analysis: Dict, fingerprint: Optional[str] = None) -> None:
+        values = dict(flattened_analysis)
+        if fingerprint:
+            values[self.fingerprint_column] = fingerprint
+        keys = tuple(values)
+        sql = self.update_sql.get(keys)
+        if sql is None:
+            sql = self.update_sql[keys] = "UPDATE papers SET " + ", ".join(f"{k} = ?" for k in keys) + " WHERE id = ?"
+        with self.lock:
+            self.conn.execute(sql, list(values.values()) + [paper_id])
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.commit()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            if self.pending:
+                logger.debug(f"Committed {self.pending} paper analyses")
+            self.pending = 0
+
+    def writer(self, max_queue: int = DEFAULT_QUEUE_SIZE) -> 'AnalysisWriter':
+        return AnalysisWriter(self, max_queue)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+
+
+class AnalysisWriter:
+    """
+    Single writer for concurrent analysis workers: workers put results on a
+    queue and one task applies them to the store in order, so the workers
+    never wait on the database lock. Whatever is written is committed each
+    time the queue drains. Use as `async with store.writer() as writer:`.
+    """
+
+    def __init__(self, store: PaperStore, max_queue: int = DEFAULT_QUEUE_SIZE):
+        self.store = store
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+
+    async def put(self, paper_id: str, flattened_analysis: Dict, fingerprint: Optional[str] = None,
+                  wipe: bool = False) -> None:
+        await self.queue.put((paper_id, flattened_analysis, fingerprint, wipe))
+
+    def _apply(self, paper_id: str, flattened_analysis: Dict, fingerprint: Optional[str], wipe: bool) -> None:
+        if wipe:
+            self.store.wipe_analysis(paper_id)
+        self.store.update_analysis(paper_id, flattened_analysis, fingerprint)
+
+    async def _run(self) -> None:
+        while True:
+            item = await self.queue.get()
+            try:
+                if item is None:
+                    return
+                await asyncio.to_thread(self._apply, *item)
+                self.written += 1
+                # Commit whenever the writer catches up, so results persist as soon as they arrive
+                if self.queue.empty():
+                    await asyncio.to_thread(self.store.commit)
+            except sqlite3.Error as e:
+                self.failed += 1
+                logger.error(f"Failed to write analysis for paper {item[0]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Write everything still queued, then commit."""
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+        await asyncio.to_thread(self.store.commit)
+
+    async def __aenter__(self) -> 'AnalysisWriter':
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
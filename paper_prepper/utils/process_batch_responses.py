@@ -5,9 +5,9 @@ import sqlite3
 import os
 import argparse
 import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def get_user_input(prompt: str, default: str = None) -> str:
@@ -41,9 +41,17 @@ def find_files(working_dir):
             output_file = os.path.join(working_dir, file)
     return db_file, output_file
 
-def update_paper_analysis(cursor: sqlite3.Cursor, paper_id: str, flattened_content: dict):
+# Output files at least this long are parsed in a process pool; smaller ones are not worth the startup cost
+PARALLEL_MIN_LINES = 2000
+PARSE_CHUNKSIZE = 256
+
+def get_existing_columns(cursor: sqlite3.Cursor) -> set:
     cursor.execute("PRAGMA table_info(papers)")
-    existing_columns = set(row[1] for row in cursor.fetchall())
+    return set(row[1] for row in cursor.fetchall())
+
+def update_paper_analysis(cursor: sqlite3.Cursor, paper_id: str, flattened_content: dict, existing_columns: set = None):
+    if existing_columns is None:
+        existing_columns = get_existing_columns(cursor)
 
     valid_keys = [k for k in flattened_content.keys() if k in existing_columns]
 
@@ -54,45 +62,97 @@ def update_paper_analysis(cursor: sqlite3.Cursor, paper_id: str, flattened_conte
     update_query = "UPDATE papers SET " + ", ".join(f"{k} = ?" for k in valid_keys) + " WHERE id = ?"
     values = [flattened_content[k] for k in valid_keys] + [paper_id]
 
-    logger.debug(f"Update query: {update_query}")
-    logger.debug(f"Values: {values}")
-
     try:
         cursor.execute(update_query, values)
     except sqlite3.OperationalError as e:
         logger.error(f"SQLite error: {e}")
         logger.error(f"Query: {update_query}")
-        logger.error(f"Values: {values}")
         raise
 
+def parse_output_line(line: str):
+    """Parse one batch output line into (paper_id, flattened_content, None), or (None, None, reason) if it is malformed."""
+    try:
+        response = json.loads(line)
+        custom_id_parts = response['custom_id'].split('_')
+        paper_id = custom_id_parts[1]
+        content = json.loads(response['response']['body']['choices'][0]['message']['content'])
+
+        flattened_content = flatten_dict(content)
+        if len(custom_id_parts) > 2:
+            # Fingerprint of the inputs the analysis was made from, used to skip unchanged papers
+            flattened_content['analysis_fingerprint'] = custom_id_parts[2]
+        return paper_id, flattened_content, None
+    except json.JSONDecodeError as e:
+        return None, None, f"JSON decode error: {e}"
+    except (KeyError, IndexError, TypeError) as e:
+        return None, None, f"Unexpected response structure: {type(e).__name__}: {e}"
+    except Exception as e:
+        return None, None, f"Unexpected error: {e}"
+
+def parse_output_lines(lines: list):
+    """Parse output lines, in a process pool when there are enough of them."""
+    if len(lines) < PARALLEL_MIN_LINES:
+        return [parse_output_line(line) for line in lines]
+    with ProcessPoolExecutor() as executor:
+        return list(executor.map(parse_output_line, lines, chunksize=PARSE_CHUNKSIZE))
+
+def group_updates(updates: dict, existing_columns: set) -> dict:
+    """Group rows by the set of columns they update, so each group is a single executemany."""
+    groups = defaultdict(list)
+    for paper_id, flattened_content in updates.items():
+        valid_keys = tuple(k for k in flattened_content.keys() if k in existing_columns)
+        if not valid_keys:
+            logger.warning(f"No valid keys found for paper_id {paper_id}. Skipping update.")
+            continue
+        groups[valid_keys].append([flattened_content[k] for k in valid_keys] + [paper_id])
+    return groups
+
+def write_rejects(reject_path: str, rejects: list):
+    with open(reject_path, 'w', encoding='utf-8') as f:
+        for line_number, reason, line in rejects:
+            f.write(json.dumps({'line_number': line_number, 'reason': reason, 'line': line.rstrip('\n')}) + '\n')
+
 def process_batch_responses(output_file_path: str, db_path: str):
+    with open(output_file_path, 'r', encoding='utf-8') as file:
+        lines = [line for line in file if line.strip()]
+
+    # Later lines for the same paper win, as they did when rows were updated one by one
+    updates = {}
+    rejects = []
+    for line_number, (line, (paper_id, flattened_content, error)) in enumerate(zip(lines, parse_output_lines(lines)), 1):
+        if error:
+            rejects.append((line_number, error, line))
+        else:
+            updates[paper_id] = flattened_content
+
     conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
+    try:
+        groups = group_updates(updates, get_existing_columns(cursor))
+        cursor.execute("BEGIN")
+        for valid_keys, rows in groups.items():
+            update_query = "UPDATE papers SET " + ", ".join(f"{k} = ?" for k in valid_keys) + " WHERE id = ?"
+            logger.debug(f"Update query: {update_query} ({len(rows)} rows)")
+            cursor.executemany(update_query, rows)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"SQLite error, no batch responses were written: {e}")
+        raise
+    finally:
+        conn.close()
 
-    with open(output_file_path, 'r') as file:
-        for line in file:
-            try:
-                response = json.loads(line)
-                paper_id = response['custom_id'].split('_')[1]
-                content = json.loads(response['response']['body']['choices'][0]['message']['content'])
-                
-                flattened_content = flatten_dict(content)
-                update_paper_analysis(cursor, paper_id, flattened_content)
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                logger.error(f"Problematic line: {line}")
-            except KeyError as e:
-                logger.error(f"KeyError: {e}")
-                logger.error(f"Response structure: {response}")
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
-                logger.error(f"Problematic line: {line}")
-
-    conn.commit()
-    conn.close()
-    logger.info("All batch responses have been processed and the database has been updated.")
+    if rejects:
+        reject_path = os.path.splitext(output_file_path)[0] + '_rejects.jsonl'
+        write_rejects(reject_path, rejects)
+        logger.error(f"{len(rejects)} malformed output lines written to {reject_path}")
+    logger.info(f"All batch responses have been processed and the database has been updated "
+                f"({len(updates)} papers in {len(groups)} column groups, {len(rejects)} rejected).")
 
 def main():
+    # Configured here, not at import, so importing this module leaves the caller's logging alone
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     parser = argparse.ArgumentParser(description="Process batch responses and update the database.")
     parser.add_argument("--working_dir", help="Path to the working directory containing the database and output file")
     args = parser.parse_args()
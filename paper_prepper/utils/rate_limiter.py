@@ -0,0 +1,169 @@
+# paper_prepper/utils/rate_limiter.py
+
+import re
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_RE = re.compile(r"rate.?limit|too many requests|\b429\b", re.IGNORECASE)
+# Reset durations in OpenAI's x-ratelimit-reset-* headers, e.g. "20ms", "1s", "6m0s"
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting: about four characters per token."""
+    return len(text or '') // 4 + 1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for 429 / rate-limit errors from the OpenAI SDK or wrappers around it."""
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if status == 429:
+        return True
+    return type(error).__name__ == 'RateLimitError' or bool(RATE_LIMIT_RE.search(str(error)))
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a header duration such as "1.5", "20ms" or "6m0s"; None if it cannot be read."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """
+    How long the server asked us to wait, from retry-after-ms / retry-after or,
+    failing those, the reset time of whichever rate-limit budget is exhausted.
+    """
+    if not headers:
+        return None
+    retry_after_ms = parse_duration(headers.get('retry-after-ms'))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = parse_duration(headers.get('retry-after'))
+    if retry_after is not None:
+        return retry_after
+    waits = [parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+             for kind in ('requests', 'tokens') if headers.get(f'x-ratelimit-remaining-{kind}') == '0']
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+class TokenBucket:
+    """Continuously refilling bucket; `acquire` waits until `amount` units are available."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A single request larger than the bucket would never fit; let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """
+    Shared limiter for concurrent LLM calls: requests and tokens per minute are
+    enforced with token buckets, and the number of calls in flight follows
+    AIMD. Every `increase_after` successes the concurrency limit grows by one
+    up to `max_concurrency`; a rate-limit response halves it.
+    """
+
+    def __init__(self, requests_per_minute: float = 500, tokens_per_minute: Optional[float] = 200000,
+                 max_concurrency: int = 8, initial_concurrency: Optional[int] = None,
+                 min_concurrency: int = 1, increase_after: int = 5):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = initial_concurrency or max_concurrency
+        self.increase_after = increase_after
+        self.in_flight = 0
+        self.successes_since_change = 0
+        self.rate_limited = 0
+        # Monotonic time before which no new call starts, set from server rate-limit headers
+        self.resume_at = 0.0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """Wait for a concurrency slot and rate budget, then hold the slot for one call."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+        try:
+            wait = self.resume_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.requests.acquire(1)
+            if self.tokens and tokens:
+                await self.tokens.acquire(tokens)
+            yield
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    async def on_success(self) -> None:
+        async with self.condition:
+            self.successes_since_change += 1
+            if self.successes_since_change >= self.increase_after and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self.successes_since_change = 0
+                logger.info(f"Concurrency raised to {self.concurrency}")
+                self.condition.notify_all()
+
+    async def on_rate_limit(self) -> None:
+        async with self.condition:
+            self.rate_limited += 1
+            self.successes_since_change = 0
+            new_concurrency = max(self.min_concurrency, self.concurrency // 2)
+            if new_concurrency != self.concurrency:
+                logger.warning(f"Rate limited; concurrency lowered from {self.concurrency} to {new_concurrency}")
+            self.concurrency = new_concurrency
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every new call for `seconds`, e.g. after a Retry-After header."""
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def observe_headers(self, headers) -> None:
+        """Pause until the reset time when a response says a rate-limit budget is used up."""
+        wait = retry_after_seconds(headers)
+        if wait:
+            logger.info(f"Rate-limit budget exhausted; pausing new calls for {wait:.1f}s")
+            self.pause(wait)
+
+    def summary(self) -> str:
+        return f"concurrency {self.concurrency}/{self.max_concurrency}, {self.rate_limited} rate-limit responses"
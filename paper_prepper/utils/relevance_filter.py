@@ -0,0 +1,118 @@
+# paper_prepper/utils/relevance_filter.py
+
+import os
+import json
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+from utils.source_index import tokenize, split_sections
+
+logger = logging.getLogger(__name__)
+
+# Threshold used until enough past decisions exist to calibrate one; 0 disables auto-rejection
+DEFAULT_THRESHOLD = 0.0
+# Past accepted references needed before the threshold is calibrated
+MIN_CALIBRATION_ACCEPTS = 10
+# Fraction of past accepted references the calibrated threshold may reject
+MAX_FALSE_REJECT_RATE = 0.02
+# Calibrated thresholds are scaled down by this margin to stay on the safe side
+THRESHOLD_MARGIN = 0.9
+
+
+def build_matrix(token_lists: List[List[str]], vocabulary: Dict[str, int]) -> sparse.csr_matrix:
+    """Sparse term-count matrix, one row per document, over a fixed vocabulary."""
+    rows, cols, values = [], [], []
+    for row, tokens in enumerate(token_lists):
+        counts = Counter(t for t in tokens if t in vocabulary)
+        rows.extend([row] * len(counts))
+        cols.extend(vocabulary[t] for t in counts)
+        values.extend(counts.values())
+    return sparse.csr_matrix((np.array(values, dtype=np.float32), (rows, cols)),
+                             shape=(len(token_lists), len(vocabulary)))
+
+
+def _tfidf_rows(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    """Sublinear tf times idf, rows L2-normalized."""
+    weighted = counts.copy()
+    weighted.data = 1 + np.log(weighted.data)
+    weighted = weighted.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ weighted
+
+
+def source_idf(source_text: str, vocabulary: Dict[str, int]) -> np.ndarray:
+    """Smoothed idf of each vocabulary term over the source's paragraphs."""
+    paragraphs = [p for section in split_sections(source_text) for p in section.paragraphs] or [source_text]
+    counts = build_matrix([tokenize(p) for p in paragraphs], vocabulary)
+    document_frequency = np.asarray((counts > 0).sum(axis=0)).ravel()
+    return np.log((1 + len(paragraphs)) / (1 + document_frequency)) + 1
+
+
+def score_references(source_text: str, reference_texts: List[str]) -> np.ndarray:
+    """
+    TF-IDF cosine similarity of each reference to the source text.
+
+    The vocabulary is the source's terms, since only those can make a reference
+    relevant. idf is computed over the source's paragraphs, so terms the whole
+    draft leans on count for little, and a reference's score depends only on
+    the source and itself: scores stay comparable across runs, which the
+    threshold calibrated from past runs relies on.
+    """
+    source_tokens = tokenize(source_text)
+    vocabulary = {term: i for i, term in enumerate(sorted(set(source_tokens)))}
+    if not vocabulary or not reference_texts:
+        return np.zeros(len(reference_texts))
+    reference_counts = build_matrix([tokenize(text) for text in reference_texts], vocabulary)
+    source_counts = build_matrix([source_tokens], vocabulary)
+    idf = source_idf(source_text, vocabulary)
+    references = _tfidf_rows(reference_counts, idf)
+    source = _tfidf_rows(source_counts, idf)
+    return np.asarray((references @ source.T).todense()).ravel()
+
+
+class RelevanceHistory:
+    """Past prefilter scores with the LLM's include decision, persisted as JSON to calibrate the threshold."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.records: Dict[str, Dict] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.records = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not load relevance history from {path}: {str(e)}")
+
+    def record(self, key: str, score: float, include: int) -> None:
+        self.records[key] = {'score': round(float(score), 6), 'include': int(include)}
+
+    def calibrated_threshold(self) -> float:
+        """
+        Highest score that would have rejected at most MAX_FALSE_REJECT_RATE of
+        past accepted references, scaled by THRESHOLD_MARGIN.
+        """
+        accepted = sorted(r['score'] for r in self.records.values() if r['include'] == 1)
+        if len(accepted) < MIN_CALIBRATION_ACCEPTS:
+            return DEFAULT_THRESHOLD
+        allowed_misses = int(len(accepted) * MAX_FALSE_REJECT_RATE)
+        threshold = accepted[allowed_misses] * THRESHOLD_MARGIN
+        rejected = [r['score'] for r in self.records.values() if r['include'] == 0]
+        would_skip = sum(score < threshold for score in rejected)
+        logger.info(f"Calibrated prefilter threshold {threshold:.4f} from {len(accepted)} accepts; "
+                    f"it would have skipped {would_skip} of {len(rejected)} past rejects")
+        return threshold
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.records, f, indent=2, sort_keys=True)
+            logger.info(f"Relevance history saved to {self.path}")
+        except OSError as e:
+            logger.error(f"Failed to save relevance history: {str(e)}")
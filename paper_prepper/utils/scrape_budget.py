@@ -0,0 +1,93 @@
+# paper_prepper/utils/scrape_budget.py
+
+import math
+import time
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional
+
+
+class BudgetExhausted(Exception):
+    """Raised when a scrape step cannot start or finish inside its wall-clock budget."""
+
+
+class ScrapeBudget:
+    """
+    Wall-clock budget for a paper, a URL or a single scraping tier.
+
+    Budgets nest: a sub-budget never outlives its parent, and time recorded
+    against a tier is rolled up to every ancestor so a paper-level budget can
+    report how its time was spent. A budget of None seconds is unlimited.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, parent: Optional['ScrapeBudget'] = None, label: str = ''):
+        self.seconds = seconds
+        self.parent = parent
+        self.label = label
+        self.started = time.monotonic()
+        self.tier_seconds: Dict[str, float] = defaultdict(float)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        own = math.inf if self.seconds is None else self.seconds - self.elapsed()
+        if self.parent is not None:
+            own = min(own, self.parent.remaining())
+        return max(own, 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cap_timeout(self, timeout: float) -> float:
+        return min(timeout, self.remaining())
+
+    def sub_budget(self, share: float = 1.0, max_seconds: Optional[float] = None, label: str = '') -> 'ScrapeBudget':
+        """Carve out a share of the remaining time, optionally capped at max_seconds."""
+        remaining = self.remaining()
+        seconds = None if math.isinf(remaining) else remaining * share
+        if max_seconds is not None:
+            seconds = max_seconds if seconds is None else min(seconds, max_seconds)
+        return ScrapeBudget(seconds, parent=self, label=label)
+
+    def record(self, tier: str, seconds: float) -> None:
+        self.tier_seconds[tier] += seconds
+        if self.parent is not None:
+            self.parent.record(tier, seconds)
+
+    async def run(self, tier: str, awaitable, timeout: Optional[float] = None):
+        """
+        Await a scrape step under min(timeout, remaining budget) and record the time spent.
+
+        The step is cancelled when the limit is reached, so callers must release
+        browser pages in finally blocks rather than in except Exception.
+        """
+        limit = self.remaining() if timeout is None else self.cap_timeout(timeout)
+        if limit <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise BudgetExhausted(f"No budget left for {tier} ({self.label})")
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(awaitable, None if math.isinf(limit) else limit)
+        except asyncio.TimeoutError:
+            if self.expired():
+                raise BudgetExhausted(f"Budget exhausted during {tier} ({self.label})")
+            raise
+        finally:
+            self.record(tier, time.monotonic() - start)
+
+    def allocate(self, weights: Dict[str, float], key: str, remaining_keys) -> 'ScrapeBudget':
+        """
+        Sub-budget for `key` sized by its weight among the steps still to run.
+
+        Time a cheap step does not use rolls over to the later ones because the
+        share is taken from what is left when the step starts.
+        """
+        total = sum(weights.get(k, 1.0) for k in remaining_keys) or 1.0
+        return self.sub_budget(share=weights.get(key, 1.0) / total, label=key)
+
+    def report(self) -> str:
+        spent = ', '.join(f"{tier}: {seconds:.1f}s" for tier, seconds in sorted(self.tier_seconds.items()))
+        limit = 'unlimited' if self.seconds is None else f"{self.seconds:.1f}s"
+        return f"{self.label or 'budget'} used {self.elapsed():.1f}s of {limit} ({spent or 'no tiers run'})"
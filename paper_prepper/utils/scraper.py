@@ -1,7 +1,6 @@
 import os
 import re
 import asyncio
-import random
 import aiohttp
 from aiohttp import ClientTimeout
 from undetected_playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
@@ -10,21 +9,49 @@ import logging
 import sys
 import json
 import fitz  # PyMuPDF
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin
 import pyperclip
 import time
+from collections import defaultdict
 from aiohttp_retry import RetryClient, ExponentialRetry
 from playwright_stealth import stealth_async
+from utils.html_extractor import extract as extract_html, DEFAULT_BACKEND
+from utils.scrape_budget import ScrapeBudget, BudgetExhausted
+from utils.domain_latency import LatencyTracker
+from utils.circuit_breaker import DomainCircuitBreaker, CircuitOpen, DomainBlocked, BLOCKING_STATUSES
+from utils.page_classifier import classify_page, extract_dom_signals, DomainVerdictLog, FULL_TEXT, HOPELESS_VERDICTS, CAPTCHA
+
+# Relative share of a URL's budget given to each tier, by expected payoff per second
+DEFAULT_TIER_WEIGHTS = {
+    'scrape_with_aiohttp': 1.0,
+    'scrape_with_playwright': 2.0,
+    'scrape_with_headful_playwright': 2.0,
+}
 
 class UnifiedWebScraper:
-    def __init__(self, session, max_concurrent_tasks=10, initial_timeout=15, log_dir="scraper_logs"):
+    def __init__(self, session, max_concurrent_tasks=10, initial_timeout=15, log_dir="scraper_logs", extractor_backend=None,
+                 url_budget=None, tier_weights=None, pdf_link_share=0.4, latency_options=None,
+                 breaker_options=None, deferred_retry_rounds=3):
         self.semaphore = asyncio.Semaphore(max_concurrent_tasks)
         self.user_agent = UserAgent()
         self.browser = None
         self.session = session
         self.failed_urls = []
         self.initial_timeout = initial_timeout
+        self.extractor_backend = extractor_backend
+        self.dom_signals = {}
+        # URLs whose last response was a PDF; their text is never classified as a wall
+        self.pdf_responses = set()
+        self.resolved_urls = {}
+        # URLs whose domain circuit was open; retried after the rest of the batch
+        self.deferred_urls = set()
+        self.breaker = DomainCircuitBreaker(**(breaker_options or {}))
+        self.deferred_retry_rounds = deferred_retry_rounds
+        # Wall-clock seconds allowed per URL (None = unlimited) and how it is split
+        self.url_budget = url_budget
+        self.tier_weights = tier_weights or dict(DEFAULT_TIER_WEIGHTS)
+        self.pdf_link_share = pdf_link_share
+        self.tier_stats = defaultdict(lambda: {'attempts': 0, 'successes': 0, 'seconds': 0.0})
 
         # Set up logging
         self.log_dir = log_dir
@@ -44,6 +71,11 @@ class UnifiedWebScraper:
         # Add the handler to the logger
         self.logger.addHandler(file_handler)
 
+        self.verdict_log = DomainVerdictLog(os.path.join(self.log_dir, "domain_verdicts.json"))
+        # Per-domain timeouts and backoff learned from observed latency; latency_options
+        # sets floors, ceilings and percentiles (see LatencyTracker)
+        self.latency = LatencyTracker(os.path.join(self.log_dir, "domain_latency.json"), **(latency_options or {}))
+
         self.logger.info("UnifiedWebScraper initialized")
 
     async def initialize(self):
@@ -57,6 +89,9 @@ class UnifiedWebScraper:
             raise
 
     async def close(self):
+        self.verdict_log.save()
+        self.save_tier_stats()
+        self.latency.save()
         if self.browser:
             await self.browser.close()
             self.logger.info("Playwright browser closed")
@@ -72,17 +107,30 @@ class UnifiedWebScraper:
             return f"http://{url}"
         return url
 
-    async def scrape(self, url, min_words=700, max_retries=3):
+    async def scrape(self, url, min_words=700, max_retries=3, budget=None):
         normalized_url = self.normalize_url(url)
         self.logger.info(f"Starting scrape for URL: {normalized_url}")
+        if budget is None:
+            budget = ScrapeBudget(self.url_budget, label=normalized_url)
+        else:
+            budget = budget.sub_budget(max_seconds=self.url_budget, label=normalized_url)
 
-        content = await self.escalating_scrape(normalized_url, min_words, max_retries)
+        page_budget = budget.sub_budget(share=1 - self.pdf_link_share, label=f"{normalized_url} (page)")
+        try:
+            content = await self.escalating_scrape(normalized_url, min_words, max_retries, budget=page_budget)
+        except CircuitOpen as e:
+            self.logger.warning(f"Deferring URL: {normalized_url}: {str(e)}")
+            self.deferred_urls.add(normalized_url)
+            return ""
         
         if len(content.split()) >= min_words:
+            self.logger.info(budget.report())
             return content
         
         # If content is still below threshold, look for PDF links
-        pdf_links = await self.find_pdf_links(normalized_url)
+        pdf_links = []
+        if not budget.expired():
+            pdf_links = await self.find_pdf_links(normalized_url, budget=budget)
         
         if pdf_links:
             self.logger.info(f"Found {len(pdf_links)} PDF-like links for URL: {normalized_url}")
@@ -90,56 +138,144 @@ class UnifiedWebScraper:
                 self.logger.info(f"PDF-like link found: {link}")
             
             pdf_contents = []
-            for pdf_link in pdf_links:
-                pdf_content = await self.escalating_scrape(pdf_link, min_words, max_retries)
+            for index, pdf_link in enumerate(pdf_links):
+                if budget.expired():
+                    self.logger.warning(f"Budget exhausted before trying {len(pdf_links) - index} remaining PDF links for URL: {normalized_url}")
+                    break
+                link_budget = budget.sub_budget(share=1 / (len(pdf_links) - index), label=pdf_link)
+                try:
+                    pdf_content = await self.escalating_scrape(pdf_link, min_words, max_retries, budget=link_budget)
+                except CircuitOpen as e:
+                    self.logger.warning(f"Skipping PDF link {pdf_link}: {str(e)}")
+                    continue
                 if len(pdf_content.split()) >= min_words:
                     pdf_contents.append(pdf_content)
             
             if pdf_contents:
                 best_content = max(pdf_contents, key=len)
                 if len(best_content.split()) >= min_words:
+                    self.logger.info(budget.report())
                     return best_content
         
         self.logger.warning(f"Failed to scrape sufficient content from URL: {normalized_url}")
+        self.logger.info(budget.report())
         self.failed_urls.append(normalized_url)
         return ""  # Return empty string if no content meets the threshold
 
-    async def escalating_scrape(self, url, min_words, max_retries):
+    async def escalating_scrape(self, url, min_words, max_retries, budget=None):
         methods = [
             self.scrape_with_aiohttp,
             self.scrape_with_playwright,
             self.scrape_with_headful_playwright
         ]
+        budget = budget or ScrapeBudget(label=url)
+        # One dead URL retried across tiers must not trip its domain's circuit on its own
+        failure_recorded = False
+
+        def record_failure(reason):
+            nonlocal failure_recorded
+            if failure_recorded:
+                self.breaker.release(url)
+            else:
+                self.breaker.record_failure(url, reason)
+                failure_recorded = True
         
-        for method in methods:
+        for index, method in enumerate(methods):
+            tier = method.__name__
+            if budget.expired():
+                self.logger.warning(f"Budget exhausted before {tier} for URL: {url}")
+                break
+            tier_budget = budget.allocate(self.tier_weights, tier, [m.__name__ for m in methods[index:]])
             for attempt in range(1, max_retries + 1):
-                timeout = self.initial_timeout * attempt
+                learned_timeout = self.latency.timeout_for(url, tier, self.initial_timeout * attempt, attempt)
+                timeout = tier_budget.cap_timeout(learned_timeout)
+                # A timeout cut short by the budget says nothing about the host
+                capped = timeout < learned_timeout
+                if timeout <= 0:
+                    self.logger.warning(f"{tier} budget exhausted after {attempt - 1} attempts for URL: {url}")
+                    break
+                if not self.breaker.acquire(url):
+                    raise CircuitOpen(f"circuit for {self.breaker.domain_for(url)} is {self.breaker.state(url)}")
+                stats = self.tier_stats[tier]
+                stats['attempts'] += 1
+                started = time.monotonic()
                 try:
-                    self.logger.info(f"Attempt {attempt} using {method.__name__} for URL: {url}")
-                    content = await method(url, timeout)
-                    word_count = len(content.split())
-                    self.logger.info(f"{method.__name__} returned {word_count} words for URL: {url}")
-                    if word_count >= min_words:
-                        self.logger.info(f"Successfully scraped URL: {url} using {method.__name__}")
+                    self.logger.info(f"Attempt {attempt} using {tier} for URL: {url} (timeout {timeout:.1f}s)")
+                    content = await tier_budget.run(tier, method(url, timeout), timeout)
+                    self.latency.record(url, tier, time.monotonic() - started)
+                    self.breaker.learn_resolution(url, self.resolved_urls.pop(url, ''))
+                    assessment = self.assess_content(url, content, min_words)
+                    verdict = assessment['verdict']
+                    if verdict == CAPTCHA:
+                        record_failure("captcha")
+                    else:
+                        self.breaker.record_success(url)
+                    self.logger.info(f"{tier} returned {assessment['word_count']} words for URL: {url} (verdict: {verdict})")
+                    if verdict == FULL_TEXT:
+                        stats['successes'] += 1
+                        self.logger.info(f"Successfully scraped URL: {url} using {tier}")
                         return content
+                    elif verdict in HOPELESS_VERDICTS:
+                        self.logger.warning(f"Stopping escalation for URL: {url}: page classified as {verdict}")
+                        return ""
                     else:
-                        self.logger.warning(f"Scraped content below threshold for URL: {url} using {method.__name__}")
+                        self.logger.warning(f"Scraped content rejected ({verdict}) for URL: {url} using {tier}")
+                except BudgetExhausted as e:
+                    self.breaker.release(url)
+                    self.logger.warning(f"{str(e)} for URL: {url}")
+                except DomainBlocked as e:
+                    self.breaker.learn_resolution(url, self.resolved_urls.pop(url, ''))
+                    record_failure(str(e))
+                    self.logger.error(f"Blocked in {tier} (attempt {attempt}) for URL: {url}: {str(e)}")
+                except (asyncio.TimeoutError, PlaywrightTimeoutError) as e:
+                    if capped:
+                        self.breaker.release(url)
+                        self.logger.warning(f"{tier} budget exhausted after {timeout:.1f}s (attempt {attempt}) for URL: {url}")
+                        continue
+                    self.latency.record_timeout(url, tier, timeout)
+                    record_failure("timeout")
+                    self.logger.error(f"Timeout in {tier} after {timeout:.1f}s (attempt {attempt}) for URL: {url}: {str(e)}")
                 except Exception as e:
-                    self.logger.error(f"Error in {method.__name__} (attempt {attempt}) for URL: {url}: {str(e)}")
+                    # SSL, DNS, parse and extractor errors say nothing about the host pushing back
+                    self.breaker.release(url)
+                    self.logger.error(f"Error in {tier} (attempt {attempt}) for URL: {url}: {str(e)}")
+                finally:
+                    stats['seconds'] += time.monotonic() - started
 
                 if attempt < max_retries:
-                    wait_time = random.uniform(1, 3) * attempt
+                    wait_time = min(self.latency.backoff_for(url, tier, attempt, (1, 3)), tier_budget.remaining())
                     self.logger.info(f"Waiting for {wait_time:.2f} seconds before retrying...")
                     await asyncio.sleep(wait_time)
         
         return ""  # Return empty string if all methods fail
 
-    async def find_pdf_links(self, url):
+    def save_tier_stats(self):
+        """Write cumulative time, attempts and successes per tier for budget tuning."""
+        stats_file = os.path.join(self.log_dir, "tier_stats.json")
+        try:
+            with open(stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self.tier_stats, f, indent=4)
+            for tier, stats in self.tier_stats.items():
+                self.logger.info(f"Tier {tier}: {stats['attempts']} attempts, {stats['successes']} successes, {stats['seconds']:.1f}s")
+        except Exception as e:
+            self.logger.error(f"Failed to save tier stats: {str(e)}")
+
+    def assess_content(self, url, content, min_words):
+        is_pdf = url in self.pdf_responses
+        self.pdf_responses.discard(url)
+        assessment = classify_page(content, min_words=min_words, dom_signals=self.dom_signals.pop(url, None), is_pdf=is_pdf)
+        self.verdict_log.record(url, assessment['verdict'])
+        if assessment['verdict'] != FULL_TEXT:
+            self.logger.info(f"Page signals for URL: {url}: {assessment['signals']}")
+        return assessment
+
+    async def find_pdf_links(self, url, budget=None):
+        timeout = budget.cap_timeout(self.initial_timeout) if budget else self.initial_timeout
         try:
             context = await self.browser.new_context(user_agent=self.user_agent.random)
             page = await context.new_page()
             await stealth_async(page)
-            await page.goto(url, wait_until="networkidle", timeout=self.initial_timeout * 1000)
+            await page.goto(url, wait_until="networkidle", timeout=timeout * 1000)
             
             pdf_links = await page.evaluate("""
                 () => {
@@ -163,14 +299,19 @@ class UnifiedWebScraper:
         async with RetryClient(retry_options=retry_options) as client:
             try:
                 async with client.get(url, headers=headers, timeout=ClientTimeout(total=timeout)) as response:
+                    self.resolved_urls[url] = str(response.url)
+                    if response.status in BLOCKING_STATUSES:
+                        raise DomainBlocked(response.status, str(response.url))
                     if response.status == 200:
                         content_type = response.headers.get('Content-Type', '').lower()
                         if 'application/pdf' in content_type or url.lower().endswith('.pdf'):
                             self.logger.info(f"Detected PDF content for URL: {url}")
                             pdf_bytes = await response.read()
+                            self.pdf_responses.add(url)
                             return self.extract_text_from_pdf(pdf_bytes)
                         else:
                             text = await response.text()
+                            self.dom_signals[url] = extract_dom_signals(text)
                             return self.extract_text_from_html(text)
                     else:
                         self.logger.warning(f"Received status code {response.status} for URL: {url}")
@@ -194,38 +335,40 @@ class UnifiedWebScraper:
             await self.handle_cookie_consent(page)
             
             content = await page.content()
-            await page.close()
-            await context.close()
-
-            # Check if content is PDF
-            if 'application/pdf' in page.url.lower() or url.lower().endswith('.pdf'):
-                self.logger.info(f"Playwright detected PDF content for URL: {url}")
-                pdf_bytes = await self.download_pdf(url)
-                return self.extract_text_from_pdf(pdf_bytes)
-
-            return self.extract_text_from_html(content)
+            page_url = page.url
+            self.resolved_urls[url] = page_url
         except PlaywrightTimeoutError:
             self.logger.warning(f"Playwright timeout for URL: {url}")
-            await page.close()
-            await context.close()
             raise
         except Exception as e:
             self.logger.error(f"Playwright error for URL: {url}: {str(e)}")
+            raise
+        finally:
+            # Runs on budget cancellation too, which except Exception does not catch
             await page.close()
             await context.close()
-            raise
+
+        # Check if content is PDF
+        if 'application/pdf' in page_url.lower() or url.lower().endswith('.pdf'):
+            self.logger.info(f"Playwright detected PDF content for URL: {url}")
+            pdf_bytes = await self.download_pdf(url, timeout=timeout)
+            self.pdf_responses.add(url)
+            return self.extract_text_from_pdf(pdf_bytes)
+
+        self.dom_signals[url] = extract_dom_signals(content)
+        return self.extract_text_from_html(content)
 
     async def scrape_with_headful_playwright(self, url, timeout):
         args = ["--disable-blink-features=AutomationControlled"]
         browser = await self.playwright.chromium.launch(headless=False, args=args)
-        context = await browser.new_context(
-            user_agent=self.user_agent.random,
-            viewport={"width": 1920, "height": 1080},
-            ignore_https_errors=True,
-        )
-        page = await context.new_page()
-        await stealth_async(page)
         try:
+            context = await browser.new_context(
+                user_agent=self.user_agent.random,
+                viewport={"width": 1920, "height": 1080},
+                ignore_https_errors=True,
+            )
+            page = await context.new_page()
+            await stealth_async(page)
             await page.goto(url, wait_until="networkidle", timeout=timeout * 1000)
             
             # Handle cookie consent popups
@@ -235,19 +378,13 @@ class UnifiedWebScraper:
             await self.scroll_page(page)
             
             # Try multiple selection strategies
-            content = await self.try_multiple_selections(page)
-            
-            await page.close()
-            await context.close()
-            await browser.close()
-
-            return content
+            return await self.try_multiple_selections(page)
         except Exception as e:
             self.logger.error(f"Headful Playwright error for URL: {url}: {str(e)}")
-            await page.close()
-            await context.close()
-            await browser.close()
             raise
+        finally:
+            # Closing the browser also closes its contexts and pages
+            await browser.close()
 
     async def handle_cookie_consent(self, page):
         consent_button_selectors = [
@@ -321,9 +458,9 @@ class UnifiedWebScraper:
             text += await p.inner_text() + "\n"
         return text
 
-    async def download_pdf(self, url):
+    async def download_pdf(self, url, timeout=None):
         headers = {"User-Agent": self.user_agent.random}
-        async with self.session.get(url, headers=headers, timeout=ClientTimeout(total=self.initial_timeout)) as response:
+        async with self.session.get(url, headers=headers, timeout=ClientTimeout(total=timeout or self.initial_timeout)) as response:
             if response.status == 200:
                 return await response.read()
             else:
@@ -343,13 +480,11 @@ class UnifiedWebScraper:
             return ""
 
     def extract_text_from_html(self, html_content):
-        self.logger.info("Extracting text from HTML")
+        self.logger.info(f"Extracting text from HTML using '{self.extractor_backend or DEFAULT_BACKEND}' backend")
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            for script_or_style in soup(['script', 'style', 'nav', 'footer']):
-                script_or_style.decompose()
-            text = soup.get_text(separator=' ', strip=True)
-            return text
+            result = extract_html(html_content, backend=self.extractor_backend)
+            self.logger.info(f"HTML extraction method: {result['method']} ({len(result['text'].split())} words)")
+            return result['text']
         except Exception as e:
             self.logger.error(f"Failed to extract text from HTML: {str(e)}")
             return ""
@@ -388,6 +523,9 @@ class UnifiedWebScraper:
         normalized_url = self.normalize_url(url)
         filename = self.sanitize_filename(normalized_url)
         
+        if normalized_url in self.deferred_urls:
+            self.logger.info(f"URL: {url} | Status: Deferred (circuit open for {self.breaker.domain_for(normalized_url)})")
+            return False
         if word_count >= min_words:
             self.save_content(content, filename, output_folder)
             self.logger.info(f"URL: {url} | Status: Success | Word count: {word_count} | Scraping time: {scraping_time:.2f}s | Saved as: {filename}")
@@ -404,6 +542,7 @@ class UnifiedWebScraper:
             task = asyncio.create_task(self.process_url(url, output_folder))
             tasks.append(task)
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        results += await self.retry_deferred(output_folder)
         self.save_failed_urls(output_folder)
         success_count = sum(1 for result in results if result is True)
         failure_count = len(urls) - success_count
@@ -414,6 +553,25 @@ class UnifiedWebScraper:
         print(f"Failed scrapes: {failure_count}")
         print(f"Results saved in: {output_folder}")
 
+    async def retry_deferred(self, output_folder):
+        """Retry URLs deferred by open circuits once their domains admit a probe."""
+        results = []
+        for round_number in range(1, self.deferred_retry_rounds + 1):
+            if not self.deferred_urls:
+                break
+            urls = sorted(self.deferred_urls)
+            self.deferred_urls.clear()
+            delay = self.breaker.next_retry_delay(urls)
+            self.logger.info(f"Retry round {round_number} for {len(urls)} deferred URLs in {delay:.0f}s. Circuits: {self.breaker.summary()}")
+            await asyncio.sleep(delay)
+            tasks = [asyncio.create_task(self.process_url(url, output_folder)) for url in urls]
+            results += await asyncio.gather(*tasks, return_exceptions=True)
+        if self.deferred_urls:
+            self.logger.warning(f"{len(self.deferred_urls)} URLs still deferred after {self.deferred_retry_rounds} rounds")
+            self.failed_urls.extend(sorted(self.deferred_urls))
+            self.deferred_urls.clear()
+        return results
+
 async def main():
     log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logging.basicConfig(
@@ -13,17 +13,93 @@ import fitz  # PyMuPDF
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin
 import time
+from collections import defaultdict
 from aiohttp_retry import RetryClient, ExponentialRetry
 from playwright_stealth import stealth_async
+from utils.html_extractor import extract as extract_html, DEFAULT_BACKEND
+from utils.scrape_budget import ScrapeBudget, BudgetExhausted
+from utils.domain_latency import LatencyTracker
+from utils.circuit_breaker import DomainCircuitBreaker, DomainBlocked, BLOCKING_STATUSES
+from utils.page_classifier import classify_page, extract_dom_signals, DomainVerdictLog, FULL_TEXT, CAPTCHA
+
+# Elements whose text is treated as page chrome rather than paper content
+BOILERPLATE_TAGS = ['script', 'style', 'nav', 'footer', 'header', 'aside']
+
+# Walks the live DOM inside the browser and serializes visible text the same way
+# BeautifulSoup's get_text(separator=' ', strip=True) does, skipping boilerplate
+# subtrees without mutating the page (it is still needed for page.pdf()).
+IN_PAGE_EXTRACT_JS = """
+(boilerplateTags) => {
+    const skip = new Set(boilerplateTags.map(t => t.toUpperCase()));
+    const root = document.documentElement;
+    const stats = {elements: 0, skipped_elements: 0, text_nodes: 0, paragraphs: 0, links: 0};
+    if (!root) {
+        return {text: '', stats: stats};
+    }
+    const walker = document.createTreeWalker(
+        root,
+        NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT,
+        {
+            acceptNode(node) {
+                if (node.nodeType === Node.ELEMENT_NODE && skip.has(node.tagName)) {
+                    stats.skipped_elements++;
+                    return NodeFilter.FILTER_REJECT;
+                }
+                return NodeFilter.FILTER_ACCEPT;
+            }
+        }
+    );
+    const parts = [];
+    let node;
+    while ((node = walker.nextNode())) {
+        if (node.nodeType === Node.TEXT_NODE) {
+            const value = node.nodeValue.trim();
+            if (value) {
+                parts.push(value);
+                stats.text_nodes++;
+            }
+        } else {
+            stats.elements++;
+            if (node.tagName === 'P') stats.paragraphs++;
+            else if (node.tagName === 'A') stats.links++;
+        }
+    }
+    stats.captcha_elements = document.querySelectorAll(
+        '.g-recaptcha, .h-captcha, #challenge-form, #cf-challenge-running, ' +
+        'iframe[src*="captcha"], iframe[src*="challenges.cloudflare.com"]').length;
+    stats.paywall_elements = document.querySelectorAll(
+        '[class*="paywall"], [id*="paywall"], [class*="access-denied"], ' +
+        '[class*="purchase-options"], [class*="get-access"]').length;
+    stats.has_citation_pdf_url = document.querySelector('meta[name="citation_pdf_url"]') ? 1 : 0;
+    const text = parts.join(' ');
+    stats.characters = text.length;
+    stats.words = text.split(/\\s+/).filter(Boolean).length;
+    return {text: text, stats: stats};
+}
+"""
 
 class UnifiedWebScraper:
-    def __init__(self, session, max_concurrent_tasks=1, initial_timeout=30, log_dir="scraper_logs"):
+    def __init__(self, session, max_concurrent_tasks=1, initial_timeout=30, log_dir="scraper_logs", extractor_backend=None,
+                 url_budget=None, read_time_share=0.4, latency_options=None,
+                 breaker_options=None, deferred_retry_rounds=3):
         self.semaphore = asyncio.Semaphore(max_concurrent_tasks)
         self.user_agent = self.initialize_user_agent()
         self.browser = None
         self.session = session
         self.failed_urls = []
         self.initial_timeout = initial_timeout
+        self.extractor_backend = extractor_backend
+        # Wall-clock seconds allowed per URL (None = unlimited); the simulated
+        # reading pause never takes more than read_time_share of an attempt's budget
+        self.url_budget = url_budget
+        self.read_time_share = read_time_share
+        self.tier_stats = defaultdict(lambda: {'attempts': 0, 'successes': 0, 'seconds': 0.0})
+        # URLs whose domain circuit was open; retried after the rest of the batch
+        self.breaker = DomainCircuitBreaker(**(breaker_options or {}))
+        self.deferred_urls = set()
+        self.deferred_retry_rounds = deferred_retry_rounds
+        self.last_verdicts = {}
+        self.last_page_stats = {}
 
         # Set up logging
         self.log_dir = log_dir
@@ -49,6 +125,10 @@ class UnifiedWebScraper:
         console_handler.setFormatter(formatter)
         self.logger.addHandler(console_handler)
 
+        self.verdict_log = DomainVerdictLog(os.path.join(self.log_dir, "domain_verdicts.json"))
+        # Per-domain navigation timeouts and retry backoff learned from observed latency
+        self.latency = LatencyTracker(os.path.join(self.log_dir, "slow_domain_latency.json"), **(latency_options or {}))
+
         self.logger.info("UnifiedWebScraper initialized with headful browser and enhanced stealth features.")
 
     def initialize_user_agent(self):
@@ -84,6 +164,9 @@ class UnifiedWebScraper:
             raise
 
     async def close(self):
+        self.verdict_log.save()
+        self.save_tier_stats()
+        self.latency.save()
         if self.browser:
             await self.browser.close()
             self.logger.info("Playwright browser closed.")
@@ -99,34 +182,86 @@ class UnifiedWebScraper:
             return f"http://{url}"
         return url
 
-    async def scrape(self, url, min_words=700, max_retries=3):
+    async def scrape(self, url, min_words=700, max_retries=3, budget=None):
         normalized_url = self.normalize_url(url)
         self.logger.info(f"Starting scrape for URL: {normalized_url}")
+        if budget is None:
+            budget = ScrapeBudget(self.url_budget, label=normalized_url)
+        else:
+            budget = budget.sub_budget(max_seconds=self.url_budget, label=normalized_url)
+        tier = 'headful_playwright'
+        # One dead URL retried several times must not trip its domain's circuit on its own
+        failure_recorded = False
 
         for attempt in range(1, max_retries + 1):
+            if budget.expired():
+                self.logger.warning(f"Budget exhausted before attempt {attempt} for URL: {normalized_url}")
+                self.failed_urls.append(normalized_url)
+                break
+            if not self.breaker.acquire(normalized_url):
+                self.logger.warning(f"Circuit for {self.breaker.domain_for(normalized_url)} is {self.breaker.state(normalized_url)}; deferring URL: {normalized_url}")
+                self.deferred_urls.add(normalized_url)
+                return "", ""
+            attempt_budget = budget.sub_budget(share=1 / (max_retries - attempt + 1), label=f"{normalized_url} (attempt {attempt})")
+            stats = self.tier_stats[tier]
+            stats['attempts'] += 1
+            started = time.monotonic()
             try:
                 async with self.semaphore:
                     self.logger.info(f"Attempt {attempt} for URL: {normalized_url}")
-                    content, pdf_path = await self.scrape_with_headful_playwright(normalized_url)
+                    content, pdf_path = await attempt_budget.run(
+                        tier, self.scrape_with_headful_playwright(normalized_url, min_words=min_words, budget=attempt_budget)
+                    )
+                    if self.last_verdicts.pop(normalized_url, None) != CAPTCHA:
+                        self.breaker.record_success(normalized_url)
+                    elif failure_recorded:
+                        self.breaker.release(normalized_url)
+                    else:
+                        self.breaker.record_failure(normalized_url, "captcha")
+                        failure_recorded = True
                     
-                    if len(content.split()) >= min_words:
+                    if pdf_path and len(content.split()) >= min_words:
+                        stats['successes'] += 1
                         self.logger.info(f"Successfully scraped URL: {normalized_url} on attempt {attempt}.")
+                        self.logger.info(budget.report())
                         return content, pdf_path
                     else:
-                        self.logger.warning(f"Content below threshold for URL: {normalized_url} on attempt {attempt}.")
+                        self.logger.warning(f"Content below threshold or rejected for URL: {normalized_url} on attempt {attempt}.")
                         # If content is insufficient, no point in retrying
                         break
             except Exception as e:
+                blocking = isinstance(e, (DomainBlocked, PlaywrightTimeoutError, asyncio.TimeoutError))
+                if blocking and not failure_recorded:
+                    self.breaker.record_failure(normalized_url, "timeout" if not isinstance(e, DomainBlocked) else str(e))
+                    failure_recorded = True
+                else:
+                    # Budget, SSL, DNS and extraction errors say nothing about the host pushing back
+                    self.breaker.release(normalized_url)
                 self.logger.error(f"Error scraping URL: {normalized_url} on attempt {attempt}: {str(e)}")
                 if attempt < max_retries:
-                    wait_time = random.uniform(10, 20)
+                    wait_time = min(self.latency.backoff_for(normalized_url, 'navigation', 1, (10, 20)), budget.remaining())
                     self.logger.info(f"Waiting for {wait_time:.2f} seconds before retrying...")
                     await asyncio.sleep(wait_time)
                 else:
                     self.failed_urls.append(normalized_url)
+            finally:
+                stats['seconds'] += time.monotonic() - started
+        self.logger.info(budget.report())
         return "", ""
 
-    async def scrape_with_headful_playwright(self, url):
+    def save_tier_stats(self):
+        """Write cumulative time, attempts and successes per tier for budget tuning."""
+        stats_file = os.path.join(self.log_dir, "tier_stats.json")
+        try:
+            with open(stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self.tier_stats, f, indent=4)
+            for tier, stats in self.tier_stats.items():
+                self.logger.info(f"Tier {tier}: {stats['attempts']} attempts, {stats['successes']} successes, {stats['seconds']:.1f}s")
+        except Exception as e:
+            self.logger.error(f"Failed to save tier stats: {str(e)}")
+
+    async def scrape_with_headful_playwright(self, url, min_words=700, budget=None):
+        budget = budget or ScrapeBudget(label=url)
         context = await self.browser.new_context(
             user_agent=random.choice(self.user_agent),
             viewport={"width": 1920, "height": 1080},
@@ -136,14 +271,29 @@ class UnifiedWebScraper:
         await stealth_async(page)
         try:
             self.logger.info(f"Navigating to URL: {url}")
-            await page.goto(url, wait_until="networkidle", timeout=self.initial_timeout * 1000)
+            # Only navigation is timed; the reading pause and scrolling are deliberate
+            learned_timeout = self.latency.timeout_for(url, 'navigation', self.initial_timeout)
+            goto_timeout = budget.cap_timeout(learned_timeout)
+            navigation_started = time.monotonic()
+            try:
+                response = await page.goto(url, wait_until="networkidle", timeout=goto_timeout * 1000)
+            except PlaywrightTimeoutError as e:
+                if goto_timeout < learned_timeout:
+                    # Cut short by the budget, not the host: no latency sample, no breaker failure
+                    raise BudgetExhausted(f"navigation budget exhausted after {goto_timeout:.1f}s") from e
+                self.latency.record_timeout(url, 'navigation', goto_timeout)
+                raise
+            self.latency.record(url, 'navigation', time.monotonic() - navigation_started)
+            self.breaker.learn_resolution(url, page.url)
+            if response is not None and response.status in BLOCKING_STATUSES:
+                raise DomainBlocked(response.status, page.url)
             
             # Handle cookie consent popups
             await self.handle_cookie_consent(page)
             
             # Simulate human-like reading time
-            read_time = random.randint(60, 120)  # Wait between 1 to 2 minutes
-            self.logger.info(f"Waiting for {read_time} seconds to mimic human reading time.")
+            read_time = min(random.randint(60, 120), budget.remaining() * self.read_time_share)  # Wait between 1 to 2 minutes
+            self.logger.info(f"Waiting for {read_time:.0f} seconds to mimic human reading time.")
             await asyncio.sleep(read_time)
             
             # Perform slow scrolling
@@ -151,30 +301,34 @@ class UnifiedWebScraper:
             
             # Extract text for word count
             content = await self.extract_text_from_page(page)
-            word_count = len(content.split())
-            self.logger.info(f"Extracted {word_count} words from URL: {url}")
+            dom_signals = {k: self.last_page_stats[k] for k in ('captcha_elements', 'paywall_elements', 'has_citation_pdf_url')
+                           if k in self.last_page_stats}
+            is_pdf = response is not None and 'application/pdf' in (response.headers.get('content-type') or '').lower()
+            assessment = classify_page(content, min_words=min_words, dom_signals=dom_signals, is_pdf=is_pdf)
+            self.verdict_log.record(url, assessment['verdict'])
+            self.last_verdicts[url] = assessment['verdict']
+            self.logger.info(f"Extracted {assessment['word_count']} words from URL: {url} (verdict: {assessment['verdict']})")
 
             pdf_path = ""
-            if word_count >= 700:
+            if assessment['verdict'] == FULL_TEXT:
                 # Save page as PDF
                 pdf_path = await self.save_page_as_pdf(page, url)
                 self.logger.info(f"Saved PDF for URL: {url} at {pdf_path}")
             else:
-                self.logger.warning(f"Insufficient content to save PDF for URL: {url}")
+                self.logger.warning(f"Page rejected as {assessment['verdict']}, not saving PDF for URL: {url}. Signals: {assessment['signals']}")
+                content = ""
 
-            await page.close()
-            await context.close()
             return content, pdf_path
         except PlaywrightTimeoutError:
             self.logger.warning(f"Playwright timeout for URL: {url}")
-            await page.close()
-            await context.close()
             raise
         except Exception as e:
             self.logger.error(f"Playwright error for URL: {url}: {str(e)}")
+            raise
+        finally:
+            # Runs on budget cancellation too, which except Exception does not catch
             await page.close()
             await context.close()
-            raise
 
     async def handle_cookie_consent(self, page):
         consent_button_selectors = [
@@ -215,10 +369,19 @@ class UnifiedWebScraper:
 
     async def extract_text_from_page(self, page):
         self.logger.info("Extracting text from the page.")
+        try:
+            result = await page.evaluate(IN_PAGE_EXTRACT_JS, BOILERPLATE_TAGS)
+            self.last_page_stats = result.get('stats', {})
+            self.logger.info(f"In-page extraction stats: {self.last_page_stats}")
+            return result.get('text', '')
+        except Exception as e:
+            self.logger.warning(f"In-page extraction failed, falling back to BeautifulSoup: {str(e)}")
+
         try:
             content = await page.content()
+            self.last_page_stats = extract_dom_signals(content)
             soup = BeautifulSoup(content, 'html.parser')
-            for script_or_style in soup(['script', 'style', 'nav', 'footer', 'header', 'aside']):
+            for script_or_style in soup(BOILERPLATE_TAGS):
                 script_or_style.decompose()
             text = soup.get_text(separator=' ', strip=True)
             return text
@@ -281,13 +444,11 @@ class UnifiedWebScraper:
 
     def extract_text_from_html(self, html_content):
         # Retained for compatibility, but may not be used in the new flow
-        self.logger.info("Extracting text from HTML.")
+        self.logger.info(f"Extracting text from HTML using '{self.extractor_backend or DEFAULT_BACKEND}' backend.")
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            for script_or_style in soup(['script', 'style', 'nav', 'footer']):
-                script_or_style.decompose()
-            text = soup.get_text(separator=' ', strip=True)
-            return text
+            result = extract_html(html_content, backend=self.extractor_backend)
+            self.logger.info(f"HTML extraction method: {result['method']} ({len(result['text'].split())} words)")
+            return result['text']
         except Exception as e:
             self.logger.error(f"Failed to extract text from HTML: {str(e)}")
             return ""
@@ -328,6 +489,9 @@ class UnifiedWebScraper:
         normalized_url = self.normalize_url(url)
         filename = self.sanitize_filename(normalized_url)
         
+        if normalized_url in self.deferred_urls:
+            self.logger.info(f"URL: {url} | Status: Deferred (circuit open for {self.breaker.domain_for(normalized_url)})")
+            return False
         if word_count >= min_words and pdf_path:
             self.save_content(content, filename, output_folder)  # Optionally save text as well
             self.logger.info(f"URL: {url} | Status: Success | Word count: {word_count} | Scraping time: {scraping_time:.2f}s | Saved as: {filename}")
@@ -343,11 +507,15 @@ class UnifiedWebScraper:
         for url in urls:
             task = asyncio.create_task(self.process_url(url, output_folder))
             tasks.append(task)
+            # URLs for blocked domains are deferred immediately, so skip the pause for them
+            if self.breaker.blocked(self.normalize_url(url)):
+                continue
             # Introduce delay between processing URLs to mimic human behavior
             delay = random.uniform(30, 60)  # 30 to 60 seconds
             self.logger.info(f"Waiting for {delay:.2f} seconds before processing the next URL.")
             await asyncio.sleep(delay)
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        results += await self.retry_deferred(output_folder)
         self.save_failed_urls(output_folder)
         success_count = sum(1 for result in results if result is True)
         failure_count = len(urls) - success_count
@@ -358,6 +526,25 @@ class UnifiedWebScraper:
         print(f"Failed scrapes: {failure_count}")
         print(f"Results saved in: {output_folder}")
 
+    async def retry_deferred(self, output_folder):
+        """Retry URLs deferred by open circuits once their domains admit a probe."""
+        results = []
+        for round_number in range(1, self.deferred_retry_rounds + 1):
+            if not self.deferred_urls:
+                break
+            urls = sorted(self.deferred_urls)
+            self.deferred_urls.clear()
+            delay = self.breaker.next_retry_delay(urls)
+            self.logger.info(f"Retry round {round_number} for {len(urls)} deferred URLs in {delay:.0f}s. Circuits: {self.breaker.summary()}")
+            await asyncio.sleep(delay)
+            for url in urls:
+                results.append(await self.process_url(url, output_folder))
+        if self.deferred_urls:
+            self.logger.warning(f"{len(self.deferred_urls)} URLs still deferred after {self.deferred_retry_rounds} rounds")
+            self.failed_urls.extend(sorted(self.deferred_urls))
+            self.deferred_urls.clear()
+        return results
+
 async def main():
     log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logging.basicConfig(
@@ -0,0 +1,159 @@
+# paper_prepper/utils/source_index.py
+
+import re
+import math
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z][a-z0-9\-]{2,}")
+STOPWORDS = frozenset("""
+about above after again against all also among and any are because been before being below between both
+but can could did does doing down during each few for from further had has have having her here hers
+herself him himself his how however into its itself just more most much must not now off once only other
+our ours out over own same she should such than that the their theirs them themselves then there these
+they this those through too under until upon very was were what when where which while who whom why
+will with within without would you your yours et al fig figure table using used use based study
+""".split())
+
+# Lines that look like headings: markdown, numbered ("2.1 Methods") or short title-like lines
+MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s+(.+)$")
+NUMBERED_HEADING_RE = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVX]+\.)\s+([A-Z].{0,100})$")
+MAX_HEADING_WORDS = 12
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Reference texts are long; only their most distinctive terms form the query
+MAX_QUERY_TERMS = 200
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall((text or '').lower()) if t not in STOPWORDS]
+
+
+def _heading_text(line: str) -> str:
+    """Heading text if the line looks like a section heading, else ''."""
+    stripped = line.strip()
+    if not stripped:
+        return ''
+    match = MARKDOWN_HEADING_RE.match(stripped) or NUMBERED_HEADING_RE.match(stripped)
+    if match:
+        return match.group(1).strip()
+    words = stripped.split()
+    if len(words) <= MAX_HEADING_WORDS and stripped[-1] not in '.,;:?!)"' and stripped[0].isupper() \
+            and (stripped.isupper() or stripped.istitle() or len(words) <= 4):
+        return stripped
+    return ''
+
+
+@dataclass
+class Section:
+    heading: str
+    paragraphs: List[str] = field(default_factory=list)
+    position: int = 0
+    # The heading line as written in the draft ("2.1 Methods", "## Results"), rendered unchanged
+    heading_line: str = ''
+
+    @property
+    def text(self) -> str:
+        return '\n\n'.join(self.paragraphs)
+
+    def render(self) -> str:
+        return f"{self.heading_line}\n\n{self.text}" if self.heading_line else self.text
+
+
+def split_sections(text: str) -> List[Section]:
+    """Split a draft into sections of paragraphs, keeping headings and paragraph text verbatim."""
+    sections = [Section(heading='', position=0)]
+    for block in re.split(r"\n\s*\n", text or ''):
+        lines = [line for line in block.strip().splitlines() if line.strip()]
+        if not lines:
+            continue
+        heading = _heading_text(lines[0])
+        if heading:
+            sections.append(Section(heading=heading, heading_line=lines[0]))
+            lines = lines[1:]
+        if lines:
+            sections[-1].paragraphs.append('\n'.join(lines))
+    sections = [s for s in sections if s.paragraphs or s.heading]
+    for position, section in enumerate(sections):
+        section.position = position
+    return sections
+
+
+class SourceIndex:
+    """
+    BM25 index over the sections of the source text (the review draft).
+
+    A section's score is its own BM25 score plus the best score of any of its
+    paragraphs, so a section with one highly relevant paragraph is not drowned
+    out by a long, unrelated remainder.
+    """
+
+    def __init__(self, text: str):
+        self.sections = split_sections(text)
+        self.section_terms = [Counter(tokenize(f"{s.heading} {s.text}")) for s in self.sections]
+        self.paragraph_terms = [[Counter(tokenize(p)) for p in s.paragraphs] for s in self.sections]
+        units = self.section_terms + [c for paragraphs in self.paragraph_terms for c in paragraphs]
+        self.document_frequency = Counter(term for unit in units for term in unit)
+        self.unit_count = max(len(units), 1)
+        self.average_section_length = sum(sum(c.values()) for c in self.section_terms) / max(len(self.sections), 1)
+        paragraph_lengths = [sum(c.values()) for paragraphs in self.paragraph_terms for c in paragraphs]
+        self.average_paragraph_length = sum(paragraph_lengths) / max(len(paragraph_lengths), 1)
+        logger.info(f"Indexed source text: {len(self.sections)} sections, {len(paragraph_lengths)} paragraphs")
+
+    def idf(self, term: str) -> float:
+        df = self.document_frequency.get(term, 0)
+        return math.log(1 + (self.unit_count - df + 0.5) / (df + 0.5))
+
+    def _bm25(self, query: Dict[str, float], terms: Counter, average_length: float) -> float:
+        length = sum(terms.values())
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1))
+        score = 0.0
+        for term, weight in query.items():
+            tf = terms.get(term, 0)
+            if tf:
+                score += weight * self.idf(term) * tf * (BM25_K1 + 1) / (tf + norm)
+        return score
+
+    def build_query(self, reference_text: str) -> Dict[str, float]:
+        """Weight the reference's terms by tf-idf against the source and keep the strongest ones."""
+        counts = Counter(t for t in tokenize(reference_text) if t in self.document_frequency)
+        weighted = {term: math.log(1 + tf) * self.idf(term) for term, tf in counts.items()}
+        strongest = sorted(weighted.items(), key=lambda item: item[1], reverse=True)[:MAX_QUERY_TERMS]
+        return {term: math.log(1 + counts[term]) for term, _ in strongest}
+
+    def score_sections(self, reference_text: str) -> List[float]:
+        query = self.build_query(reference_text)
+        scores = []
+        for section_terms, paragraphs in zip(self.section_terms, self.paragraph_terms):
+            best_paragraph = max((self._bm25(query, p, self.average_paragraph_length) for p in paragraphs), default=0.0)
+            scores.append(self._bm25(query, section_terms, self.average_section_length) + best_paragraph)
+        return scores
+
+    def top_sections(self, reference_text: str, k: int = 4) -> List[Section]:
+        """The k most relevant sections, returned in document order."""
+        if len(self.sections) <= k:
+            return list(self.sections)
+        scores = self.score_sections(reference_text)
+        ranked = sorted(range(len(self.sections)), key=lambda i: scores[i], reverse=True)[:k]
+        return [self.sections[i] for i in sorted(ranked)]
+
+    def render(self, sections: List[Section]) -> str:
+        """Excerpt of the source text with headings and paragraphs kept verbatim, so anchors still match."""
+        parts = []
+        previous = -1
+        for section in sections:
+            if previous >= 0 and section.position != previous + 1:
+                parts.append('[...]')
+            parts.append(section.render())
+            previous = section.position
+        return '\n\n'.join(parts)
+
+    def relevant_text(self, reference_text: str, k: int = 4) -> str:
+        return self.render(self.top_sections(reference_text, k))
@@ -0,0 +1,12 @@
+# paper_prepper/utils/url_utils.py
+
+from urllib.parse import urlparse
+
+
+def get_domain(url: str) -> str:
+    """Return the lower-cased host of a URL without a leading 'www.'."""
+    netloc = urlparse(url).netloc.lower()
+    if '@' in netloc:
+        netloc = netloc.rsplit('@', 1)[1]
+    netloc = netloc.split(':', 1)[0]
+    return netloc[4:] if netloc.startswith('www.') else netloc
@@ -37,6 +37,9 @@ setup(
     install_requires=[
         'aiohttp',
         'beautifulsoup4',
+        'lxml',
+        'numpy',
+        'scipy',
         'PyMuPDF',
         'playwright==1.36.0',
         'fake-useragent',